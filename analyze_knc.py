@@ -6,203 +6,188 @@ Analyze a KNC function and compute metrics.
 
 import sys
 import math
-import json
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from logger import get_time
+from logger import get_time, init_trace, span, add_count
+from graph_io import read_frequencies
+from freq_stats import get_size, get_mean, get_median, get_quantile, get_stdev
+from stage_cache import get_stage_key, start_stage, store_stage, restore_stage
+from results import get_result, add_results, get_first_class, export_csv
 from importlib import import_module
 
-def get_result(run_name, superclass, result):
-        """ Get the result value of a superclass """
-        df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-        return df.loc[superclass, result]
-
-def add_results(run_name, superclass, **results):
-    """ Append result columns in a superclass row """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    for resultname, result in results.items():
-        df.loc[superclass, resultname] = result
-    df.to_csv(f"out/_results_{run_name}.csv")
-
-def read_knc_list(superclass, onemode):
-    """ Read KNC plot values from csv file """
-    df = pd.read_csv(f"out/{superclass}/{superclass}.{onemode}.knc.csv")
-    return list(df.itertuples(index=False, name=None))
-
-def compute_rc(knc_list, n_max, k_max):
-    """ Compute representational consistency (AUC of KNC) based on connectivity measure """
-    density_sum = 0
-    if len(knc_list[0]) == 4: # Graph was build to compute connectivity measures
-        ncomponents_sum = 0
-        slcc_sum = 0
-        for k in tqdm(range(0, k_max)):
-            density_sum += knc_list[k][1]
-            ncomponents_sum += (n_max - knc_list[k][2]) / (n_max - 1)
-            slcc_sum += (knc_list[k][3] - 1) / (n_max - 1)
-        rc_density = (1 / k_max) * density_sum
-        rc_ncomponents = (1 / k_max) * ncomponents_sum
-        rc_slcc = (1 / k_max) * slcc_sum
-        print(f"[Info] rc_density {rc_density:.8f}")
-        print(f"[Info] rc_ncomponents {rc_ncomponents:.8f}")
-        print(f"[Info] rc_slcc {rc_slcc:.8f}")
-        return rc_density, rc_ncomponents, rc_slcc
-    elif len(knc_list[0]) == 2: # Weight distribution was used to compute density
-        for k in tqdm(range(0, k_max)):
-            density_sum += knc_list[k][1]
-        rc_density = (1 / k_max) * density_sum
-        print(f"[Info] rc_density {rc_density:.8f}")
-        return rc_density, None, None
-
-def compute_avg_dens(knc_list, k_max):
-    """ Compute the average density of a knc function with density connectivity measure """
-    density_sum = 0
-    for knc_step in knc_list:
-        density_sum += knc_step[1]
-    return density_sum / k_max
-
-def get_k_0(knc_list):
-    """ Return the k at which density becomes zero, Return 0 if density never becomes zero """
-    for knc_step in knc_list:
-        if knc_step[1] == 0:
-            return knc_step[0]
-    return math.inf
+def read_knc_curves(classnames, onemode):
+    """ Read the KNC plots of a batch of classes as arrays of one NaN padded row per class and one column per k """
+    dfs = [pd.read_csv(f"out/{classname}/{classname}.{onemode}.knc.csv") for classname in classnames]
+    k_len = max((len(df) for df in dfs), default=0)
+    measures = ["density", "ncomponents", "slcc", "density_low", "density_high"]
+    curves = {measure: np.full((len(dfs), k_len), np.nan) for measure in measures}
+    for i, df in enumerate(dfs):
+        for measure in curves:
+            # Plots computed from the weight distribution only have a density, estimated ones its confidence band
+            if measure in df:
+                curves[measure][i, :len(df)] = df[measure].to_numpy()
+    return curves
+
+def compute_knc_metrics(curves, n_max, k_max, fractions=(0.1, 0.5)):
+    """ Compute RC (AUC of KNC), mean and max density, k_0, knees and partial RCs of a batch of KNC plots at once """
+    ks = np.arange(1, curves["density"].shape[1] + 1)
+    n_max = n_max[:, None]
+    k_max = k_max[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"): # Single node graphs have no connectivity measures
+        measures = {
+            "dens": curves["density"],
+            "ncomp": (n_max - curves["ncomponents"]) / (n_max - 1),
+            "slcc": (curves["slcc"] - 1) / (n_max - 1),
+        }
+    metrics = {}
+    for name, values in measures.items():
+        # Sketched plots have components and LCC sizes from k = sketch_min_weight on
+        measured = ~np.isnan(values).all(axis=1)
+        metrics[f"rc_{name}"] = np.where(measured, get_partial_rc(values, ks, k_max), np.nan)
+        metrics[f"knee_{name}"] = np.where(measured, get_knee(values, ks, k_max), np.nan)
+    for fraction in fractions:
+        metrics[f"rc_dens_{int(fraction * 100)}"] = get_partial_rc(measures["dens"], ks, np.maximum(1, np.ceil(fraction * k_max)))
+    # Half widths of the confidence intervals of estimated plots
+    rc_bands = [get_partial_rc(curves[f"density_{bound}"], ks, k_max) for bound in ["low", "high"]]
+    metrics["rc_dens_ci"] = np.where(np.isnan(curves["density_low"][:, 0]), np.nan, (rc_bands[1] - rc_bands[0]) / 2)
+    metrics["dens_ci"] = (curves["density_high"][:, 0] - curves["density_low"][:, 0]) / 2
+    density = curves["density"]
+    metrics["mean_dens"] = np.nansum(density, axis=1) / k_max[:, 0]
+    metrics["max_dens"] = density[:, 0]
+    # k at which density becomes zero, inf if density never becomes zero
+    zero = density == 0
+    metrics["k_0"] = np.where(zero.any(axis=1), ks[zero.argmax(axis=1)], math.inf)
+    return metrics
+
+def get_first_index(values):
+    """ Get the index of the first measured point of each curve """
+    return np.argmax(~np.isnan(values), axis=1)[:, None]
+
+def get_partial_rc(values, ks, k_end):
+    """ Get the mean of each curve over k from its first measured k to its k_end """
+    k_first = ks[get_first_index(values)]
+    return np.nansum(np.where(ks <= k_end, values, 0), axis=1) / np.maximum(k_end - k_first + 1, 1)[:, 0]
+
+def get_knee(values, ks, k_max):
+    """ Get the k of each decreasing curve with the largest distance below the chord from its first to its last point """
+    in_range = (ks <= k_max) & ~np.isnan(values)
+    first_index = get_first_index(values)
+    first = np.take_along_axis(values, first_index, axis=1)
+    last = np.take_along_axis(values, np.maximum(first_index + in_range.sum(axis=1, keepdims=True) - 1, 0), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (ks - 1 - first_index) / (np.maximum(in_range.sum(axis=1, keepdims=True), 2) - 1)
+        y = (values - last) / (first - last)
+    distance = np.where(in_range, (1 - x) - np.nan_to_num(y), -np.inf)
+    return ks[distance.argmax(axis=1)]
 
 def get_rel_rc(run_name, superclass, rc_dens, onemode):
     """ Compute the representational consistency relative to its run superclass """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    if superclass == df.index[0]:
+    first_class = get_first_class(run_name)
+    if superclass == first_class:
         return None
     else:
         return None
         if onemode == "t":
-            rc_dens_super = df.iloc[0].rc_dens_t
+            rc_dens_super = get_result(run_name, first_class, "rc_t_dens")
         elif onemode == "b":
-            rc_dens_super = df.iloc[0].rc_dens_b
+            rc_dens_super = get_result(run_name, first_class, "rc_b_dens")
         return rc_dens / rc_dens_super
 
-def get_disc_nodes(run_name, classname, onemode):
+def read_tables(classname, onemode):
+    """ Read the k (degree), c (connectivity) and w (edgeweight) frequency tables of a onemode graph once """
+    tables = {disttype: read_frequencies(classname, onemode, disttype) for disttype in ["k", "c", "w"]}
+    w_values, w_counts = tables["w"]
+    edges = w_values > 0 # Node pairs without common neighbor are no edges
+    tables["w"] = (w_values[edges], w_counts[edges])
+    return tables
+
+def get_disc_nodes(run_name, classname, onemode, tables):
     """ Get number of disconnected nodes in the onemode projection based on degree dist """
-    nnodes = 0
     n_om = get_result(run_name, classname, f"n_{onemode}")
-    with open(f"out/{classname}/{classname}.{onemode}.k.json", "r") as in_file:
-        k_dist = json.load(in_file)
-    for degree, count in k_dist.items():
-        if int(degree) > 0:
-            nnodes += count
-    return n_om - nnodes
-
-def get_median(run_name, classname, disttype, onemode):
-    """ Get median of k (degree) or c (connectivity) distribution """
-    labels = []
-    with open(f"out/{classname}/{classname}.{onemode}.{disttype}.json", "r") as input_file:
-        dist = json.load(input_file)
-    for label, count in dist.items():
-        labels.extend([int(label)] * count)
-    return np.median(labels)
-
-def get_weight_median(run_name, classname, onemode):
-    """ Get median of w (edgeweight) distribution based on frequency table """
-    m_om = get_result(run_name, classname, f"m_{onemode}")
-    with open(f"out/{classname}/{classname}.{onemode}.w.json", "r") as input_file:
-        w_dist = json.load(input_file)
-    # Compute the 0.5 quantile
-    quantile = 0.5
-    quantilemargin = m_om * quantile
-    counter = 0
-    for weight, count in w_dist.items():
-        if int(weight) > 0:
-            counter += count
-            if counter >= quantilemargin:
-                return int(weight)
-    return None
-
-def get_stdev(run_name, classname, disttype, onemode):
-    """ Get standard deviation of k (degree) or c (connectivity) distribution """
-    labels = []
-    with open(f"out/{classname}/{classname}.{onemode}.{disttype}.json", "r") as input_file:
-        dist = json.load(input_file)
-    for label, count in dist.items():
-        labels.extend([int(label)] * count)
-    return np.std(labels)
-
-def analyze_knc(run_name, superclass):
-    """ Get metrics of knc curve for both onemodes and save them in results file """
-    n_t = int(get_result(run_name, superclass, "n_t"))
-    n_b = int(get_result(run_name, superclass, "n_b"))
-
-    knc_t = read_knc_list(superclass, "t")
-    rc_t_dens, rc_t_ncomp, rc_t_slcc = compute_rc(knc_t, n_t, n_b)
-    avg_dens_t = compute_avg_dens(knc_t, n_b)
-    max_dens_t = knc_t[0][1]
-    k_0_t = get_k_0(knc_t)
-    rel_rc_t = get_rel_rc(run_name, superclass, rc_t_dens, "t")
-    n_disc_t = get_disc_nodes(run_name, superclass, "t")
-    k_med_t = get_median(run_name, superclass, "k", "t")
-    c_med_t = get_median(run_name, superclass, "c", "t")
-    w_med_t = get_weight_median(run_name, superclass, "t")
-    k_sd_t = get_stdev(run_name, superclass, "k", "t")
-    c_sd_t = get_stdev(run_name, superclass, "c", "t")
-    # w_sd_t = ... # TODO: Compute mean/median/stdev based on frequency table
-
-    knc_b = read_knc_list(superclass, "b")
-    rc_b_dens, rc_b_ncomp, rc_b_slcc = compute_rc(knc_b, n_b, n_t)
-    avg_dens_b = compute_avg_dens(knc_b, n_t)
-    max_dens_b = knc_b[0][1]
-    k_0_b = get_k_0(knc_b)
-    rel_rc_b = get_rel_rc(run_name, superclass, rc_b_dens, "b")
-    n_disc_b = get_disc_nodes(run_name, superclass, "b")
-    k_med_b = get_median(run_name, superclass, "k", "b")
-    c_med_b = get_median(run_name, superclass, "c", "b")
-    w_med_b = get_weight_median(run_name, superclass, "b")
-    k_sd_b = get_stdev(run_name, superclass, "k", "b")
-    c_sd_b = get_stdev(run_name, superclass, "c", "b")
-    # w_sd_b = ... # TODO: Compute mean/median/stdev based on frequency table
-
-    add_results(run_name, superclass,
-                rc_t_dens=rc_t_dens, rc_t_ncomp=rc_t_ncomp, rc_t_slcc=rc_t_slcc,
-                avg_dens_t=avg_dens_t, max_dens_t=max_dens_t, k_0_t=k_0_t, rel_rc_t=rel_rc_t,
-                n_disc_t=n_disc_t, k_med_t=k_med_t, c_med_t=c_med_t, w_med_t=w_med_t, k_sd_t=k_sd_t, c_sd_t=c_sd_t,
-                rc_b_dens=rc_b_dens, rc_b_ncomp=rc_b_ncomp, rc_b_slcc=rc_b_slcc,
-                avg_dens_b=avg_dens_b, max_dens_b=max_dens_b, k_0_b=k_0_b, rel_rc_b=rel_rc_b,
-                n_disc_b=n_disc_b, k_med_b=k_med_b, c_med_b=c_med_b, w_med_b=w_med_b, k_sd_b=k_sd_b, c_sd_b=c_sd_b
-                )
+    return n_om - get_size(tables["k"][1])
+
+def analyze_knc(run_name, classnames):
+    """ Get metrics of the knc curves of a batch of classes for both onemodes and save them in results file """
+    n = {onemode: np.array([get_result(run_name, classname, f"n_{onemode}") for classname in classnames], dtype=float)
+         for onemode in "tb"}
+    metrics = {
+        "t": compute_knc_metrics(read_knc_curves(classnames, "t"), n["t"], n["b"]),
+        "b": compute_knc_metrics(read_knc_curves(classnames, "b"), n["b"], n["t"]),
+    }
+    for i, classname in enumerate(classnames):
+        results = {}
+        for onemode in "tb":
+            curve_metrics = {name: values[i] for name, values in metrics[onemode].items()}
+            print(f"[Info] {classname} {onemode} rc_density {curve_metrics['rc_dens']:.8f} "
+                  f"rc_ncomponents {curve_metrics['rc_ncomp']:.8f} rc_slcc {curve_metrics['rc_slcc']:.8f}")
+            tables = read_tables(classname, onemode)
+            results.update({
+                f"rc_{onemode}_dens": curve_metrics["rc_dens"],
+                f"rc_{onemode}_ncomp": curve_metrics["rc_ncomp"],
+                f"rc_{onemode}_slcc": curve_metrics["rc_slcc"],
+                f"avg_dens_{onemode}": curve_metrics["mean_dens"],
+                f"max_dens_{onemode}": curve_metrics["max_dens"],
+                f"k_0_{onemode}": curve_metrics["k_0"],
+                f"rel_rc_{onemode}": get_rel_rc(run_name, classname, curve_metrics["rc_dens"], onemode),
+                f"knee_dens_{onemode}": curve_metrics["knee_dens"],
+                f"knee_ncomp_{onemode}": curve_metrics["knee_ncomp"],
+                f"knee_slcc_{onemode}": curve_metrics["knee_slcc"],
+                f"rc_dens_10_{onemode}": curve_metrics["rc_dens_10"],
+                f"rc_dens_50_{onemode}": curve_metrics["rc_dens_50"],
+                f"rc_dens_ci_{onemode}": curve_metrics["rc_dens_ci"],
+                f"dens_ci_{onemode}": curve_metrics["dens_ci"],
+                f"n_disc_{onemode}": get_disc_nodes(run_name, classname, onemode, tables),
+                f"k_med_{onemode}": get_median(*tables["k"]),
+                f"c_med_{onemode}": get_median(*tables["c"]),
+                f"w_med_{onemode}": get_quantile(*tables["w"], 0.5, "inverted_cdf"), # Weights are discrete, so no interpolation
+                f"k_sd_{onemode}": get_stdev(*tables["k"]),
+                f"c_sd_{onemode}": get_stdev(*tables["c"]),
+                f"w_mean_{onemode}": get_mean(*tables["w"]),
+                f"w_sd_{onemode}": get_stdev(*tables["w"]),
+            })
+        add_results(run_name, classname, **results)
+
+def get_analyzable(run_name, classname):
+    """ Check whether the KNC plots and results that analyze_knc reads exist for a class """
+    try:
+        for onemode in "tb":
+            get_result(run_name, classname, f"n_{onemode}")
+            read_frequencies(classname, onemode, "k")
+            open(f"out/{classname}/{classname}.{onemode}.knc.csv").close()
+    except FileNotFoundError as e:
+        print(f"[Info] file not found {classname} graph is the null graph\n{e}")
+        return False
+    except KeyError as e:
+        print(f"[Info] key not found {classname} graph is the null graph\n{e}")
+        return False
+    return True
 
 @get_time
 def main():
     run_name = sys.argv[1][:-3]
     run = import_module(run_name)
+    init_trace(run_name)
 
-    for superclass in run.config["classes"]:
+    batch = [] # Classes that are not restored from the cache are analyzed together
+    for superclass in sys.argv[2:] or run.config["classes"]: # Optional classes to analyze, e.g. by orchestrate.py
         print("\n[Analyze knc]", superclass)
-        try:
-            analyze_knc(run_name, superclass)
-        except FileNotFoundError as e:
-            print(f"[Info] file not found {superclass} graph is the null graph\n{e}")
-        except KeyError as e:
-            print(f"[Info] key not found {superclass} graph is the null graph\n{e}")
-
-    res = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    res = res.rename(columns={
-        "k_t": "k_t_g", "k_b": "k_b_g",
-        "k_t_om": "k_mean_t", "k_b_om": "k_mean_b",
-        "c_t_om": "c_mean_t", "c_b_om": "c_mean_b",
-        "rc_t_dens": "rc_dens_t", "rc_b_dens": "rc_dens_b",
-        "rc_t_ncomp": "rc_ncomp_t", "rc_b_ncomp": "rc_ncomp_b",
-        "rc_t_slcc": "rc_slcc_t", "rc_b_slcc": "rc_slcc_b",
-        "avg_dens_t": "mean_dens_t", "avg_dens_b": "mean_dens_b",
-        "max_dens_t": "dens_t", "max_dens_b": "dens_b",
-        "n_disc_t": "ndisc_t", "n_disc_b": "ndisc_b",
-        })
-    cols = [ # Rearrange column order, Drop unwanted
-        'n_t', 'n_b', 'm_g', 'dens_g', 'k_t_g', 'k_b_g', 'ndisc_t', 'ndisc_b',
-        'm_t', 'dens_t', 'mean_dens_t', 'k_mean_t', 'k_med_t', 'k_sd_t', 'c_mean_t', 'c_med_t', 'c_sd_t','w_med_t',
-        'k_0_t', 'rc_dens_t', 'rc_ncomp_t', 'rc_slcc_t', 'rel_rc_t',
-        'm_b', 'dens_b', 'mean_dens_b', 'k_mean_b', 'k_med_b', 'k_sd_b', 'c_mean_b', 'c_med_b', 'c_sd_b','w_med_b',
-        'k_0_b', 'rc_dens_b', 'rc_ncomp_b', 'rc_slcc_b', 'rel_rc_b',
-        # 'superclass',
-        ]
-    res = res[cols]
-    res.to_csv(f"out/_results_{run_name}.csv")
-
-main()
+        key = None
+        if run.config.get("stage_cache", True):
+            # Relative metrics refer to the first class of the run
+            key = get_stage_key("analyze", superclass, run.config, [], ["analyze_knc.py", "graph_io.py", "freq_stats.py"],
+                                [("compute", superclass), ("compute", run.config["classes"][0])])
+        if restore_stage(run_name, "analyze", superclass, key):
+            continue
+        if get_analyzable(run_name, superclass):
+            batch.append((superclass, key, start_stage(superclass)))
+    if batch:
+        with span("analyze", stage="analyze"):
+            add_count(len(batch), "classes")
+            analyze_knc(run_name, [superclass for superclass, key, snapshot in batch])
+    for superclass, key, snapshot in batch:
+        store_stage("analyze", superclass, key, snapshot)
+
+    export_csv(run_name)
+
+if __name__ == "__main__":
+    main()
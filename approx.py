@@ -0,0 +1,82 @@
+"""
+Estimate the onemode distributions of a bipartite graph from sampled node pairs and sampled nodes instead of projecting it.
+
+The sample size follows from the DKW inequality, so the estimated fraction of node pairs with weight >= k (the KNC density)
+is within approx_error of the exact fraction for all k at once with probability approx_confidence.
+"""
+
+import math
+import numpy as np
+from statistics import NormalDist
+from results import get_result
+from sketch import get_pair_weights
+
+def get_sample_size(error, confidence):
+    """ Get the number of samples whose empirical CDF is within error of the true CDF everywhere at a confidence level """
+    return math.ceil(math.log(2 / (1 - confidence)) / (2 * error ** 2))
+
+def get_pair_count(n):
+    """ Get the number of node pairs of a onemode graph with n nodes """
+    return n * (n - 1) // 2
+
+def sample_pair_weights(rng, biadjmatrix, size, batch_size=2**16):
+    """ Get the onemode weights of uniformly sampled pairs of distinct row nodes of a binary CSR biadjacency matrix """
+    n = biadjmatrix.shape[0]
+    rows_a = rng.integers(n, size=size)
+    # Second node drawn from the n - 1 other nodes
+    rows_b = rng.integers(n - 1, size=size)
+    rows_b += rows_b >= rows_a
+    return get_pair_weights(biadjmatrix, rows_a, rows_b, batch_size)
+
+def sample_node_counts(rng, biadjmatrix, size, block_size=2**24):
+    """ Get the onemode degree and connectivity of row nodes sampled without replacement, Return the nodes too """
+    n = biadjmatrix.shape[0]
+    nodes = np.sort(rng.choice(n, size=min(size, n), replace=False))
+    biadjmatrix_t = biadjmatrix.T.tocsr()
+    batch_size = max(1, block_size // max(n, 1)) # Rows of the onemode weight matrix computed at once
+    degrees = []
+    connectivities = []
+    for start in range(0, len(nodes), batch_size):
+        rows = biadjmatrix[nodes[start:start + batch_size]]
+        wrows = (rows @ biadjmatrix_t).tocsr()
+        # The common neighbors of a node with itself are its own neighbors
+        self_weights = np.diff(rows.indptr)
+        degrees.append(np.diff(wrows.indptr) - (self_weights > 0))
+        connectivities.append(np.asarray(wrows.sum(axis=1)).ravel() - self_weights)
+    if not degrees:
+        return nodes, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return nodes, np.concatenate(degrees).astype(np.int64), np.concatenate(connectivities).astype(np.int64)
+
+def scale_counts(values, total):
+    """ Get the frequency table of a sample of values scaled to a population of total items, The counts sum to total """
+    values, counts = np.unique(values, return_counts=True)
+    if len(values) == 0:
+        return values.astype(np.int64), counts.astype(np.int64)
+    # Largest remainder rounding in exact integers, a count * total product can exceed int64
+    size = int(counts.sum())
+    quotients, remainders = zip(*(divmod(int(count) * int(total), size) for count in counts))
+    scaled = np.array(quotients, dtype=np.int64)
+    missing = int(total) - int(scaled.sum())
+    scaled[np.argsort(-np.array(remainders, dtype=np.float64), kind="stable")[:missing]] += 1
+    return values.astype(np.int64), scaled
+
+def get_mean_ci(values, population, confidence):
+    """ Get the half width of the normal confidence interval of the mean of a sample without replacement """
+    size = len(values)
+    if size < 2 or population <= 1:
+        return 0.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    correction = math.sqrt(max(0.0, (population - size) / (population - 1))) # Finite population
+    return float(z * np.std(values, ddof=1) / math.sqrt(size) * correction)
+
+def get_approx_results(onemode, approx_error=None, m_ci=None, k_mean_ci=None, c_mean_ci=None):
+    """ Get the result columns that mark an estimated onemode graph, Cleared (None) for an exact projection """
+    return {f"approx_{onemode}": approx_error, f"m_ci_{onemode}": m_ci,
+            f"k_mean_ci_{onemode}": k_mean_ci, f"c_mean_ci_{onemode}": c_mean_ci}
+
+def get_approx_error(run_name, classname, onemode):
+    """ Get the error bound of the estimated distributions of a onemode graph, None if it was projected exactly """
+    try:
+        return get_result(run_name, classname, f"approx_{onemode}")
+    except KeyError:
+        return None
@@ -0,0 +1,281 @@
+"""
+Benchmark all projection methods and KNC implementations on synthetic bipartite graphs of growing size.
+
+Each projection and KNC computation runs in a subprocess, its outputs are checked against the reference (first) method.
+
+out/BenchX/  generated bipartite graph X in the binary graph format
+out/_benchmark/<bench>/  run configs of the projection subprocesses and KNC points of each implementation
+out/_benchmark_<bench>.csv  time, CPU time, peak RSS and agreement of each graph, stage, method and onemode
+out/_logs/<bench>/<class>.<stage>.<method>.log  output of each subprocess
+
+python3 benchmark.py benchmark_config.py  with a benchmark config like run/benchmark_config.py
+"""
+
+#!/usr/bin/python3
+
+import os
+import sys
+import glob
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+from importlib import import_module
+from logger import get_time, init_trace, span, add_count, read_trace
+from graph_io import write_graph, graph_path, onemode_path, read_onemode_edgelist, read_frequencies
+from knc_stream import init_knc_stream, update_knc_stream, finish_knc_stream
+from compute_knc import compute_knc_onemode, get_density_curve
+
+def generate_graph(rng, model, n_t, n_b, m, exponent=1.5, communities=4, p_in=0.9):
+    """ Get the top and bot node codes of m distinct random edges of a bipartite graph model """
+    if m > n_t * n_b:
+        raise ValueError(f"A bipartite graph with {n_t} top and {n_b} bot nodes has less than {m} edges")
+    if model == "communities" and communities > n_b:
+        raise ValueError(f"{communities} communities need at least as many bot nodes")
+    if model == "powerlaw":
+        # Predicate popularity follows Zipf's law, like rdf:type and rdfs:label against rare properties
+        p_b = np.arange(1, n_b + 1, dtype=np.float64) ** -exponent
+        p_b /= p_b.sum()
+    keys = np.zeros(0, dtype=np.int64)
+    while len(keys) < m:
+        size = int(1.2 * (m - len(keys))) + 16
+        t_codes = rng.integers(n_t, size=size)
+        if model == "uniform":
+            b_codes = rng.integers(n_b, size=size)
+        elif model == "powerlaw":
+            b_codes = rng.choice(n_b, size=size, p=p_b)
+        elif model == "communities":
+            # Top node t is in community t % communities and links to bots of its own community with probability p_in
+            groups = t_codes % communities
+            group_sizes = (n_b - groups + communities - 1) // communities
+            b_in = groups + communities * (rng.random(size) * group_sizes).astype(np.int64)
+            b_codes = np.where(rng.random(size) < p_in, b_in, rng.integers(n_b, size=size))
+        else:
+            raise ValueError(f"Unknown graph model {model}")
+        # Keys not seen yet in order of appearance, so that m edges are kept without bias
+        new_keys = t_codes.astype(np.int64) * n_b + b_codes
+        new_keys, first = np.unique(new_keys, return_index=True)
+        new_keys = new_keys[np.argsort(first)]
+        keys = np.concatenate((keys, new_keys[~np.isin(new_keys, keys)]))
+    keys = keys[:m]
+    return keys // n_b, keys % n_b
+
+def write_bench_graph(classname, t_codes, b_codes):
+    """ Write a generated graph with the nodes without edges removed, Return its number of top and bot nodes """
+    os.makedirs(f"out/{classname}", exist_ok=True)
+    nodes_top, t_codes = np.unique(t_codes, return_inverse=True)
+    nodes_bot, b_codes = np.unique(b_codes, return_inverse=True)
+    write_graph(classname, t_codes, b_codes, [f"t{node}" for node in nodes_top], [f"b{node}" for node in nodes_bot])
+    return len(nodes_top), len(nodes_bot)
+
+def get_classname(model, n_t, n_b, m):
+    """ Get the class name of a generated graph """
+    return f"Bench{model.capitalize()}{n_t}x{n_b}x{m}"
+
+def write_bench_config(bench_name, project_method, classname, memory_limit):
+    """ Write the run config of a projection subprocess, Return its file name """
+    config = {
+        "classes": [classname],
+        "project_method": project_method,
+        "kg_source": "benchmark",
+        "kg_ontology": None,
+        "subject_limit": 0,
+        "predicate_limit": 0,
+        "incremental_projection": False,
+        "memory_limit": memory_limit,
+        "stage_cache": False,
+    }
+    os.makedirs(f"out/_benchmark/{bench_name}", exist_ok=True)
+    run_config = f"{bench_name}_{project_method}.py"
+    with open(f"out/_benchmark/{bench_name}/{run_config}", "w") as output_file:
+        output_file.write(f"config = {config!r}\n")
+    return run_config
+
+def remove_onemodes(classname):
+    """ Remove the onemode edgelists, distributions and KNC points of a class left by the last method """
+    for path in glob.glob(graph_path(classname, "[tb].*")):
+        os.remove(path)
+
+def run_subprocess(bench_name, args, run_name, session):
+    """ Run a script in a subprocess, Return its returncode, wall time, CPU time and peak RSS and the spans it traced """
+    env = dict(os.environ, TRACE_SESSION=session)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [f"out/_benchmark/{bench_name}", env.get("PYTHONPATH")]))
+    trace_path = f"out/_traces/{run_name}/{session}.jsonl"
+    if os.path.isfile(trace_path):
+        os.remove(trace_path)
+    os.makedirs(f"out/_logs/{bench_name}", exist_ok=True)
+    start = time.perf_counter()
+    with open(f"out/_logs/{bench_name}/{session}.log", "w") as log_file:
+        process = subprocess.Popen([sys.executable] + args, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+    # Resource usage of the subprocess and the workers it waited for, e.g. the pool of the hyper projection
+    pid, status, rusage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    spans = read_trace(trace_path) if os.path.isfile(trace_path) else []
+    return {
+        "returncode": returncode, "process_seconds": seconds, "cpu": rusage.ru_utime + rusage.ru_stime,
+        "max_rss": rusage.ru_maxrss / (1024 ** 2),
+    }, spans
+
+def get_stage_seconds(spans, stage):
+    """ Get the wall time of the outermost spans of a stage, without the start of the interpreter and the imports """
+    return sum(record["wall"] for record in spans
+               if record["name"] == stage and stage not in record["path"].split("/")[:-1])
+
+def read_projection(classname):
+    """ Read the onemode edgelists in canonical order and the distribution tables a projection wrote """
+    projection = {}
+    for onemode in "tb":
+        if os.path.isfile(onemode_path(classname, onemode)):
+            edgelist = np.array(read_onemode_edgelist(classname, onemode), dtype=np.int64)
+            edges = np.column_stack((edgelist[:, :2].min(axis=1), edgelist[:, :2].max(axis=1), edgelist[:, 2]))
+            projection[f"{onemode}.el"] = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+        for disttype in "wkc":
+            if os.path.isfile(graph_path(classname, f"{onemode}.{disttype}.npy")):
+                projection[f"{onemode}.{disttype}"] = np.vstack(read_frequencies(classname, onemode, disttype))
+    return projection
+
+def compare_outputs(reference, outputs):
+    """ Check whether the outputs present in both agree, None if there is nothing to compare """
+    shared = [name for name in outputs if name in reference]
+    if not shared:
+        return None
+    return all(reference[name].shape == outputs[name].shape and np.allclose(reference[name], outputs[name])
+               for name in shared)
+
+def knc_path(bench_name, classname, onemode, knc_method):
+    """ Get the path of the KNC points of an implementation """
+    return f"out/_benchmark/{bench_name}/{classname}.{onemode}.knc.{knc_method}.csv"
+
+def compute_bench_knc(bench_name, classname, onemode, knc_method, k_max):
+    """ Compute the KNC points of a projected onemode graph with an implementation of compute_knc.py or knc_stream.py """
+    with span("knc", stage="knc", classname=classname, onemode=onemode, method=knc_method):
+        if knc_method == "weights":
+            if os.path.isfile(graph_path(classname, f"{onemode}.w.npy")):
+                weights, counts = read_frequencies(classname, onemode, "w")
+                n = int(read_frequencies(classname, onemode, "k")[1].sum()) # Nodes of the onemode edgelist
+            else:
+                edgelist = read_onemode_edgelist(classname, onemode)
+                weights, counts = np.unique(edgelist[:, 2], return_counts=True)
+                n = len(np.unique(edgelist[:, :2]))
+            add_count(counts.sum(), "edges")
+            ks = np.arange(1, k_max + 1)
+            knc_list = pd.DataFrame({"k": ks, "density": get_density_curve(weights, counts, ks, 0.5 * n * (n - 1))})
+        else:
+            edgelist = np.array(read_onemode_edgelist(classname, onemode), dtype=np.int64)
+            add_count(len(edgelist), "edges")
+            if knc_method == "unionfind":
+                knc_list = compute_knc_onemode(edgelist, k_max)
+            elif knc_method == "stream":
+                n = int(edgelist[:, :2].max()) + 1 if len(edgelist) else 0
+                knc_stream = init_knc_stream(n)
+                for start in range(0, len(edgelist), 2**20):
+                    block = edgelist[start:start + 2**20]
+                    update_knc_stream(knc_stream, block[:, 0], block[:, 1], block[:, 2])
+                weight_counts = np.bincount(edgelist[:, 2], minlength=1)
+                degrees = np.bincount(edgelist[:, :2].ravel(), minlength=n)
+                knc_list = finish_knc_stream(knc_stream, weight_counts, degrees, k_max)
+            else:
+                raise ValueError(f"Unknown KNC method {knc_method}")
+            knc_list = pd.DataFrame(knc_list, columns=["k", "density", "ncomponents", "slcc"])
+    knc_list.to_csv(knc_path(bench_name, classname, onemode, knc_method), index=False)
+
+def compare_knc(reference, knc_list):
+    """ Check whether the KNC points of two implementations agree in the columns both computed """
+    columns = [column for column in knc_list.columns if column in reference.columns]
+    return len(reference) == len(knc_list) and np.allclose(reference[columns], knc_list[columns])
+
+@get_time
+def benchmark_graph(bench_name, config, graph, scale, rng):
+    """ Generate a graph at a scale, Run all projections and KNC implementations on it, Return a record of each run """
+    params = {key: value for key, value in graph.items() if key not in ["model", "n_t", "n_b", "m"]}
+    n_t, n_b, m = (int(graph[key] * scale) for key in ["n_t", "n_b", "m"])
+    classname = get_classname(graph["model"], n_t, n_b, m)
+    print(f"\n[Benchmark] {classname}")
+    t_codes, b_codes = generate_graph(rng, graph["model"], n_t, n_b, m, **params)
+    n_t, n_b = write_bench_graph(classname, t_codes, b_codes)
+    print(f"[Info] n_t {n_t}, n_b {n_b}, m_g {m}")
+    base = {"model": graph["model"], "scale": scale, "classname": classname, "n_t": n_t, "n_b": n_b, "m_g": m}
+
+    records = []
+    reference = None
+    for project_method in config["project_methods"]:
+        remove_onemodes(classname)
+        run_config = write_bench_config(bench_name, project_method, classname, config.get("memory_limit", 0))
+        usage, spans = run_subprocess(bench_name, ["project_graph.py", run_config, classname],
+                                      run_config[:-3], f"{classname}.project.{project_method}")
+        seconds = get_stage_seconds(spans, "project")
+        if usage["returncode"] == 0:
+            outputs = read_projection(classname)
+            agree = True if reference is None else compare_outputs(reference, outputs)
+        else:
+            outputs, agree = None, False
+        records.append({**base, "stage": "project", "method": project_method, "onemode": "",
+                        "seconds": seconds, **usage, "agree": agree})
+        print(f"[Info] project {project_method} {seconds:.3f} sec, max RAM in GB {usage['max_rss']:.6f}, agree {agree}")
+        if reference is None:
+            if outputs is None:
+                print(f"[Error] Reference projection {project_method} failed, see out/_logs/{bench_name}")
+                return records
+            reference = outputs
+            # KNC implementations run on the onemode graphs of the reference projection
+            records += benchmark_knc(bench_name, config, classname, base, {"t": n_b, "b": n_t})
+    return records
+
+def benchmark_knc(bench_name, config, classname, base, k_max):
+    """ Run all KNC implementations on both onemode graphs of a class, Return a record of each run """
+    records = []
+    for onemode in "tb":
+        reference = None
+        for knc_method in config["knc_methods"]:
+            usage, spans = run_subprocess(bench_name, ["benchmark.py", "knc", bench_name, classname, onemode,
+                                                       knc_method, str(k_max[onemode])],
+                                          bench_name, f"{classname}.{onemode}.knc.{knc_method}")
+            seconds = get_stage_seconds(spans, "knc")
+            agree = False
+            if usage["returncode"] == 0:
+                knc_list = pd.read_csv(knc_path(bench_name, classname, onemode, knc_method))
+                agree = True if reference is None else compare_knc(reference, knc_list)
+                reference = knc_list if reference is None else reference
+            records.append({**base, "stage": "knc", "method": knc_method, "onemode": onemode,
+                            "seconds": seconds, **usage, "agree": agree})
+            print(f"[Info] knc {onemode} {knc_method} {seconds:.3f} sec, max RAM in GB {usage['max_rss']:.6f}, agree {agree}")
+    return records
+
+def print_curves(df):
+    """ Print time and peak RSS of each method over the graph sizes and the fastest method of each size """
+    for (model, stage), group in df.groupby(["model", "stage"], sort=False):
+        print(f"\n[Curve] {model} {stage}")
+        curves = group.groupby(["method", "m_g"], sort=False).agg(seconds=("seconds", "sum"), max_rss=("max_rss", "max"))
+        print(curves.unstack("m_g").to_string(float_format=lambda value: f"{value:.3f}"))
+        fastest = curves["seconds"].unstack("method").idxmin(axis=1)
+        print("[Info] fastest " + ", ".join(f"m_g {m_g}: {method}" for m_g, method in fastest.items()))
+    disagree = df[df["agree"] == False]
+    if len(disagree):
+        print(f"\n[Error] {len(disagree)} runs disagree with the reference or failed")
+        print(disagree[["classname", "stage", "method", "onemode", "returncode"]].to_string(index=False))
+
+@get_time
+def main():
+    bench_name = sys.argv[1][:-3]
+    bench = import_module(bench_name)
+    init_trace(bench_name)
+    rng = np.random.default_rng(bench.config.get("seed", 0))
+    records = []
+    for graph in bench.config["graphs"]:
+        for scale in bench.config.get("scales", [1]):
+            records += benchmark_graph(bench_name, bench.config, graph, scale, rng)
+    df = pd.DataFrame(records)
+    df.to_csv(f"out/_benchmark_{bench_name}.csv", index=False)
+    print_curves(df)
+    if (df["agree"] == False).any():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 7 and sys.argv[1] == "knc": # KNC subprocess of a benchmark
+        init_trace(sys.argv[2])
+        compute_bench_knc(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], int(sys.argv[6]))
+    elif len(sys.argv) == 2:
+        main()
+    else:
+        sys.exit("[Info] Please specify a benchmark config file as argument")
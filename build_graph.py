@@ -10,42 +10,46 @@ Build a bipartite graph from an n-triples Knowledge Graph representation.
 
 import os
 import sys
-import time
+import multiprocessing as mp
 from tqdm import tqdm
-from hdt import HDTDocument
-from logger import get_time
-from rdflib import Graph, RDFS
+from hdt import HDTDocument, IdentifierPosition
+from logger import get_time, init_trace, span, add_count
+from graph_io import read_graph, write_graph, write_graph_edgelist, write_types, has_types, read_types
+from graph_io import write_parent, remove_parent
+from stage_cache import get_stage_key, start_stage, store_stage, restore_stage
+from results import add_results, export_csv
+from ontology import get_subclass_closure, dbo
 from importlib import import_module
-import pandas as pd
-import networkx as nx
+from scipy import sparse
+from scipy.sparse import csgraph
+import numpy as np
 
 rdf = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
-dbo = "http://dbpedia.org/ontology/"
 dbr = "http://dbpedia.org/resource/"
+wd = "http://www.wikidata.org/entity/"
+wdt = "http://www.wikidata.org/prop/direct/"
+
+wikidata_source = "kg/wikidata-20170313-all-BETA.hdt"
+wd_classes = {
+    "BoxerWikidata" : "Q11338576",
+    "CyclistWikidata": "Q2309784",
+    "CapitalWikidata" : "Q5119",
+    "CountryWikidata" : "Q6256",
+    "MetroAreaWikidata" : "Q1907114",
+    "GeographicRegionWikidata" : "Q82794",
+    "FilmFestivalWikidata" : "Q220505",
+}
+
+hdt_docs = {} # HDT document opened by each extraction worker
 
 # DBpedia classes: http://mappings.dbpedia.org/server/ontology/classes/
 
 @get_time
 def query_subclasses(superclass):
     """ Query ontology for subclass rdfs-entailment """
-    # Option 1: Sequential querying with pyHDT
-    # Option 2: Mappings from dataset.join()
-    # Option 3: https://github.com/comunica/comunica-actor-init-sparql-hdt
-    subclass_query = f"""
-    SELECT ?subclass
-    WHERE 
-    {{
-        ?subclass <{str(RDFS['subClassOf'])}>* <{dbo + superclass}> .
-    }}
-    """
-    subclasses = []
-    t_ontology = time.time()
-    ontology = Graph().parse(run.config["kg_ontology"])
-    print(f"\n[Time] load-ontology {time.time() - t_ontology:.3f} sec")
-    results = ontology.query(subclass_query)
-    for result in results:
-        subclasses.append(str(result['subclass']))
-    return subclasses
+    # Equivalent to SELECT ?subclass WHERE { ?subclass rdfs:subClassOf* <superclass> }
+    subclass_closure = get_subclass_closure(run.config["kg_ontology"])
+    return subclass_closure.get(dbo + superclass, [dbo + superclass])
 
 @get_time
 def extract_dbpedia(superclass):
@@ -79,19 +83,117 @@ def extract_dbpedia(superclass):
             #     edgelist.append((triple[0], triple[1]))
     return list(set(edgelist)) # Exclude duplicate entity-property relations
 
+@get_time
+def extract_dbpedia_ids(superclass):
+    """ Get edges for superclass and all its subclasses as HDT dictionary ids, Decode only the node labels of the graph """
+    subclasses = query_subclasses(superclass)
+    doc, edges, memberships = extract_ids(run.config["kg_source"], rdf + "type", subclasses,
+                                          run.config["subject_limit"], run.config["predicate_limit"])
+    subjects = write_graph_ids(doc, superclass, edges)
+    write_types_ids(superclass, subjects, memberships, subclasses)
+
+@get_time
+def extract_ids(kg_source, type_predicate, classes, subject_limit=0, predicate_limit=0, shards_per_core=4):
+    """ Get the (subject id, predicate id) edges and the (instance id, class index) memberships of all instances of classes """
+    doc = HDTDocument(kg_source)
+    type_id = doc.convert_term(type_predicate, IdentifierPosition.Predicate)
+    blacklist_ids = get_term_ids(doc, blacklist, IdentifierPosition.Predicate)
+    instance_ids = [np.zeros(0, dtype=np.int64)]
+    class_codes = [np.zeros(0, dtype=np.int32)]
+    print("[Info] query instance ids for each subclass")
+    for class_code, subclass in enumerate(tqdm(classes)):
+        subclass_id = doc.convert_term(subclass, IdentifierPosition.Object)
+        if subclass_id == 0: # Subclass without instances in the dataset
+            continue
+        (triples, count) = doc.search_triples_ids(0, type_id, subclass_id, limit=max(subject_limit, 0))
+        instance_ids.append(np.fromiter((triple[0] for triple in triples), dtype=np.int64))
+        class_codes.append(np.full(len(instance_ids[-1]), class_code, dtype=np.int32))
+    memberships = (np.concatenate(instance_ids), np.concatenate(class_codes))
+    instances = np.unique(memberships[0])
+    ncores = os.cpu_count()
+    nshards = max(1, min(ncores * shards_per_core, len(instances)))
+    # Subjects are sharded by id, so the edges of different shards never overlap
+    shard_args = [(instances[instances % nshards == shard], blacklist_ids, predicate_limit) for shard in range(nshards)]
+    print(f"[Info] Start {ncores} processes with {nshards} shards of {len(instances)} instances")
+    with mp.Pool(initializer=open_hdt, initargs=(kg_source,)) as pool:
+        # Idle workers pull the next shard, so all cores stay busy until the last shards
+        shard_edges = list(tqdm(pool.imap_unordered(extract_shard_star, shard_args), total=nshards))
+    add_count(sum(len(edges) for edges in shard_edges), "edges")
+    return doc, np.concatenate(shard_edges), memberships
+
+def open_hdt(kg_source):
+    """ Open an own HDT document in an extraction worker process """
+    hdt_docs["doc"] = HDTDocument(kg_source)
+
+def extract_shard_star(args):
+    """ Unpack arguments for extract_shard """
+    return extract_shard(*args)
+
+def extract_shard(subjects, blacklist_ids, predicate_limit):
+    """ Get the deduplicated (subject id, predicate id) edges of a shard of instances """
+    doc = hdt_docs["doc"]
+    subject_ids = [np.zeros(0, dtype=np.int64)]
+    predicate_ids = [np.zeros(0, dtype=np.int64)]
+    for subject in subjects.tolist():
+        (triples, count) = doc.search_triples_ids(subject, 0, 0, limit=max(predicate_limit, 0))
+        predicates = np.fromiter((triple[1] for triple in triples), dtype=np.int64)
+        predicates = predicates[~np.isin(predicates, blacklist_ids)]
+        subject_ids.append(np.full(len(predicates), subject, dtype=np.int64))
+        predicate_ids.append(predicates)
+    edges = np.stack((np.concatenate(subject_ids), np.concatenate(predicate_ids)), axis=1)
+    return np.unique(edges, axis=0) # Exclude duplicate entity-property relations
+
+def get_term_ids(doc, terms, position):
+    """ Convert terms to HDT dictionary ids at a triple position, Skip terms missing in the dictionary """
+    ids = (doc.convert_term(term, position) for term in terms)
+    return np.array([term_id for term_id in ids if term_id > 0], dtype=np.int64)
+
+def write_graph_ids(doc, classname, edges):
+    """ Write a bipartite graph of unique (subject id, predicate id) edges with node codes, Decode the labels of its nodes once """
+    subjects, t_codes = np.unique(edges[:, 0], return_inverse=True)
+    predicates, b_codes = np.unique(edges[:, 1], return_inverse=True)
+    nodes_top = [doc.convert_id(int(subject), IdentifierPosition.Subject) for subject in subjects]
+    nodes_bot = [doc.convert_id(int(predicate), IdentifierPosition.Predicate) for predicate in predicates]
+    write_graph(classname, t_codes.ravel(), b_codes.ravel(), nodes_top, nodes_bot)
+    return subjects
+
+def write_types_ids(classname, subjects, memberships, types):
+    """ Write the rdf:type memberships of the top nodes of a graph built from sorted HDT subject ids """
+    instance_ids, type_codes = memberships
+    t_codes = np.searchsorted(subjects, instance_ids)
+    # Instances without any predicate left after the blacklist are not part of the graph
+    found = t_codes < len(subjects)
+    found[found] = subjects[t_codes[found]] == instance_ids[found]
+    write_types(classname, t_codes[found], type_codes[found], types)
+
+def get_built_parent(classname, built):
+    """ Get the latest class built in this run whose rdf:type memberships cover classname """
+    for parent in reversed(built):
+        if has_types(parent) and dbo + classname in query_subclasses(parent):
+            return parent
+    return None
+
+@get_time
+def derive_graph(classname, parent):
+    """ Get the graph of a subclass by filtering the graph of its superclass on the rdf:type memberships of its instances """
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph(parent)
+    member_t, member_types, types = read_types(parent)
+    subclass_types = np.isin(np.array(types), query_subclasses(classname))
+    instances = np.zeros(len(nodes_top), dtype=bool)
+    instances[member_t[subclass_types[member_types]]] = True
+    edges = instances[t_codes]
+    # Sorted superclass codes keep the node order of a direct extraction
+    t_map, sub_t_codes = np.unique(t_codes[edges], return_inverse=True)
+    b_map, sub_b_codes = np.unique(b_codes[edges], return_inverse=True)
+    write_graph(classname, sub_t_codes.ravel(), sub_b_codes.ravel(),
+                [nodes_top[t] for t in t_map.tolist()], [nodes_bot[b] for b in b_map.tolist()])
+    members = instances[member_t]
+    write_types(classname, np.searchsorted(t_map, member_t[members]), member_types[members], types)
+    write_parent(classname, parent, t_map, b_map)
+    print(f"[Info] Derive {classname} from {parent} graph")
+
 def extract_wikidata(classname, typeproperty):
-    doc = HDTDocument("kg/wikidata-20170313-all-BETA.hdt")
-    wd = "http://www.wikidata.org/entity/"
-    wdt = "http://www.wikidata.org/prop/direct/"
-    wd_classes = {
-        "BoxerWikidata" : "Q11338576",
-        "CyclistWikidata": "Q2309784",
-        "CapitalWikidata" : "Q5119",
-        "CountryWikidata" : "Q6256",
-        "MetroAreaWikidata" : "Q1907114",
-        "GeographicRegionWikidata" : "Q82794",
-        "FilmFestivalWikidata" : "Q220505",
-    }
+    doc = HDTDocument(wikidata_source)
     edgelist = []
     instances = set()
     (triples, count) = doc.search_triples("", f"{wdt}{typeproperty}", f"{wd}{wd_classes[classname]}")
@@ -107,95 +209,99 @@ def extract_wikidata(classname, typeproperty):
 
     return list(set(edgelist)) # Exclude duplicate entity-property relations
 
-def write_edgelist(classname, edgelist):
-    """ Write edgelist to csv file """
-    df = pd.DataFrame(edgelist, columns=["t", "b"])
-    df.to_csv(f"out/{classname}/{classname}.g.csv", index=False)
-
-def write_integer_edgelist(classname, edgelist):
-    """ Write edgelist to csv file with node labels converted to unique integers """
-    df = pd.DataFrame(edgelist, columns=["t", "b"])
-    df["t"] = pd.Categorical(df["t"])
-    df["b"] = pd.Categorical(df["b"])
-    b_offset = df["t"].nunique()
-    df["t"] = df["t"].cat.codes
-    df["b"] = df["b"].cat.codes + b_offset
-    df.to_csv(f"out/{classname}/{classname}.i.csv", index=False)
-
-def check_connected(bigraph):
-    """ Check whether input graph is connected and throw NetworkXPointlessConcept if null graph """
-    print("[Info] Graph connected", nx.is_connected(bigraph))
-
-def check_bipartite(bigraph):
-    """ Check whether input graph is bipartite """
-    if not nx.bipartite.is_bipartite(bigraph):
-        sys.exit("[Error] Input graph is not bipartite")
+@get_time
+def extract_wikidata_ids(classname, typeproperty):
+    """ Get edges for a Wikidata class as HDT dictionary ids, Decode only the node labels of the graph """
+    doc, edges, memberships = extract_ids(wikidata_source, f"{wdt}{typeproperty}", [f"{wd}{wd_classes[classname]}"])
+    write_graph_ids(doc, classname, edges)
+
+def check_connected(t_codes, b_codes, n_t, n_b):
+    """ Check whether input graph is connected """
+    adjmatrix = sparse.coo_matrix((np.ones(len(t_codes), dtype=np.int8), (t_codes, n_t + np.asarray(b_codes))),
+                                  shape=(n_t + n_b, n_t + n_b))
+    ncomponents, _ = csgraph.connected_components(adjmatrix, directed=False)
+    print("[Info] Graph connected", ncomponents == 1)
 
-def split_edgelist(edges):
-    """ Split the input edgelist into top (t) and bottom (b) nodes """
-    nodes_top = []
-    nodes_bot = []
-    for edge in edges:
-        nodes_top.append(edge[0])
-        nodes_bot.append(edge[1])
-    nodes_top = list(set(nodes_top))
-    nodes_bot = list(set(nodes_bot))
-    return nodes_top, nodes_bot
-
-def add_results(run_name, superclass, **results):
-    """ Append result columns in a superclass row """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    for resultname, result in results.items():
-        df.at[superclass, resultname] = result
-    df.to_csv(f"out/_results_{run_name}.csv")
+def check_bipartite(nodes_top, nodes_bot):
+    """ Check whether input graph is bipartite, i.e. no node label is both a top and a bottom node """
+    if not set(nodes_top).isdisjoint(nodes_bot):
+        sys.exit("[Error] Input graph is not bipartite")
 
 if __name__ == "__main__":
     run_name = sys.argv[1][:-3]
     run = import_module(run_name)
+    init_trace(run_name)
 
     with open("blacklist.txt", "r") as file:
         blacklist = file.read().splitlines()
     with open("whitelist-boxer.txt", "r") as file:
         whitelist = file.read().splitlines()
-    if not os.path.exists(f"out/_results_{run_name}.csv"):
-        df = pd.DataFrame(columns=["n_t"])
-        df.to_csv(f"out/_results_{run_name}.csv")
 
+    selected = sys.argv[2:] # Optional classes to build, e.g. by orchestrate.py
+    built = [] # Classes of this run with recorded rdf:type memberships
     for superclass in run.config["classes"]:
-        print("\n[Build] ", superclass)
-        if not os.path.exists(f"./out/{superclass}"):
-                os.mkdir(f"./out/{superclass}")
-
-        if superclass == "Mixed":
-            df = pd.read_csv(f"out/{superclass}/{superclass}.g.csv")
-            edgelist = list(df.itertuples(index=False, name=None))
-
-        elif run.config["kg_source"] == "kg/wikidata-20170313-all-BETA.hdt":
-            # "instance_of" :  "P31"
-            # "occupation" : "P106"
-            edgelist = extract_wikidata(superclass, "P31")
-            write_edgelist(superclass, edgelist)
-
-        elif run.config["kg_source"] == "kg/dbpedia2016-04en.hdt":
-            edgelist = extract_dbpedia(superclass)
-            write_edgelist(superclass, edgelist)
-
-        try:
-            bigraph = nx.Graph()
-            bigraph.add_edges_from(edgelist)
-            check_connected(bigraph)
-            check_bipartite(bigraph)
-            nodes_top, nodes_bot = split_edgelist(edgelist)
-            n_t, n_b = len(nodes_top), len(nodes_bot)
-            m_g = len(edgelist)
+        if selected and superclass not in selected:
+            if has_types(superclass): # Built by an earlier invocation
+                built.append(superclass)
+            continue
+        with span("build", stage="build", classname=superclass):
+            print("\n[Build] ", superclass)
+            if not os.path.exists(f"./out/{superclass}"):
+                    os.mkdir(f"./out/{superclass}")
+
+            key = None
+            if run.config.get("stage_cache", True) and superclass != "Mixed":
+                key = get_stage_key("build", superclass, run.config,
+                                    ["kg_source", "kg_ontology", "subject_limit", "predicate_limit", "extract_method"],
+                                    [run.config["kg_source"], run.config.get("kg_ontology"), "blacklist.txt",
+                                     "build_graph.py", "ontology.py", "graph_io.py"])
+            if restore_stage(run_name, "build", superclass, key):
+                if has_types(superclass):
+                    built.append(superclass)
+                continue
+            snapshot = start_stage(superclass)
+
+            if superclass == "Mixed":
+                pass # Mixed graph is built beforehand
+
+            elif run.config["kg_source"] == wikidata_source:
+                # "instance_of" :  "P31"
+                # "occupation" : "P106"
+                if run.config.get("extract_method", "ids") == "ids":
+                    extract_wikidata_ids(superclass, "P31")
+                else:
+                    edgelist = extract_wikidata(superclass, "P31")
+                    write_graph_edgelist(superclass, edgelist)
+
+            elif run.config["kg_source"] == "kg/dbpedia2016-04en.hdt":
+                # Subclasses listed after their superclass are filtered from its graph without querying HDT again
+                parent = get_built_parent(superclass, built) if run.config["subject_limit"] <= 0 else None
+                remove_parent(superclass)
+                if parent is not None:
+                    derive_graph(superclass, parent)
+                    built.append(superclass)
+                elif run.config.get("extract_method", "ids") == "ids":
+                    extract_dbpedia_ids(superclass)
+                    built.append(superclass)
+                else:
+                    edgelist = extract_dbpedia(superclass)
+                    write_graph_edgelist(superclass, edgelist)
+
+            t_codes, b_codes, nodes_top, nodes_bot = read_graph(superclass)
+            n_t, n_b, m_g = len(nodes_top), len(nodes_bot), len(t_codes)
+            if m_g == 0:
+                print(f"[Info] {superclass} graph is the null graph")
+                continue
+            check_connected(t_codes, b_codes, n_t, n_b)
+            check_bipartite(nodes_top, nodes_bot)
             dens_g = m_g / (n_t * n_b)
             k_t_g = m_g / n_t
             k_b_g = m_g / n_b
-            print(f"[Info] n_t {n_t}, n_b {n_b}, m_g {len(edgelist)}")
+            print(f"[Info] n_t {n_t}, n_b {n_b}, m_g {m_g}")
             # In onemode network edgelists, information about disconnected nodes gets lost
             add_results(run_name, superclass,
                         n_t=n_t, n_b=n_b,
                         m_g=m_g, dens_g=dens_g,
                         k_t_g=k_t_g, k_b_g=k_b_g)
-        except nx.NetworkXPointlessConcept as e:
-            print(f"[Info] {superclass} graph is the null graph\n{e}")
+            store_stage("build", superclass, key, snapshot)
+    export_csv(run_name)
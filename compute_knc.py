@@ -7,22 +7,23 @@ Compute points for a KNC plot.
 import os
 import sys
 import time
-import json
+import shutil
 from scipy import sparse
 from importlib import import_module
-from logger import get_time, get_ram
+from logger import get_time, get_ram, init_trace, span, annotate, add_count
+from graph_io import onemode_path, read_onemode_edgelist, read_frequencies, read_biadjacency
+from knc_stream import get_density
+from stage_cache import get_stage_key, start_stage, store_stage, restore_stage
+from results import get_result, export_csv
+from approx import get_approx_error
+from sketch import get_sketch_edges
+import numpy as np
 import pandas as pd
-import networkx as nx
 from tqdm import tqdm
 
-def get_result(run_name, superclass, result):
-    """ Get the result value of a superclass """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    return df.loc[superclass, result]
-
 def is_buildable(classname, onemode):
     """ Check if onemode edgelist file exists and a networkx graph of it can be loaded into main memory """
-    edgelist_file = f"out/{classname}/{classname}.{onemode}.csv"
+    edgelist_file = onemode_path(classname, onemode)
     nx_max_size = 3
     if os.path.isfile(edgelist_file):
         filesize = os.path.getsize(edgelist_file) / (1000 ** 3)
@@ -33,30 +34,47 @@ def is_buildable(classname, onemode):
     else:
         return False
 
-def compute_knc(run_name, superclass, project_method):
+def has_knc_stream(classname, onemode):
+    """ Check if the KNC plot points were already computed while streaming the projection """
+    return os.path.isfile(f"out/{classname}/{classname}.{onemode}.knc.stream.csv")
+
+def copy_knc_stream(classname, onemode):
+    """ Use the KNC plot points computed while streaming the projection """
+    print(f"[Info] use knc plot of streamed projection for {classname} {onemode}")
+    shutil.copyfile(f"out/{classname}/{classname}.{onemode}.knc.stream.csv",
+                    f"out/{classname}/{classname}.{onemode}.knc.csv")
+
+def compute_knc(run_name, superclass, project_method, sketch_min_weight=0, sketch_bands=64, sketch_rows=2):
     """ Compute points for a KNC plot and save them together in .k.csv """
     if is_buildable(superclass, "t"):
         n_b = int(get_result(run_name, superclass, "n_b"))
-        omgraph_t = load_onemode_graph(superclass, "t", project_method)
-        knc_t = compute_knc_onemode(omgraph_t, n_b)
+        edgelist_t = load_onemode_edgelist(superclass, "t", project_method)
+        add_count(len(edgelist_t), "edges")
+        knc_t = compute_knc_onemode(edgelist_t, n_b)
         write_knc(superclass, knc_t, "t")
+    elif has_knc_stream(superclass, "t"):
+        copy_knc_stream(superclass, "t")
     else:
         compute_knc_onemode_weights(run_name, superclass, "t")
+        if sketch_min_weight:
+            compute_knc_onemode_sketch(superclass, "t", sketch_min_weight, sketch_bands, sketch_rows)
 
     if is_buildable(superclass, "b"):
         n_t = int(get_result(run_name, superclass, "n_t"))
-        omgraph_b = load_onemode_graph(superclass, "b", project_method)
-        knc_b = compute_knc_onemode(omgraph_b, n_t)
+        edgelist_b = load_onemode_edgelist(superclass, "b", project_method)
+        add_count(len(edgelist_b), "edges")
+        knc_b = compute_knc_onemode(edgelist_b, n_t)
         write_knc(superclass, knc_b, "b")
+    elif has_knc_stream(superclass, "b"):
+        copy_knc_stream(superclass, "b")
     else:
         compute_knc_onemode_weights(run_name, superclass, "b")
+        if sketch_min_weight:
+            compute_knc_onemode_sketch(superclass, "b", sketch_min_weight, sketch_bands, sketch_rows)
 
 @get_time
 def compute_knc_onemode_weights(run_name, superclass, onemode):
     """ Compute KNC plot based on weight distribution and max edges formula """
-    knc = []
-    weight_dist = {}
-    n_edges = 0
     if onemode == "t":
         n_max = int(get_result(run_name, superclass, f"n_t"))
         k_max = int(get_result(run_name, superclass, f"n_b"))
@@ -64,25 +82,53 @@ def compute_knc_onemode_weights(run_name, superclass, onemode):
         n_max = int(get_result(run_name, superclass, f"n_b"))
         k_max = int(get_result(run_name, superclass, f"n_t"))
     edges_max = 0.5 * n_max * (n_max - 1)
-    with open(f"out/{superclass}/{superclass}.{onemode}.w.json", "r") as input_file:
-        weight_dist = json.load(input_file)
-    for key, value in weight_dist.items():
-        if int(key) > 0:
-            n_edges += value
+    ks = np.arange(1, k_max + 1)
+    weights, counts = read_weight_distribution(superclass, onemode)
     print(f"[Info] compute knc density plot based on w-dist for {superclass} {onemode}")
-    for k in tqdm(range(1, k_max + 1)):
-        edges_miss = 0
-        for key, value in weight_dist.items():
-            if int(key) > 0 and int(key) < k:
-                edges_miss += value
-        density = (n_edges - edges_miss) / edges_max
-        knc.append((k, density))
-    df = pd.DataFrame(knc, columns=["k", "density"])
+    density = get_density_curve(weights, counts, ks, edges_max)
+    df = pd.DataFrame({"k": ks, "density": density})
+    approx_error = get_approx_error(run_name, superclass, onemode)
+    if approx_error is not None:
+        # Estimated density of all k is within the error bound at the confidence of the sample
+        df["density_low"] = np.clip(density - approx_error, 0, 1)
+        df["density_high"] = np.clip(density + approx_error, 0, 1)
+    df.to_csv(f"out/{superclass}/{superclass}.{onemode}.knc.csv", index=False)
+
+@get_time
+def compute_knc_onemode_sketch(superclass, onemode, min_weight, bands, rows):
+    """ Add components and LCC size for k >= min_weight to a KNC plot of the weight distribution from edges found by LSH """
+    biadjmatrix, _, _ = read_biadjacency(superclass)
+    if onemode == "b":
+        biadjmatrix = biadjmatrix.T.tocsr()
+    annotate(onemode=onemode)
+    edgelist, candidates = get_sketch_edges(biadjmatrix, min_weight, bands, rows)
+    add_count(candidates, "pairs")
+    print(f"[Info] sketch {onemode} {candidates} candidate pairs, {len(edgelist)} with weight >= {min_weight}")
+    df = pd.read_csv(f"out/{superclass}/{superclass}.{onemode}.knc.csv")
+    knc = pd.DataFrame(compute_knc_onemode(edgelist, len(df)), columns=["k", "density", "ncomponents", "slcc"])
+    # Nodes of the onemode graph without a found edge are components of their own
+    n = int(read_frequencies(superclass, onemode, "k")[1].sum())
+    singletons = n - len(np.unique(edgelist[:, :2]))
+    high = df["k"] >= min_weight
+    df["ncomponents"] = np.where(high, knc["ncomponents"] + singletons, np.nan)
+    df["slcc"] = np.where(high, np.maximum(knc["slcc"], min(n, 1)), np.nan)
     df.to_csv(f"out/{superclass}/{superclass}.{onemode}.knc.csv", index=False)
 
+def read_weight_distribution(superclass, onemode):
+    """ Read the weight distribution of a onemode graph as arrays of weights and counts sorted by weight """
+    return read_frequencies(superclass, onemode, "w")
+
+def get_density_curve(weights, counts, ks, edges_max):
+    """ Get the density of a onemode graph at each threshold in ks from its sorted weight distribution """
+    edges = weights > 0
+    weights = weights[edges]
+    # Number of edges with weight >= weights[i] as suffix sums of the counts, 0 behind the largest weight
+    edges_from = np.concatenate((np.cumsum(counts[edges][::-1])[::-1], [0]))
+    return edges_from[np.searchsorted(weights, ks, side="left")] / edges_max
+
 @get_time
-def load_onemode_graph(superclass, onemode, project_method):
-    """ Load the onemode superclass graph from .onemode.csv """
+def load_onemode_edgelist(superclass, onemode, project_method):
+    """ Load the weighted onemode superclass edgelist as (node_a, node_b, w) rows from .onemode.el.bin """
     if project_method == "dot":
         t_start = time.time()
         wmatrix = sparse.load_npz(f"out/{superclass}.{onemode}.npz")
@@ -97,36 +143,54 @@ def load_onemode_graph(superclass, onemode, project_method):
         print(f"[Info] wmatrix {onemode} shape {wmatrix.shape}")
         print(f"[Info] wmatrix {onemode} maxelement {wmatrix.max()}")
         t_start = time.time()
-        omgraph = nx.from_scipy_sparse_matrix(wmatrix)
+        wmatrix = wmatrix.tocoo()
+        edgelist = np.column_stack((wmatrix.row, wmatrix.col, wmatrix.data))
         print(f"[Time] from-sparse {onemode} {time.time() - t_start:.3f} sec")
     else:
-        omgraph = nx.Graph()
-        df = pd.read_csv(f"out/{superclass}/{superclass}.{onemode}.csv", delim_whitespace=True)
+        edgelist = read_onemode_edgelist(superclass, onemode)
         print("[Info] read edgelist finished")
-        omgraph.add_weighted_edges_from([tuple(edge) for edge in df.values])
-        print(f"[Info] omgraph number of nodes {onemode} {omgraph.number_of_nodes()}")
-    return omgraph
-
-def compute_knc_onemode(onemode_graph, k_max):
-    """ Compute points of an KNC plot """
-    knc_list = []
-    fully_disconnected = False
-    get_density = nx.classes.function.density
-    get_ncc = nx.algorithms.components.number_connected_components
-    get_slcc = nx.algorithms.components.connected_components
-    for k in tqdm(range(1, k_max + 1)):
-        if not fully_disconnected:
-            for edge in list(onemode_graph.edges.data("weight")):
-                if int(edge[2]) < k:
-                    onemode_graph.remove_edge(edge[0], edge[1])
-            density = get_density(onemode_graph)
-            ncomponents = get_ncc(onemode_graph)
-            slcc = len(max(get_slcc(onemode_graph), key=len))
-            if density == 0:
-                fully_disconnected = True
-        knc_list.append((k, density, ncomponents, slcc))
+    print(f"[Info] om edgelist {onemode} number of edges {len(edgelist)}")
+    return edgelist
+
+def compute_knc_onemode(edgelist, k_max):
+    """ Compute points of an KNC plot by adding edges of descending weight into a union-find structure """
+    nodes, codes = np.unique(edgelist[:, :2], return_inverse=True)
+    codes = codes.reshape(-1, 2)
+    order = np.argsort(-edgelist[:, 2], kind="stable")
+    nodes_a = codes[order, 0].tolist()
+    nodes_b = codes[order, 1].tolist()
+    weights = edgelist[order, 2].tolist()
+    n = len(nodes)
+    parent = list(range(n))
+    size = [1] * n
+    m = 0
+    ncomponents = n
+    slcc = 1 if n > 0 else 0
+    knc_list = [None] * k_max
+    for k in tqdm(range(k_max, 0, -1)):
+        # The onemode graph at k contains all edges with weight >= k
+        while m < len(weights) and weights[m] >= k:
+            root_a = find_root(parent, nodes_a[m])
+            root_b = find_root(parent, nodes_b[m])
+            if root_a != root_b:
+                if size[root_a] < size[root_b]:
+                    root_a, root_b = root_b, root_a
+                parent[root_b] = root_a
+                size[root_a] += size[root_b]
+                slcc = max(slcc, size[root_a])
+                ncomponents -= 1
+            m += 1
+        density = get_density(n, m)
+        knc_list[k - 1] = (k, density, ncomponents, slcc)
     return knc_list
 
+def find_root(parent, node):
+    """ Find the root of a node in a union-find structure with path halving """
+    while parent[node] != node:
+        parent[node] = parent[parent[node]]
+        node = parent[node]
+    return node
+
 @get_time
 def write_knc(superclass, knc_list, onemode):
     """ Save KNC plot points to a csv file """
@@ -138,12 +202,27 @@ def write_knc(superclass, knc_list, onemode):
 def main():
     run_name = sys.argv[1][:-3]
     run = import_module(run_name)
+    init_trace(run_name)
 
-    for superclass in run.config["classes"]:
-        print("\n[Compute knc]", superclass)
-        try:
-            compute_knc(run_name, superclass, run.config["project_method"])
-        except KeyError as e:
-            print(f"[Info] file not found {superclass} graph is the null graph\n{e}")
+    for superclass in sys.argv[2:] or run.config["classes"]: # Optional classes to compute, e.g. by orchestrate.py
+        with span("compute", stage="compute", classname=superclass):
+            print("\n[Compute knc]", superclass)
+            try:
+                key = None
+                if run.config.get("stage_cache", True):
+                    key = get_stage_key("compute", superclass, run.config,
+                                        ["project_method", "sketch_min_weight", "sketch_bands", "sketch_rows"],
+                                        ["compute_knc.py", "graph_io.py", "knc_stream.py", "approx.py", "sketch.py"],
+                                        [("project", superclass)])
+                if restore_stage(run_name, "compute", superclass, key):
+                    continue
+                snapshot = start_stage(superclass)
+                compute_knc(run_name, superclass, run.config["project_method"], run.config.get("sketch_min_weight", 0),
+                            run.config.get("sketch_bands", 64), run.config.get("sketch_rows", 2))
+                store_stage("compute", superclass, key, snapshot)
+            except KeyError as e:
+                print(f"[Info] file not found {superclass} graph is the null graph\n{e}")
+    export_csv(run_name)
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compute statistics of a distribution straight from its frequency table of distinct values and their counts.
+
+All functions take int or float values sorted ascending and int counts, and run in O(number of distinct values).
+They equal the numpy functions applied to the raw sample np.repeat(values, counts) without building it.
+"""
+
+import numpy as np
+
+def get_size(counts):
+    """ Get the number of observations of a frequency table """
+    return int(np.sum(counts))
+
+def get_mean(values, counts):
+    """ Get the mean of a frequency table, None if it is empty """
+    size = get_size(counts)
+    if size == 0:
+        return None
+    return float(np.dot(values.astype(np.float64), counts) / size)
+
+def get_value_at(values, counts, positions):
+    """ Get the values at positions of the sorted raw sample """
+    return values[np.searchsorted(np.cumsum(counts), positions, side="right")]
+
+def get_quantile(values, counts, q, method="linear"):
+    """ Get the q quantile of a frequency table like np.quantile with method 'linear' or 'inverted_cdf', None if it is empty """
+    size = get_size(counts)
+    if size == 0:
+        return None
+    if method == "linear":
+        # Interpolate between the sample values around position (size - 1) * q
+        position = (size - 1) * q
+        lower, upper = get_value_at(values, counts, [int(np.floor(position)), int(np.ceil(position))])
+        return float(lower + (upper - lower) * (position - np.floor(position)))
+    elif method == "inverted_cdf":
+        # Smallest value whose cumulative count reaches size * q, and at least the first observation
+        cum_counts = np.cumsum(counts)
+        return values[min(np.searchsorted(cum_counts, max(size * q, 1), side="left"), len(values) - 1)].item()
+    raise ValueError(f"Unknown quantile method {method}")
+
+def get_median(values, counts):
+    """ Get the median of a frequency table like np.median, None if it is empty """
+    return get_quantile(values, counts, 0.5)
+
+def get_moment(values, counts, order, central=True):
+    """ Get the raw or central moment of an order of a frequency table, None if it is empty """
+    size = get_size(counts)
+    if size == 0:
+        return None
+    values = values.astype(np.float64)
+    if central:
+        values = values - get_mean(values, counts)
+    return float(np.dot(values ** order, counts) / size)
+
+def get_stdev(values, counts):
+    """ Get the population standard deviation of a frequency table like np.std, None if it is empty """
+    variance = get_moment(values, counts, 2)
+    return None if variance is None else float(np.sqrt(variance))
@@ -0,0 +1,157 @@
+"""
+Read and write bipartite and onemode graphs in a binary format with integer coded nodes.
+
+out/X/X.g.t.npy, out/X/X.g.b.npy  int32 top and bot node codes of each bipartite edge
+out/X/X.g.t.txt, out/X/X.g.b.txt  node labels (URIs), one per line, line number is the node code
+out/X/X.g.types.npz  rdf:type memberships (top node code, type code) and type labels of the top nodes
+out/X/X.g.parent.npz  name of the superclass graph X was derived from and its top and bot node codes of each X node code
+out/X/X.t.el.bin, out/X/X.b.el.bin  raw int32 (node_a, node_b, w) triples of the onemode edgelists
+out/X/X.t.w.npy, .k.npy, .c.npy  int64 frequency tables (values, counts) of onemode weights, degrees, connectivities
+out/X/X.t.nk.npy, .nc.npy  int64 degree and connectivity of each onemode node, indexed by node code
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from logger import get_time
+
+def graph_path(classname, label):
+    """ Get the path of a graph file of a class """
+    return f"out/{classname}/{classname}.{label}"
+
+@get_time
+def write_graph(classname, t_codes, b_codes, nodes_top, nodes_bot):
+    """ Write bipartite edge code arrays and node label dictionaries """
+    np.save(graph_path(classname, "g.t.npy"), np.asarray(t_codes, dtype=np.int32))
+    np.save(graph_path(classname, "g.b.npy"), np.asarray(b_codes, dtype=np.int32))
+    write_nodes(classname, "t", nodes_top)
+    write_nodes(classname, "b", nodes_bot)
+
+def write_graph_edgelist(classname, edgelist):
+    """ Write a bipartite edgelist of (top label, bot label) tuples with node labels converted to codes """
+    df = pd.DataFrame(edgelist, columns=["t", "b"]).drop_duplicates()
+    t_codes, nodes_top = pd.factorize(df["t"])
+    b_codes, nodes_bot = pd.factorize(df["b"])
+    write_graph(classname, t_codes, b_codes, nodes_top, nodes_bot)
+
+def write_nodes(classname, onemode, nodes):
+    """ Write node labels of one side of the bipartite graph, one per line in code order """
+    with open(graph_path(classname, f"g.{onemode}.txt"), "w") as output_file:
+        for node in nodes:
+            output_file.write(f"{node}\n")
+
+def read_nodes(classname, onemode):
+    """ Read node labels of one side of the bipartite graph in code order """
+    with open(graph_path(classname, f"g.{onemode}.txt"), "r") as input_file:
+        return input_file.read().splitlines()
+
+def has_graph(classname):
+    """ Check whether the binary bipartite graph of a class exists """
+    return os.path.isfile(graph_path(classname, "g.t.npy"))
+
+@get_time
+def read_graph(classname):
+    """ Memory-map the bipartite edge code arrays, Convert a .g.csv edgelist once if there is no binary graph """
+    if not has_graph(classname):
+        df = pd.read_csv(graph_path(classname, "g.csv"), dtype=str)
+        write_graph_edgelist(classname, df.itertuples(index=False, name=None))
+    t_codes = np.load(graph_path(classname, "g.t.npy"), mmap_mode="r")
+    b_codes = np.load(graph_path(classname, "g.b.npy"), mmap_mode="r")
+    return t_codes, b_codes, read_nodes(classname, "t"), read_nodes(classname, "b")
+
+def read_code_edgelist(classname):
+    """ Read the bipartite edgelist as (top code, bot code) tuples """
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph(classname)
+    return list(zip(t_codes.tolist(), b_codes.tolist()))
+
+@get_time
+def read_biadjacency(classname):
+    """ Build the integer biadjacency matrix with top node codes as rows and bot node codes as columns """
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph(classname)
+    data = np.ones(len(t_codes), dtype=np.int32)
+    biadjmatrix = sparse.csr_matrix((data, (t_codes, b_codes)), shape=(len(nodes_top), len(nodes_bot)))
+    biadjmatrix.data[:] = 1 # Duplicate entity-property relations count once
+    print(f"[Info] biadjacency matrix shape {biadjmatrix.shape} nnz {biadjmatrix.nnz}")
+    return biadjmatrix, nodes_top, nodes_bot
+
+def write_types(classname, t_codes, type_codes, types):
+    """ Write the rdf:type memberships of top nodes as pairs of top node code and index into the type labels """
+    np.savez(graph_path(classname, "g.types.npz"),
+             t=np.asarray(t_codes, dtype=np.int32), type=np.asarray(type_codes, dtype=np.int32), labels=np.array(types, dtype=str))
+
+def has_types(classname):
+    """ Check whether the rdf:type memberships of a class graph were recorded """
+    return os.path.isfile(graph_path(classname, "g.types.npz"))
+
+def read_types(classname):
+    """ Read the rdf:type memberships of top nodes as top node codes, type codes and type labels """
+    with np.load(graph_path(classname, "g.types.npz")) as types:
+        return types["t"], types["type"], types["labels"].tolist()
+
+def write_parent(classname, parent, t_map, b_map):
+    """ Write the superclass a graph was derived from and the superclass node code of each of its node codes """
+    np.savez(graph_path(classname, "g.parent.npz"),
+             parent=np.array(parent), t=np.asarray(t_map, dtype=np.int32), b=np.asarray(b_map, dtype=np.int32))
+
+def has_parent(classname):
+    """ Check whether a class graph was derived from a superclass graph """
+    return os.path.isfile(graph_path(classname, "g.parent.npz"))
+
+def remove_parent(classname):
+    """ Remove the superclass reference of a class graph that is built on its own """
+    if has_parent(classname):
+        os.remove(graph_path(classname, "g.parent.npz"))
+
+def read_parent(classname):
+    """ Read the superclass a graph was derived from and the superclass node codes of its top and bot nodes """
+    with np.load(graph_path(classname, "g.parent.npz")) as parent:
+        return str(parent["parent"]), parent["t"], parent["b"]
+
+def onemode_path(classname, onemode):
+    """ Get the path of the binary onemode edgelist of a class """
+    return graph_path(classname, f"{onemode}.el.bin")
+
+def open_onemode_edgelist(classname, onemode):
+    """ Open the binary onemode edgelist of a class for writing """
+    return open(onemode_path(classname, onemode), "wb")
+
+def write_onemode_edges(output_file, nodes_a, nodes_b, weights):
+    """ Append a block of weighted onemode edges as int32 triples """
+    edges = np.empty((len(weights), 3), dtype=np.int32)
+    edges[:, 0] = nodes_a
+    edges[:, 1] = nodes_b
+    edges[:, 2] = weights
+    edges.tofile(output_file)
+
+def read_onemode_edgelist(classname, onemode):
+    """ Memory-map the binary onemode edgelist of a class as an array of (node_a, node_b, w) rows """
+    path = onemode_path(classname, onemode)
+    if os.path.getsize(path) == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    return np.memmap(path, dtype=np.int32, mode="r").reshape(-1, 3)
+
+def write_distribution(classname, onemode, disttype, values, counts):
+    """ Write the frequency table of a onemode distribution (w, k, c) as an array of values and counts """
+    table = np.vstack((values, counts)).astype(np.int64)
+    np.save(graph_path(classname, f"{onemode}.{disttype}.npy"), table)
+
+def read_frequencies(classname, onemode, disttype):
+    """ Read the frequency table of a onemode distribution (w, k, c) as arrays of values and counts sorted by value """
+    table = np.load(graph_path(classname, f"{onemode}.{disttype}.npy"))
+    return table[0], table[1]
+
+def read_distribution(classname, onemode, disttype):
+    """ Read the frequency table of a onemode distribution (w, k, c) as a dict of value: count """
+    values, counts = read_frequencies(classname, onemode, disttype)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+def write_node_values(classname, onemode, disttype, values):
+    """ Write degree (nk) or connectivity (nc) of each onemode node as an array indexed by node code """
+    np.save(graph_path(classname, f"{onemode}.{disttype}.npy"), np.asarray(values, dtype=np.int64))
+
+def read_node_values(classname, onemode, disttype):
+    """ Read degree (nk) or connectivity (nc) of each connected onemode node as a dict of node label: value """
+    values = np.load(graph_path(classname, f"{onemode}.{disttype}.npy"))
+    nodes = read_nodes(classname, onemode)
+    return {nodes[code]: int(values[code]) for code in np.flatnonzero(values)}
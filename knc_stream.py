@@ -0,0 +1,122 @@
+"""
+Compute a KNC plot online from blocks of weighted onemode edges without keeping the edgelist.
+
+A stream keeps one union-find parent array per threshold k (n * w_max int32), a stream with a spill keeps the edges in
+runs sorted by weight instead and merges them into a single union-find in order of descending weight at the end.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+from spill import update_spill, merge_spill
+
+def init_knc_stream(n, spill=None):
+    """ Get an empty KNC stream of a onemode graph with n nodes, one union-find parent array per threshold k or a spill """
+    return {"n": n, "parents": [], "spill": spill}
+
+def get_stream_bytes(n, w_max):
+    """ Get the bytes of the parent arrays of a KNC stream of a onemode graph with n nodes and weights up to w_max """
+    return 4 * n * w_max
+
+def update_knc_stream(knc_stream, rows, cols, weights):
+    """ Merge a block of weighted onemode edges into the components of each threshold k <= w """
+    if len(weights) == 0:
+        return
+    if knc_stream["spill"] is not None:
+        update_spill(knc_stream["spill"], rows, cols, weights)
+        return
+    order = np.argsort(-weights, kind="stable")
+    rows, cols, weights = rows[order], cols[order], weights[order]
+    parents = knc_stream["parents"]
+    while len(parents) < weights[0]:
+        parents.append(np.arange(knc_stream["n"], dtype=np.int32))
+    for k in range(1, weights[0] + 1):
+        # Edges with weight >= k are a prefix of the block sorted by descending weight
+        m_k = np.searchsorted(-weights, -k, side="right")
+        union_edges(parents[k - 1], rows[:m_k], cols[:m_k])
+
+def find_roots(parent, nodes):
+    """ Find the roots of nodes in a union-find parent array by pointer jumping, Compress their paths """
+    roots = parent[nodes]
+    while True:
+        grandparents = parent[roots]
+        if np.array_equal(grandparents, roots):
+            break
+        roots = grandparents
+    parent[nodes] = roots
+    return roots
+
+def union_edges(parent, nodes_a, nodes_b, sizes=None):
+    """ Union the components of a batch of edges, The smallest root of each merged component becomes its root """
+    roots_a = find_roots(parent, nodes_a)
+    roots_b = find_roots(parent, nodes_b)
+    merging = roots_a != roots_b
+    if not merging.any():
+        return 0
+    roots, codes = np.unique(np.concatenate((roots_a[merging], roots_b[merging])), return_inverse=True)
+    n_merging = merging.sum()
+    root_graph = sparse.coo_matrix(
+        (np.ones(n_merging, dtype=np.int8), (codes[:n_merging], codes[n_merging:])),
+        shape=(len(roots), len(roots)))
+    ncomponents, components = csgraph.connected_components(root_graph, directed=False)
+    new_roots = np.full(ncomponents, parent.shape[0], dtype=parent.dtype)
+    np.minimum.at(new_roots, components, roots)
+    if sizes is not None:
+        # Component sizes are kept at their roots
+        sizes[new_roots] = np.bincount(components, weights=sizes[roots]).astype(sizes.dtype)
+    parent[roots] = new_roots[components]
+    return len(roots) - ncomponents # Number of merged components
+
+def sweep_knc_spill(knc_stream, n):
+    """ Merge spilled edges into one union-find by descending weight, Return the weights with components and LCC size after each """
+    parent = np.arange(knc_stream["n"], dtype=np.int32)
+    sizes = np.ones(knc_stream["n"], dtype=np.int64)
+    ncomponents = n
+    slcc = 1 if n > 0 else 0
+    points = {}
+    for rows, cols, weights in merge_spill(knc_stream["spill"]):
+        # Edges of one weight can continue in the next block
+        starts = np.flatnonzero(np.concatenate(([True], weights[1:] != weights[:-1])))
+        for start, end in zip(starts, np.append(starts[1:], len(weights))):
+            ncomponents -= union_edges(parent, rows[start:end], cols[start:end], sizes)
+            slcc = max(slcc, int(sizes[find_roots(parent, rows[start:end])].max()))
+            points[int(weights[start])] = (ncomponents, slcc)
+    weights = np.array(sorted(points), dtype=np.int64)
+    return weights, [points[weight] for weight in weights]
+
+def finish_knc_stream(knc_stream, weight_counts, degrees, k_max):
+    """ Get the KNC plot points for k from 1 to k_max of a streamed onemode graph """
+    present = np.flatnonzero(degrees > 0) # Nodes of the onemode edgelist
+    n = len(present)
+    edges_from = np.cumsum(weight_counts[::-1])[::-1] # Number of edges with weight >= k at index k
+    if knc_stream["spill"] is not None:
+        weights, points = sweep_knc_spill(knc_stream, n)
+    knc_list = []
+    for k in range(1, k_max + 1):
+        m = int(edges_from[k]) if k < len(edges_from) else 0
+        if knc_stream["spill"] is not None:
+            # Components after all edges with weight >= k were merged, after the smallest such weight
+            i = np.searchsorted(weights, k, side="left")
+            ncomponents, slcc = points[i] if i < len(weights) else (n, 1 if n > 0 else 0)
+        elif k <= len(knc_stream["parents"]):
+            roots = find_roots(knc_stream["parents"][k - 1], present)
+            component_sizes = np.bincount(roots)
+            ncomponents = int(np.count_nonzero(component_sizes))
+            slcc = int(component_sizes.max()) if n > 0 else 0
+        else:
+            ncomponents = n
+            slcc = 1 if n > 0 else 0
+        knc_list.append((k, get_density(n, m), ncomponents, slcc))
+    return knc_list
+
+def write_knc_stream(classname, onemode, knc_list):
+    """ Save streamed KNC plot points to a csv file that compute_knc uses in place of the onemode edgelist """
+    df = pd.DataFrame(knc_list, columns=["k", "density", "ncomponents", "slcc"])
+    df.to_csv(f"out/{classname}/{classname}.{onemode}.knc.stream.csv", index=False)
+
+def get_density(n, m):
+    """ Get the density of an undirected graph with n nodes and m edges like networkx """
+    if m == 0 or n <= 1:
+        return 0
+    return m / (n * (n - 1)) * 2
@@ -1,15 +1,116 @@
+"""
+Time and memory logging of functions, recorded as nested spans in a JSONL trace file of each run session.
+
+out/_traces/<run>/<session>.jsonl  one span per line with wall and CPU time, peak RSS of the process and its largest child
+                                   since they started, growth of the process peak during the span, item counts and throughput,
+                                   tagged with the stage, class and onemode it ran for
+
+python3 logger.py diff <trace_a> <trace_b>  compare the spans of two runs
+python3 logger.py chrome <trace> > trace.json  convert a trace to the Chrome trace format (chrome://tracing, Perfetto)
+"""
+
+import os
+import sys
+import json
 import time
+import inspect
 import resource
 from functools import wraps
+from contextlib import contextmanager
+
+trace = {"path": None, "stack": []} # Trace file of this process and its open spans, innermost last
+
+def init_trace(run_name):
+    """ Write the spans of this process and of its child processes to the trace file of the current run session """
+    # Processes started by orchestrate.py or pipeline.sh inherit the session and append to the same trace
+    session = os.environ.setdefault("TRACE_SESSION", time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(f"out/_traces/{run_name}", exist_ok=True)
+    trace["path"] = f"out/_traces/{run_name}/{session}.jsonl"
+
+def get_max_rss():
+    """ Get the peak RSS in GB of this process and of its largest terminated child process since they started """
+    max_rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2)
+    # Maximum over the children, not their sum, so concurrent pool workers together can have used up to ncores times more
+    max_rss_child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 ** 2)
+    return max_rss_self, max_rss_child
+
+@contextmanager
+def span(name, **attrs):
+    """ Record wall time, CPU time, peak RSS and item counts of a block, Nested spans inherit stage, class and onemode """
+    stack = trace["stack"]
+    parent = stack[-1] if stack else None
+    record = {
+        "name": name,
+        "path": f"{parent['path']}/{name}" if parent else name,
+        "attrs": {**(parent["attrs"] if parent else {}), **attrs},
+        "count": 0,
+        "unit": None,
+    }
+    start = time.time()
+    start_perf = time.perf_counter()
+    start_times = os.times()
+    start_rss, _ = get_max_rss()
+    stack.append(record)
+    try:
+        yield record
+    finally:
+        stack.pop()
+        end_times = os.times()
+        record["start"] = start
+        record["wall"] = time.perf_counter() - start_perf
+        record["cpu"] = (end_times.user - start_times.user) + (end_times.system - start_times.system)
+        record["cpu_children"] = ((end_times.children_user - start_times.children_user)
+                                  + (end_times.children_system - start_times.children_system))
+        # ru_maxrss is the peak of the process lifetime, the growth is how far the block raised it above the peak before
+        record["max_rss"], record["max_rss_child"] = get_max_rss()
+        record["rss_growth"] = record["max_rss"] - start_rss
+        record["throughput"] = record["count"] / record["wall"] if record["count"] and record["wall"] > 0 else None
+        record["pid"] = os.getpid()
+        record["script"] = os.path.basename(sys.argv[0])
+        write_span(record)
+
+def write_span(record):
+    """ Append a finished span to the trace file as one JSON line """
+    if trace["path"] is None:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    # Single appends of a line are not interleaved with lines of other processes
+    with open(trace["path"], "a") as output_file:
+        output_file.write(line)
+
+def annotate(**attrs):
+    """ Tag the innermost open span and the spans nested in it later, e.g. with the onemode a function works on """
+    if trace["stack"]:
+        trace["stack"][-1]["attrs"].update(attrs)
+
+def add_count(count, unit):
+    """ Add processed items (pairs, triples, edges) to the innermost open span to report their throughput """
+    if trace["stack"]:
+        trace["stack"][-1]["count"] += int(count)
+        trace["stack"][-1]["unit"] = unit
+
+@contextmanager
+def function_span(func):
+    """ Open a span for a decorated function, Reuse it if get_time and get_ram decorate the same function """
+    func = inspect.unwrap(func)
+    stack = trace["stack"]
+    if stack and stack[-1].get("func") == id(func):
+        yield stack[-1]
+        return
+    with span(func.__name__) as record:
+        record["func"] = id(func)
+        yield record
+        del record["func"] # Not part of the trace
 
 def get_time(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         # time.perf_counter() - system time, including time when the Python process is not running
         # time.process_time() - user time, only the time of the Python process
-        start = time.perf_counter()
-        func_return_val = func(*args, **kwargs)
-        end = time.perf_counter()
+        with function_span(func):
+            start = time.perf_counter()
+            func_return_val = func(*args, **kwargs)
+            end = time.perf_counter()
         print(f"[Time] {func.__name__} {end - start:.3f} sec")
         return func_return_val
     return wrapper
@@ -17,8 +118,79 @@ def get_time(func):
 def get_ram(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        func_return_val = func(*args, **kwargs)
-        max_ram = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2)
-        print(f"[Info] {func.__name__} max RAM in GB {max_ram:.6f}")
+        with function_span(func):
+            func_return_val = func(*args, **kwargs)
+        max_ram, max_ram_child = get_max_rss()
+        print(f"[Info] {func.__name__} max RAM in GB {max_ram:.6f}, largest child {max_ram_child:.6f}")
         return func_return_val
     return wrapper
+
+def read_trace(path):
+    """ Read the spans of a trace file """
+    with open(path, "r") as input_file:
+        return [json.loads(line) for line in input_file if line.strip()]
+
+def aggregate_spans(spans):
+    """ Sum wall time, CPU time and counts and take the process peak RSS and its growth of the spans of each script, path, class and onemode """
+    totals = {}
+    for record in spans:
+        attrs = record["attrs"]
+        key = (f"{record.get('script', '')}:{record['path']}", attrs.get("classname", ""), attrs.get("onemode", ""))
+        total = totals.setdefault(key, {"calls": 0, "wall": 0.0, "cpu": 0.0, "max_rss": 0.0, "rss_growth": 0.0, "count": 0, "unit": None})
+        total["calls"] += 1
+        total["wall"] += record["wall"]
+        total["cpu"] += record["cpu"] + record["cpu_children"]
+        total["max_rss"] = max(total["max_rss"], record["max_rss"], record["max_rss_child"])
+        total["rss_growth"] = max(total["rss_growth"], record.get("rss_growth", 0.0)) # Missing in traces of older runs
+        total["count"] += record["count"]
+        total["unit"] = total["unit"] or record["unit"]
+    return totals
+
+def diff_traces(path_a, path_b):
+    """ Print wall time, CPU time, process peak RSS, its growth and throughput of each span of two runs side by side """
+    totals_a = aggregate_spans(read_trace(path_a))
+    totals_b = aggregate_spans(read_trace(path_b))
+    # peak: GB peak RSS of the process (or largest child) since it started, grow: GB the span raised the process peak
+    print(f"{'span':<60} {'class':<16} {'om':<2} {'wall a':>9} {'wall b':>9} {'b/a':>6} "
+          f"{'cpu a':>9} {'cpu b':>9} {'peak a':>7} {'peak b':>7} {'grow a':>7} {'grow b':>7} "
+          f"{'rate a':>10} {'rate b':>10} unit")
+    for key in sorted(set(totals_a) | set(totals_b)):
+        path, classname, onemode = key
+        a, b = totals_a.get(key), totals_b.get(key)
+        ratio = b["wall"] / a["wall"] if a and b and a["wall"] > 0 else None
+        rates = [total["count"] / total["wall"] if total and total["count"] and total["wall"] > 0 else None for total in (a, b)]
+        unit = (a or b)["unit"] or ""
+        print(f"{path:<60} {classname:<16} {onemode:<2} "
+              f"{format_value(a and a['wall'], 9, 3)} {format_value(b and b['wall'], 9, 3)} {format_value(ratio, 6, 2)} "
+              f"{format_value(a and a['cpu'], 9, 3)} {format_value(b and b['cpu'], 9, 3)} "
+              f"{format_value(a and a['max_rss'], 7, 3)} {format_value(b and b['max_rss'], 7, 3)} "
+              f"{format_value(a and a['rss_growth'], 7, 3)} {format_value(b and b['rss_growth'], 7, 3)} "
+              f"{format_value(rates[0], 10, 0)} {format_value(rates[1], 10, 0)} {unit}")
+
+def format_value(value, width, precision):
+    """ Format a number of a diff column, a dash if a run has no such span """
+    if value is None:
+        return f"{'-':>{width}}"
+    return f"{value:>{width}.{precision}f}"
+
+def to_chrome(path):
+    """ Convert the spans of a trace file to the Chrome trace event format """
+    events = []
+    for record in read_trace(path):
+        events.append({
+            "name": record["name"], "cat": record["attrs"].get("stage", ""), "ph": "X",
+            "ts": record["start"] * 1e6, "dur": record["wall"] * 1e6, "pid": record["pid"], "tid": record["pid"],
+            "args": {**record["attrs"], "cpu": record["cpu"], "cpu_children": record["cpu_children"],
+                     "max_rss": record["max_rss"], "max_rss_child": record["max_rss_child"],
+                     "rss_growth": record.get("rss_growth", 0.0),
+                     "count": record["count"], "unit": record["unit"], "throughput": record["throughput"]},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "diff":
+        diff_traces(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "chrome":
+        json.dump(to_chrome(sys.argv[2]), sys.stdout)
+    else:
+        sys.exit("[Info] Please specify 'diff <trace_a> <trace_b>' or 'chrome <trace>' as arguments")
@@ -0,0 +1,55 @@
+"""
+Get the rdfs:subClassOf closure of the classes of an ontology, cached by the hash of the ontology file.
+
+out/_cache/ontology/<hash>.pickle  subclasses of each class of the ontology including itself
+"""
+
+import os
+import pickle
+from rdflib import Graph, RDFS
+from logger import get_time
+from stage_cache import hash_file
+
+dbo = "http://dbpedia.org/ontology/"
+
+subclass_closures = {} # Subclass closure of each loaded ontology by file hash
+ontology_hashes = {} # File hash of each ontology by path, modification time and size
+
+def get_subclass_closure(kg_ontology):
+    """ Get the subclasses of each ontology class including itself, Build them once per ontology file hash """
+    stat = os.stat(kg_ontology)
+    file_key = (kg_ontology, stat.st_mtime_ns, stat.st_size)
+    if file_key not in ontology_hashes: # Hash each ontology file once per process
+        ontology_hashes[file_key] = hash_file(kg_ontology)
+    ontology_hash = ontology_hashes[file_key]
+    if ontology_hash not in subclass_closures:
+        cache_path = f"out/_cache/ontology/{ontology_hash}.pickle"
+        if os.path.isfile(cache_path):
+            with open(cache_path, "rb") as input_file:
+                subclass_closures[ontology_hash] = pickle.load(input_file)
+        else:
+            subclass_closures[ontology_hash] = build_subclass_closure(kg_ontology)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(f"{cache_path}.{os.getpid()}.tmp", "wb") as output_file:
+                pickle.dump(subclass_closures[ontology_hash], output_file)
+            os.replace(f"{cache_path}.{os.getpid()}.tmp", cache_path) # Concurrent builds never read a partial file
+    return subclass_closures[ontology_hash]
+
+@get_time
+def build_subclass_closure(kg_ontology):
+    """ Parse the ontology once and compute the transitive rdfs:subClassOf closure of all its classes """
+    ontology = Graph().parse(kg_ontology)
+    children = {}
+    for subclass, superclass in ontology.subject_objects(RDFS["subClassOf"]):
+        children.setdefault(str(superclass), set()).add(str(subclass))
+    subclass_closure = {}
+    for superclass in children:
+        subclasses = {superclass}
+        stack = [superclass]
+        while stack:
+            for subclass in children.get(stack.pop(), ()):
+                if subclass not in subclasses:
+                    subclasses.add(subclass)
+                    stack.append(subclass)
+        subclass_closure[superclass] = sorted(subclasses)
+    return subclass_closure
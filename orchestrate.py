@@ -0,0 +1,200 @@
+"""
+Run the build, project, compute and analyze stages of all classes of a run as a DAG of (class, stage) tasks.
+
+Each task runs its stage script for one class in a subprocess, so the HDT-bound build of a class overlaps with the
+CPU-bound stages of the classes built before it. Tasks take an I/O or CPU slot and fit into a memory budget.
+
+out/_orchestrate_<run>.json  status, time and peak RSS of each task, Completed tasks are skipped when a run is resumed
+out/_logs/<run>/<class>.<stage>.log  output of each task
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import subprocess
+from logger import get_time, init_trace, write_span
+from ontology import get_subclass_closure, dbo
+from importlib import import_module
+
+scripts = {"build": "build_graph.py", "project": "project_graph.py", "compute": "compute_knc.py", "analyze": "analyze_knc.py"}
+slots = {"build": "io", "project": "cpu", "compute": "cpu", "analyze": "cpu"}
+
+def get_ancestors(run):
+    """ Get the classes listed earlier in the run whose graph a class could be derived from """
+    classes = run.config["classes"]
+    ancestors = {classname: [] for classname in classes}
+    # Same condition under which build_graph.py derives subclass graphs
+    if run.config["kg_source"] != "kg/dbpedia2016-04en.hdt" or run.config["subject_limit"] > 0:
+        return ancestors
+    subclass_closure = get_subclass_closure(run.config["kg_ontology"])
+    for i, classname in enumerate(classes):
+        ancestors[classname] = [parent for parent in classes[:i] if parent != classname
+                                and dbo + classname in subclass_closure.get(dbo + parent, [dbo + parent])]
+    return ancestors
+
+def get_tasks(run):
+    """ Get the (class, stage) tasks of a run with the tasks each depends on, in order of priority """
+    classes = run.config["classes"]
+    ancestors = get_ancestors(run)
+    # Same condition under which project_graph.py projects the bots of subclasses together with their superclass
+    incremental = run.config.get("incremental_projection", True) and run.config["project_method"] in ["hyper", "sparse", "inverted"]
+    tasks = {}
+    for classname in classes:
+        descendants = [subclass for subclass in classes if classname in ancestors[subclass]]
+        tasks[(classname, "build")] = [(parent, "build") for parent in ancestors[classname]]
+        tasks[(classname, "project")] = [(classname, "build")]
+        tasks[(classname, "compute")] = [(classname, "project")]
+        if incremental:
+            # Derivation chains of subclasses are read when the superclass is projected, It writes their bot graphs
+            tasks[(classname, "project")] += [(subclass, "build") for subclass in descendants]
+            tasks[(classname, "compute")] += [(parent, "project") for parent in ancestors[classname]]
+        tasks[(classname, "analyze")] = [(classname, "compute")]
+        if classname != classes[0]:
+            tasks[(classname, "analyze")].append((classes[0], "compute")) # Relative metrics refer to the first class
+    return tasks
+
+def get_skipped(tasks, pending, failed):
+    """ Get the pending tasks that depend on a failed task directly or through other pending tasks, in pending order """
+    skipped = set()
+    changed = True
+    while changed:
+        # Descendants can come before the tasks they depend on, so repeat until no task is added
+        changed = False
+        for task in pending:
+            if task not in skipped and any(dependency in failed or dependency in skipped for dependency in tasks[task]):
+                skipped.add(task)
+                changed = True
+    return [task for task in pending if task in skipped]
+
+def task_name(task):
+    """ Get the name of a task in the state file and logs """
+    classname, stage = task
+    return f"{classname}.{stage}"
+
+def state_path(run_name):
+    """ Get the path of the task state file of a run """
+    return f"out/_orchestrate_{run_name}.json"
+
+def read_state(run_name, config):
+    """ Read the task state of the last run, Start over if the run config changed but keep peak RSS of the tasks """
+    config_hash = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+    state = {"config": config_hash, "tasks": {}, "peaks": {}}
+    if os.path.isfile(state_path(run_name)):
+        with open(state_path(run_name), "r") as input_file:
+            last_state = json.load(input_file)
+        state["peaks"] = last_state.get("peaks", {})
+        if last_state["config"] == config_hash:
+            state["tasks"] = last_state["tasks"]
+    return state
+
+def write_state(run_name, state):
+    """ Write the task state of a run after each finished task """
+    with open(state_path(run_name) + ".tmp", "w") as output_file:
+        json.dump(state, output_file, indent=4)
+    os.replace(state_path(run_name) + ".tmp", state_path(run_name)) # A crash never leaves a partial state file
+
+def get_memory_estimate(state, task):
+    """ Get the peak RSS in GB of the last run of a task, else of the same stage of another class, else 0 """
+    peaks = state["peaks"]
+    if task_name(task) in peaks:
+        return peaks[task_name(task)]
+    stage_peaks = [peak for name, peak in peaks.items() if name.endswith(f".{task[1]}")]
+    return max(stage_peaks, default=0.0)
+
+def get_memory_total():
+    """ Get the physical memory of the machine in GB """
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 ** 3)
+
+def start_task(run_config, run_name, task):
+    """ Run the stage script of a task for its class in a subprocess """
+    classname, stage = task
+    os.makedirs(f"out/_logs/{run_name}", exist_ok=True)
+    with open(f"out/_logs/{run_name}/{task_name(task)}.log", "w") as log_file:
+        process = subprocess.Popen([sys.executable, scripts[stage], run_config, classname],
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+    print(f"[Orchestrate] start {task_name(task)} pid {process.pid}")
+    return process
+
+def write_task_span(task, start, seconds, rusage, returncode):
+    """ Add the wall time, CPU time and peak RSS of a finished task subprocess to the trace of the run session """
+    classname, stage = task
+    write_span({
+        "name": stage, "path": f"orchestrate/{stage}", "attrs": {"stage": stage, "classname": classname},
+        "count": 0, "unit": None, "start": start, "wall": seconds, "cpu": 0.0, "cpu_children": rusage.ru_utime + rusage.ru_stime,
+        "max_rss": 0.0, "max_rss_child": rusage.ru_maxrss / (1024 ** 2), "rss_growth": 0.0, "throughput": None, "pid": os.getpid(),
+        "script": os.path.basename(sys.argv[0]), "returncode": returncode,
+    })
+
+@get_time
+def orchestrate(run_config):
+    """ Run the tasks of a run as soon as their dependencies, a slot and enough of the memory budget are free """
+    run_name = run_config[:-3]
+    run = import_module(run_name)
+    init_trace(run_name) # Tasks inherit the trace session
+    tasks = get_tasks(run)
+    state = read_state(run_name, run.config)
+    slot_limits = {"io": run.config.get("io_slots", 1), "cpu": run.config.get("cpu_slots", 1)}
+    memory_budget = run.config.get("memory_budget", get_memory_total())
+
+    done = {task for task in tasks if state["tasks"].get(task_name(task), {}).get("status") == "done"}
+    failed = set()
+    pending = [task for task in tasks if task not in done]
+    running = {} # Task, start times and memory estimate of each running subprocess by pid
+    print(f"[Info] {len(done)} of {len(tasks)} tasks done, slots {slot_limits}, memory budget in GB {memory_budget:.3f}")
+
+    while pending or running:
+        for task in get_skipped(tasks, pending, failed):
+            # Tasks after a failed task are skipped
+            failed.add(task)
+            state["tasks"][task_name(task)] = {"status": "skipped"}
+            print(f"[Info] skip {task_name(task)}")
+        pending = [task for task in pending if task not in failed]
+        for task in pending:
+            if not all(dependency in done for dependency in tasks[task]):
+                continue
+            slot_used = sum(slots[running_task[1]] == slots[task[1]] for running_task, _, _, _ in running.values())
+            if slot_used >= slot_limits[slots[task[1]]]:
+                continue
+            estimate = get_memory_estimate(state, task)
+            memory_used = sum(running_estimate for _, _, _, running_estimate in running.values())
+            if running and memory_used + estimate > memory_budget:
+                continue
+            process = start_task(run_config, run_name, task)
+            running[process.pid] = (task, time.time(), time.perf_counter(), estimate)
+        pending = [task for task in pending if task not in [running_task for running_task, _, _, _ in running.values()]]
+        if not running:
+            break
+
+        pid, status, rusage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        task, start, start_perf, estimate = running.pop(pid)
+        seconds = time.perf_counter() - start_perf
+        max_ram = rusage.ru_maxrss / (1024 ** 2) # Peak RSS of the largest process of the task
+        returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        if returncode == 0:
+            done.add(task)
+            state["tasks"][task_name(task)] = {"status": "done", "seconds": seconds, "max_ram": max_ram}
+            state["peaks"][task_name(task)] = max_ram
+            print(f"[Orchestrate] done {task_name(task)} {seconds:.3f} sec, max RAM in GB {max_ram:.6f}")
+        else:
+            failed.add(task)
+            state["tasks"][task_name(task)] = {"status": "failed", "returncode": returncode, "seconds": seconds}
+            print(f"[Error] {task_name(task)} failed with code {returncode}, see out/_logs/{run_name}/{task_name(task)}.log")
+        write_task_span(task, start, seconds, rusage, returncode)
+        write_state(run_name, state)
+
+    write_state(run_name, state)
+    return failed
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("[Info] Please specify run config files as arguments")
+    failed = set()
+    for run_config in sys.argv[1:]:
+        print("\n[Orchestrate]", run_config)
+        failed |= orchestrate(run_config)
+    if failed:
+        sys.exit(f"[Error] {len(failed)} tasks failed or skipped")
@@ -3,6 +3,7 @@
 if [[ -n "$@" ]]; then
     for arg in "$@" # Iterate over arguments
     do
+        export TRACE_SESSION=$(date +%Y%m%d-%H%M%S) # All steps of a run append to one trace in out/_traces
         python3 build_graph.py "$arg" && python3 project_graph.py "$arg" && python3 compute_knc.py "$arg" && python3 analyze_knc.py "$arg"
     done
 else
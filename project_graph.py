@@ -5,52 +5,61 @@ Project a bipartite graph into its two onemode representations.
 #!/usr/bin/python3
 
 import os
-import re
 import sys
-import json
 import time
+import queue
+import shutil
+import zlib
 import resource
-from math import ceil
 from tqdm import tqdm
 from scipy import sparse
-from logger import get_time, get_ram
-from itertools import combinations, islice, chain
+from logger import get_time, get_ram, init_trace, span, annotate, add_count
+from graph_io import read_biadjacency, read_code_edgelist, has_parent, read_parent
+from graph_io import open_onemode_edgelist, write_onemode_edges, write_distribution, write_node_values, onemode_path, graph_path
+from stage_cache import get_stage_key, start_stage, store_stage, restore_stage
+from results import add_results, get_result, export_csv
+from knc_stream import init_knc_stream, get_stream_bytes, update_knc_stream, finish_knc_stream, write_knc_stream
+from spill import get_limit_edges, init_spill, update_spill, write_run, merge_spill
+from approx import get_sample_size, get_pair_count, sample_pair_weights, sample_node_counts, scale_counts, get_mean_ci
+from approx import get_approx_results, get_approx_error
+from itertools import combinations
 from importlib import import_module
 import numpy as np
-import pandas as pd
 import networkx as nx
 import multiprocessing as mp
+from multiprocessing import shared_memory
 
-def read_edgelist(superclass, label):
-    """ Read edgelist from csv file """
-    df = pd.read_csv(f"out/{superclass}/{superclass}.{label}.csv")
-    return list(df.itertuples(index=False, name=None))
-
-def get_result(run_name, superclass, result):
-    """ Get the result value of a superclass """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    return df.loc[superclass, result]
-
-def add_results(run_name, superclass, **results):
-    """ Append result columns in a superclass row """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    for resultname, result in results.items():
-        df.loc[superclass, resultname] = result
-    df.to_csv(f"out/_results_{run_name}.csv")
+hyper_arrays = {} # CSR adjacency arrays attached by projection workers
+hyper_blocks = []
+hyper_queues = [] # Queue of the edge blocks of discarded edgelists attached by projection workers
+el_max_nodes = 100000 # Edgelists of larger onemode graphs are discarded (top), their KNC plot is streamed
+hyper_block_edges = 2**20 # Edges of a discarded edgelist a projection worker sends to the parent process at once
 
 @get_time
 def write_edgelist(classname, onemode, edgelist):
-    """ Write edge list to csv file """
-    df = pd.DataFrame(edgelist, columns=["node_a", "node_b", "w"])
-    df.to_csv(f"out/{classname}/{classname}.{onemode}.csv", index=False)
+    """ Write weighted edge list of node codes to binary onemode edgelist file """
+    with open_onemode_edgelist(classname, onemode) as output_file:
+        write_edges(output_file, edgelist)
 
-def project_graph(run_name, superclass, project_method):
+def project_graph(run_name, superclass, project_method, onemodes="tb", memory_limit=0, approx_error=0, approx_confidence=0.95):
     """ Get the onemode representations of the bipartite subject-predicate graph of a superclass """
-    edgelist = read_edgelist(superclass, "g")
+    approximated = get_approximated(run_name, superclass, onemodes, approx_error, approx_confidence) if approx_error else ""
+    exact = "".join(onemode for onemode in onemodes if onemode not in approximated)
+    if exact:
+        project_exact(run_name, superclass, project_method, exact, memory_limit)
+    if approximated:
+        project_approx(run_name, superclass, approximated, approx_error, approx_confidence)
+
+def project_exact(run_name, superclass, project_method, onemodes="tb", memory_limit=0):
+    """ Get the exact onemode representations of a superclass with a projection method """
     if project_method == "hyper": # Benchmark: @get_ram * ncores == htop ram ?
-        project_hyper(run_name, superclass, edgelist)
+        project_hyper(run_name, superclass, onemodes, memory_limit)
+    elif project_method == "sparse":
+        project_sparse(run_name, superclass, onemodes, memory_limit)
+    elif project_method == "inverted":
+        project_inverted(run_name, superclass, onemodes, memory_limit)
     elif project_method == "intersect_al":
-        project_intersect_al(superclass, edgelist)
+        project_intersect_al(superclass, memory_limit)
     # elif project_method == "intersect": # Compare and benchmark approaches
     #     project_intersect(superclass, bigraph, nodes_top, nodes_bot)
     # elif project_method == "dot":
@@ -60,193 +69,585 @@ def project_graph(run_name, superclass, project_method):
     # elif project_method == "nx":
     #     project_nx(superclass, bigraph, nodes_top, nodes_bot)
 
+def get_approximated(run_name, superclass, onemodes, approx_error, approx_confidence):
+    """ Get the onemodes with more node pairs than the sample that bounds their estimation error """
+    sample_size = get_sample_size(approx_error, approx_confidence)
+    return "".join(onemode for onemode in onemodes
+                   if get_pair_count(int(get_result(run_name, superclass, f"n_{onemode}"))) > sample_size)
+
+@get_ram
+def project_approx(run_name, superclass, onemodes, approx_error, approx_confidence):
+    """ Estimate the top and bot onemode graph of superclass from sampled node pairs and nodes """
+    biadjmatrix, _, _ = read_biadjacency(superclass)
+    if "t" in onemodes:
+        project_approx_onemode(run_name, superclass, "t", biadjmatrix, approx_error, approx_confidence)
+    if "b" in onemodes:
+        project_approx_onemode(run_name, superclass, "b", biadjmatrix.T.tocsr(), approx_error, approx_confidence)
+
+@get_time
+def project_approx_onemode(run_name, superclass, onemode, biadjmatrix, approx_error, approx_confidence):
+    """ Write the w, k and c distributions of a onemode graph estimated from samples, Save results with their CIs """
+    n = biadjmatrix.shape[0]
+    pairs = get_pair_count(n)
+    sample_size = get_sample_size(approx_error, approx_confidence)
+    annotate(onemode=onemode)
+    add_count(sample_size, "pairs")
+    print(f"[Info] Estimate {onemode} from {sample_size} of {pairs} pairs, error {approx_error} at confidence {approx_confidence}")
+    # Exact outputs of an earlier run would be taken for the onemode graph by compute_knc.py
+    for path in [onemode_path(superclass, onemode), graph_path(superclass, f"{onemode}.knc.stream.csv"),
+                 graph_path(superclass, f"{onemode}.nk.npy"), graph_path(superclass, f"{onemode}.nc.npy")]:
+        if os.path.isfile(path):
+            os.remove(path)
+    rng = np.random.default_rng(zlib.crc32(f"{superclass}.{onemode}".encode()))
+    # Fraction of pairs with each weight, including the pairs without common neighbor
+    w_values, w_counts = scale_counts(sample_pair_weights(rng, biadjmatrix, sample_size), pairs)
+    write_distribution(superclass, onemode, "w", w_values, w_counts)
+    nodes, degrees, connectivities = sample_node_counts(rng, biadjmatrix, sample_size)
+    connected = degrees > 0
+    n_connected = round(n * connected.mean()) if len(nodes) else 0
+    write_distribution(superclass, onemode, "k", *scale_counts(degrees[connected], n_connected))
+    write_distribution(superclass, onemode, "c", *scale_counts(connectivities[connected], n_connected))
+    m = min(int(w_counts[w_values > 0].sum()), pairs) # At most a complete graph
+    k = degrees[connected].mean() if connected.any() else 0
+    c = connectivities[connected].mean() if connected.any() else 0
+    approx_results = get_approx_results(onemode, approx_error, approx_error * pairs,
+                                        get_mean_ci(degrees[connected], n_connected, approx_confidence),
+                                        get_mean_ci(connectivities[connected], n_connected, approx_confidence))
+    add_results(run_name, superclass, **{f"m_{onemode}": m, f"k_mean_{onemode}": k, f"c_mean_{onemode}": c}, **approx_results)
+
 @get_ram
-def project_hyper(run_name, superclass, edgelist):
+def project_hyper(run_name, superclass, onemodes="tb", memory_limit=0):
     """ Get both top and bot onemode graph of superclass using multiprocessing """
-    al_top = get_adjacencylist(edgelist, "t")
-    project_hyper_onemode(run_name, superclass, "t", al_top)
-    al_bot = get_adjacencylist(edgelist, "b")
-    project_hyper_onemode(run_name, superclass, "b", al_bot)
+    biadjmatrix, _, _ = read_biadjacency(superclass)
+    if "t" in onemodes:
+        project_hyper_onemode(run_name, superclass, "t", biadjmatrix, memory_limit)
+    if "b" in onemodes:
+        project_hyper_onemode(run_name, superclass, "b", biadjmatrix.T.tocsr(), memory_limit)
 
 @get_ram
-def project_hyper_onemode(run_name, superclass, onemode, adj_list):
-    """ Start multiple processes with split up adjacency list """
-    gen_pairs = combinations(adj_list, 2)
-    n = int(get_result(run_name, superclass, f"n_{onemode}"))
-    pairs_len = n * (n - 1) * 0.5
+def project_hyper_onemode(run_name, superclass, onemode, biadjmatrix, memory_limit=0, chunks_per_core=8):
+    """ Start multiple processes that pull row chunks of the upper triangular pair space """
+    n, n_opp = biadjmatrix.shape
+    annotate(onemode=onemode)
+    add_count(n * (n - 1) // 2, "pairs")
+    save_el = n < el_max_nodes
+    worker_limit = memory_limit
+    block_edges = hyper_block_edges
+    if not save_el:
+        knc_stream = init_discarded_stream(superclass, onemode, n, get_max_degree(biadjmatrix), memory_limit)
+        worker_limit = memory_limit / 2 # The other half holds the KNC stream or the buffer of its spill
     ncores = os.cpu_count()
-    size = ceil(pairs_len / ncores)
-    print(f"[Info] Start {ncores} processes with input length {size}")
-    if len(adj_list) < 100000: # Discard large graphs (top)
-        save_el = True
-    else:
-        save_el = False
-        print(f"[Info] Discard om edgelists {superclass} {onemode}")
-    with mp.Pool() as pool:
-        gen_slices = [islice(gen_pairs, size * i, size * (i + 1)) for i in range(0, ncores)]
-        gen_slices = [(superclass, onemode, size, ncores, save_el, gen_slice) for gen_slice in gen_slices]
-        pool.starmap(project_gen, gen_slices)
-    m = combine_weights(run_name, superclass, onemode)
-    k = combine_degrees(superclass, onemode, ncores)
-    c = combine_connectivities(superclass, onemode, ncores)
+    if memory_limit:
+        # Each worker holds a mask and the degree and connectivity counts of its chunk and its pickled result
+        worker_bytes = 8 * (n_opp + 4 * n)
+        if not save_el:
+            # and an edge block with its concatenated and queued copies (36 bytes per edge) of at least one row
+            worker_bytes += 36 * n
+        ncores = max(1, min(ncores, int(worker_limit * 1024**3 / worker_bytes)))
+        if not save_el:
+            # Edge blocks take the share of a worker that its counts leave
+            block_edges = int(min(hyper_block_edges, max(1, (worker_limit * 1024**3 / ncores - worker_bytes) / 36)))
+    nchunks = min(ncores * chunks_per_core, n, 9999)
+    chunks = get_row_chunks(biadjmatrix.indptr, nchunks)
+    print(f"[Info] Start {ncores} processes with {len(chunks)} row chunks of {n * (n - 1) // 2} pairs")
+    edge_queue = None
+    if not save_el:
+        # Workers wait while ncores edge blocks are queued, so the blocks in flight stay bounded
+        edge_queue = mp.Queue(ncores)
+    # CSR arrays in shared memory are attached by workers without copying or reference counting
+    blocks, specs = share_arrays(
+        indptr=biadjmatrix.indptr.astype(np.int64),
+        indices=biadjmatrix.indices.astype(np.int32))
+    try:
+        with mp.Pool(ncores, initializer=attach_arrays, initargs=(specs, edge_queue)) as pool:
+            chunk_args = [(superclass, onemode, save_el, n_opp, block_edges, chunk, start, end)
+                          for chunk, (start, end) in enumerate(chunks)]
+            # Idle workers pull the next chunk, so all cores stay busy until the last chunks
+            if save_el:
+                chunk_counts = pool.imap_unordered(project_rows_star, chunk_args)
+                om_counts = merge_counts(tqdm(chunk_counts, total=len(chunk_args)), n)
+            else:
+                result = pool.map_async(project_rows_star, chunk_args, chunksize=1)
+                om_counts = merge_counts(stream_chunk_edges(edge_queue, result, len(chunks), knc_stream), n)
+                result.get()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    if save_el:
+        concatenate_el(superclass, onemode, len(chunks))
+    finish_projection(run_name, superclass, onemode, om_counts)
+    if not save_el:
+        finish_projection_stream(superclass, onemode, knc_stream, om_counts, n_opp)
+
+def share_arrays(**arrays):
+    """ Copy numpy arrays into shared memory blocks, Return the blocks and the specs to attach them """
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+def attach_arrays(specs, edge_queue=None):
+    """ Attach a worker process to the shared memory arrays and the queue of edge blocks """
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        hyper_blocks.append(block) # Keep the block open as long as the worker lives
+        hyper_arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    hyper_queues.append(edge_queue)
+
+def get_row_chunks(indptr, nchunks, row_overhead=4096):
+    """ Split the rows of the upper triangular pair space into contiguous chunks of about equal estimated cost """
+    n = len(indptr) - 1
+    # Row i is compared with its n - 1 - i successors by scanning all of their neighbors once
+    row_costs = (indptr[-1] - indptr[1:]) + (n - 1 - np.arange(n)) + row_overhead
+    cum_costs = np.cumsum(row_costs)
+    targets = cum_costs[-1] * np.arange(1, nchunks) / nchunks if n > 0 else []
+    bounds = np.unique(np.concatenate(([0], np.searchsorted(cum_costs, targets) + 1, [n])))
+    bounds = bounds[bounds <= n]
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+def project_rows_star(args):
+    """ Unpack arguments for project_rows """
+    return project_rows(*args)
+
+def project_rows(classname, onemode, save_el, n_opp, block_edges, chunk, row_start, row_end):
+    """ Get a weigthed edgelist by intersecting the neighbors of each row node with all its successors, Return its counts """
+    # Edges of a discarded edgelist are sent to the parent process in blocks, which streams them into the KNC plot
+    indptr = hyper_arrays["indptr"]
+    indices = hyper_arrays["indices"]
+    n = len(indptr) - 1
+    mask = np.zeros(n_opp, dtype=np.int64)
+    weight_counts = np.zeros(1, dtype=np.int64)
+    degrees = np.zeros(n, dtype=np.int64)
+    connectivities = np.zeros(n, dtype=np.int64)
+    edges = []
+    n_edges = 0
+    chunk_path = get_chunk_path(classname, onemode, chunk) if save_el else os.devnull
+    with open(chunk_path, "wb") as output_file:
+        for i in range(row_start, row_end):
+            neighbors_a = indices[indptr[i]:indptr[i + 1]]
+            mask[neighbors_a] = 1
+            # Intersection sizes with all successors from prefix sums over their marked neighbors
+            offset = indptr[i + 1]
+            hits = np.concatenate(([0], np.cumsum(mask[indices[offset:]])))
+            weights = hits[indptr[i + 2:] - offset] - hits[indptr[i + 1:-1] - offset]
+            mask[neighbors_a] = 0
+            cols = np.flatnonzero(weights)
+            weights = weights[cols]
+            weight_counts = add_counts(weight_counts, np.bincount(weights))
+            cols += i + 1
+            degrees[i] += len(cols)
+            degrees[cols] += 1
+            # Connectivity of a node i defined as the sum of all weigths of edges connected to i
+            connectivities[i] += weights.sum()
+            connectivities[cols] += weights
+            if save_el:
+                write_onemode_edges(output_file, np.full(len(cols), i), cols, weights)
+            elif len(cols):
+                edges.append(np.column_stack((np.full(len(cols), i), cols, weights)).astype(np.int32))
+                n_edges += len(cols)
+                if n_edges >= block_edges: # At most block_edges - 1 edges and the edges of one row
+                    hyper_queues[0].put(np.concatenate(edges))
+                    edges = []
+                    n_edges = 0
+    om_counts = {"w": weight_counts, "k": degrees, "c": connectivities}
+    if save_el:
+        return om_counts
+    if edges:
+        hyper_queues[0].put(np.concatenate(edges))
+    hyper_queues[0].put(om_counts) # The counts follow the last edge block of the chunk
+
+def stream_chunk_edges(edge_queue, result, nchunks, knc_stream):
+    """ Merge the edge blocks of the workers into a KNC stream until all chunks are done, Yield the counts of each chunk """
+    done = 0
+    with tqdm(total=nchunks) as progress:
+        while done < nchunks:
+            try:
+                edges = edge_queue.get(timeout=1)
+            except queue.Empty:
+                if result.ready():
+                    result.get() # Raise the error of a failed worker
+                continue
+            if isinstance(edges, dict):
+                done += 1
+                progress.update()
+                yield edges
+                continue
+            edges = edges.astype(np.int64)
+            update_knc_stream(knc_stream, edges[:, 0], edges[:, 1], edges[:, 2])
+
+def merge_counts(chunk_counts, n):
+    """ Merge the count arrays of all chunks as they arrive by a tree-reduce over equally sized partial sums """
+    # levels[i] holds the sum of 2**i chunks, so every chunk takes part in about log2(nchunks) additions
+    levels = []
+    for om_counts in chunk_counts:
+        level = 0
+        while level < len(levels) and levels[level] is not None:
+            om_counts = sum_counts(levels[level], om_counts)
+            levels[level] = None
+            level += 1
+        if level == len(levels):
+            levels.append(None)
+        levels[level] = om_counts
+    merged = init_counts(n)
+    for om_counts in levels:
+        if om_counts is not None:
+            merged = sum_counts(merged, om_counts)
+    return merged
+
+def sum_counts(counts_a, counts_b):
+    """ Add the weight, degree and connectivity counts of two parts of a onemode graph """
+    return {
+        "w": add_counts(counts_a["w"], counts_b["w"]),
+        "k": counts_a["k"] + counts_b["k"],
+        "c": counts_a["c"] + counts_b["c"],
+    }
+
+def get_chunk_path(classname, onemode, chunk):
+    """ Get the path of the binary edgelist file of a multiprocessing chunk """
+    return f"out/{classname}/{classname}.{onemode}.{chunk:04}.bin"
+
+def concatenate_el(classname, onemode, nchunks):
+    """ Combine all multiprocessing edgelist files in chunk order to single binary onemode edgelist file, Remove them """
+    with open_onemode_edgelist(classname, onemode) as output_file:
+        for chunk in range(nchunks):
+            chunk_path = get_chunk_path(classname, onemode, chunk)
+            with open(chunk_path, "rb") as input_file:
+                shutil.copyfileobj(input_file, output_file)
+            os.remove(chunk_path)
+
+@get_ram
+def project_sparse(run_name, superclass, onemodes="tb", memory_limit=0):
+    """ Get both top and bot onemode graph of superclass by blockwise sparse matrix products """
+    biadjmatrix, _, _ = read_biadjacency(superclass)
+    if "t" in onemodes:
+        project_sparse_onemode(run_name, superclass, "t", biadjmatrix, memory_limit)
+    if "b" in onemodes:
+        project_sparse_onemode(run_name, superclass, "b", biadjmatrix.T.tocsr(), memory_limit)
+
+def get_row_blocks(biadjmatrix, biadjmatrix_t, block_size):
+    """ Split the rows of a biadjacency matrix into blocks of about block_size scalar products each """
+    # Upper bound of nonzero products in a row: Sum of the degrees of its neighbors
+    row_costs = biadjmatrix @ np.diff(biadjmatrix_t.indptr).astype(np.int64)
+    cum_costs = np.cumsum(row_costs)
+    n = biadjmatrix.shape[0]
+    bounds = [0]
+    while bounds[-1] < n:
+        start = bounds[-1]
+        base = cum_costs[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(cum_costs, base + block_size, side="right"))
+        bounds.append(max(end, start + 1))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+@get_time
+def project_sparse_onemode(run_name, superclass, onemode, biadjmatrix, memory_limit=0, block_size=2**25):
+    """ Count weights, degrees and connectivities of a onemode graph from the upper triangle of B * B.T """
+    biadjmatrix_t = biadjmatrix.T.tocsr()
+    n = biadjmatrix.shape[0]
+    annotate(onemode=onemode)
+    add_count(n * (n - 1) // 2, "pairs")
+    om_counts = init_counts(n)
+    save_el = n < el_max_nodes
+    block_limit = memory_limit
+    if not save_el:
+        knc_stream = init_discarded_stream(superclass, onemode, n, get_max_degree(biadjmatrix), memory_limit)
+        block_limit = memory_limit / 2 # The other half holds the KNC stream or the buffer of its spill
+    block_size = get_limit_edges(block_limit, block_size) # Scalar products of a block bound its nonzero weights
+    blocks = get_row_blocks(biadjmatrix, biadjmatrix_t, block_size)
+    print(f"[Info] Multiply {len(blocks)} row blocks of {onemode}")
+    with open_edgelist(superclass, onemode, save_el) as output_file:
+        for start, end in tqdm(blocks):
+            # Only the nonzero co-occurrences of node pairs i < j are visited
+            wblock = sparse.triu(biadjmatrix[start:end] @ biadjmatrix_t, k=start + 1, format="coo")
+            rows = wblock.row + start
+            weights = wblock.data.astype(np.int64)
+            count_edges(om_counts, rows, wblock.col, weights)
+            if save_el:
+                write_onemode_edges(output_file, rows, wblock.col, weights)
+            else:
+                update_knc_stream(knc_stream, rows, wblock.col, weights)
+    finish_projection(run_name, superclass, onemode, om_counts)
+    if not save_el:
+        finish_projection_stream(superclass, onemode, knc_stream, om_counts, biadjmatrix.shape[1])
+
+def init_counts(n):
+    """ Get empty weight, degree and connectivity count arrays of a onemode graph with n nodes """
+    return {
+        "w": np.zeros(1, dtype=np.int64),
+        "k": np.zeros(n, dtype=np.int64),
+        "c": np.zeros(n, dtype=np.int64),
+    }
 
+def count_edges(om_counts, rows, cols, weights):
+    """ Add a block of weighted onemode edges to the weight, degree and connectivity counts """
+    n = len(om_counts["k"])
+    om_counts["w"] = add_counts(om_counts["w"], np.bincount(weights))
+    om_counts["k"] += np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n)
+    # Connectivity of a node i defined as the sum of all weigths of edges connected to i
+    om_counts["c"] += np.bincount(rows, weights=weights, minlength=n).astype(np.int64)
+    om_counts["c"] += np.bincount(cols, weights=weights, minlength=n).astype(np.int64)
+
+def get_max_degree(biadjmatrix):
+    """ Get the largest number of neighbors of a row node, an upper bound of its onemode weights """
+    return int(np.diff(biadjmatrix.indptr).max(initial=0))
+
+def init_discarded_stream(classname, onemode, n, w_max, memory_limit):
+    """ Get the KNC stream of a discarded onemode edgelist, Spill its edges by weight if the stream exceeds half the memory limit """
+    print(f"[Info] Discard om edgelists {classname} {onemode}")
+    spill = None
+    stream_bytes = get_stream_bytes(n, w_max)
+    if memory_limit and stream_bytes > memory_limit * 1024**3 / 2:
+        print(f"[Info] KNC stream of {classname} {onemode} needs up to {stream_bytes / 1024**3:.3f} GB, spill its edges by weight")
+        spill = init_spill(classname, onemode, get_limit_edges(memory_limit / 2, np.inf), by_weight=True)
+    return init_knc_stream(n, spill)
+
+def open_edgelist(classname, onemode, save_el):
+    """ Open the binary onemode edgelist file, or a null device if the edgelist is discarded """
+    if not save_el:
+        return open(os.devnull, "wb")
+    return open_onemode_edgelist(classname, onemode)
+
+def finish_projection(run_name, classname, onemode, om_counts):
+    """ Count node pairs without common neighbor, Write distributions and save onemode results """
+    n = len(om_counts["k"])
+    om_counts["w"][0] += n * (n - 1) // 2 - om_counts["w"][1:].sum()
+    m, k, c = write_distributions(classname, onemode, om_counts["w"], om_counts["k"], om_counts["c"])
+    if get_approx_error(run_name, classname, onemode) is not None:
+        add_results(run_name, classname, **get_approx_results(onemode)) # No longer estimated
     if onemode == "t":
-        add_results(run_name, superclass, m_t=m, k_mean_t=k, c_mean_t=c)
+        add_results(run_name, classname, m_t=m, k_mean_t=k, c_mean_t=c)
     elif onemode == "b":
-        add_results(run_name, superclass, m_b=m, k_mean_b=k, c_mean_b=c)
-    if save_el:
-        concatenate_el(superclass, onemode)
-    clean_out(superclass, onemode)
-
-def project_gen(classname, onemode, size, ncores, save_el, al_gen):
-    """ Get a weigthed edgelist by intersecting pairs from adjacency list generator slices """
-    pid = mp.current_process()._identity[0]
-    print(f"[Info] PID {pid:04}")
-    om_weights = {}
-    om_degrees = {}
-    om_connectivity = {}
-    with open(f"./out/{classname}/{classname}.{onemode}.{pid:04}.csv", "a") as output_file:
-        if pid % (2 * ncores) == ncores:
-            for node_a, node_b in tqdm(al_gen, total=size):
-                neighbors_a = node_a[1]
-                neighbors_b = node_b[1]
-                weight = len(set.intersection(neighbors_a, neighbors_b))
-                om_weights[weight] = om_weights.get(weight, 0) + 1
-                if weight > 0:
-                    om_degrees[node_a[0]] = om_degrees.get(node_a[0], 0) + 1
-                    om_degrees[node_b[0]] = om_degrees.get(node_b[0], 0) + 1
-                    # Connectivity of a node i defined as the sum of all weigths of edges connected to i
-                    om_connectivity[node_a[0]] = om_connectivity.get(node_a[0], 0) + weight
-                    om_connectivity[node_b[0]] = om_connectivity.get(node_b[0], 0) + weight
-                    if save_el:
-                        output_file.write(f"{node_a[0]} {node_b[0]} {weight}\n")
+        add_results(run_name, classname, m_b=m, k_mean_b=k, c_mean_b=c)
+
+@get_time
+def finish_projection_stream(classname, onemode, knc_stream, om_counts, k_max):
+    """ Save the KNC plot points of a onemode graph whose edgelist was streamed instead of saved """
+    knc_list = finish_knc_stream(knc_stream, om_counts["w"], om_counts["k"], k_max)
+    write_knc_stream(classname, onemode, knc_list)
+
+def add_counts(counts_a, counts_b):
+    """ Add two count arrays indexed by value of possibly different lengths """
+    if len(counts_a) < len(counts_b):
+        counts_a, counts_b = counts_b, counts_a
+    counts_a = counts_a.copy()
+    counts_a[:len(counts_b)] += counts_b
+    return counts_a
+
+def write_distributions(classname, onemode, weight_counts, degrees, connectivities):
+    """ Write w, k and c distributions of a onemode graph to binary files, Return m, k_mean and c_mean """
+    weights = np.flatnonzero(weight_counts)
+    write_distribution(classname, onemode, "w", weights, weight_counts[weights])
+    connected = degrees > 0
+    write_node_values(classname, onemode, "nk", degrees)
+    write_distribution(classname, onemode, "k", *np.unique(degrees[connected], return_counts=True))
+    write_node_values(classname, onemode, "nc", connectivities)
+    write_distribution(classname, onemode, "c", *np.unique(connectivities[connected], return_counts=True))
+    m = int(weight_counts[1:].sum())
+    k = degrees[connected].mean() if connected.any() else 0
+    c = connectivities[connected].mean() if connected.any() else 0
+    return m, k, c
+
+@get_ram
+def project_inverted(run_name, superclass, onemodes="tb", memory_limit=0):
+    """ Get both top and bot onemode graph of superclass by counting co-occurrences from the opposite adjacency list """
+    edgelist = read_code_edgelist(superclass)
+    al_top = get_adjacencylist(edgelist, "t")
+    al_bot = get_adjacencylist(edgelist, "b")
+    if "t" in onemodes:
+        project_inverted_onemode(run_name, superclass, "t", al_top, al_bot, memory_limit)
+    if "b" in onemodes:
+        project_inverted_onemode(run_name, superclass, "b", al_bot, al_top, memory_limit)
+
+@get_time
+def project_inverted_onemode(run_name, superclass, onemode, adj_list, inv_adj_list, memory_limit=0, hub_fraction=0.1, batch_size=2**22):
+    """ Get the weights of each node to its successors by summing up the member arrays of its opposite nodes """
+    codes = np.array([int(node) for node, neighbors in adj_list], dtype=np.int64)
+    node_index = {node: i for i, (node, neighbors) in enumerate(adj_list)}
+    n = len(codes)
+    annotate(onemode=onemode)
+    add_count(n * (n - 1) // 2, "pairs")
+    # Opposite nodes connected to more than hub_fraction of all nodes (e.g. rdf:type) are counted densely
+    hub_min_degree = max(2, int(hub_fraction * n))
+    members = {}
+    hubs = {}
+    hub_members = []
+    for opp_node, neighbors in inv_adj_list:
+        member_ids = np.sort(np.fromiter((node_index[str(node)] for node in neighbors), dtype=np.int64))
+        if len(member_ids) > hub_min_degree:
+            hubs[opp_node] = len(hubs)
+            hub_members.append(member_ids)
         else:
-            for node_a, node_b in al_gen:
-                neighbors_a = node_a[1]
-                neighbors_b = node_b[1]
-                weight = len(set.intersection(neighbors_a, neighbors_b))
-                om_weights[weight] = om_weights.get(weight, 0) + 1
-                if weight > 0:
-                    om_degrees[node_a[0]] = om_degrees.get(node_a[0], 0) + 1
-                    om_degrees[node_b[0]] = om_degrees.get(node_b[0], 0) + 1
-                    om_connectivity[node_a[0]] = om_connectivity.get(node_a[0], 0) + weight
-                    om_connectivity[node_b[0]] = om_connectivity.get(node_b[0], 0) + weight
-                    if save_el:
-                        output_file.write(f"{node_a[0]} {node_b[0]} {weight}\n")
-    with open(f"out/{classname}/{classname}.{onemode}.w.{pid:04}.json", "w") as output_file:
-        json.dump(om_weights, output_file)
-    with open(f"out/{classname}/{classname}.{onemode}.k.{pid:04}.json", "w") as output_file:
-        json.dump(om_degrees, output_file)
-    with open(f"out/{classname}/{classname}.{onemode}.nc.{pid:04}.json", "w") as output_file:
-        json.dump(om_connectivity, output_file)
-
-def combine_weights(run_name, classname, onemode):
-    """ Combine all multiprocessing weight dict files to single file, Count total edges """
-    om_weights = {}
-    regex = f"{classname}.{onemode}.w.[0-9][0-9][0-9][0-9].json"
-    mp_files = [mp_file for mp_file in os.listdir(f'out/{classname}') if re.match(regex, mp_file)]
-    for mp_file in mp_files:
-        with open(f"out/{classname}/" + mp_file, "r") as input_file:
-            mp_om_weights = json.load(input_file)
-            for key, value in mp_om_weights.items():
-                om_weights[key] = om_weights.get(key, 0) + value
-    with open(f"out/{classname}/{classname}.{onemode}.w.json", "w") as output_file:
-        json.dump(om_weights, output_file, indent=4, sort_keys=True)
-    m = 0
-    for key, value in om_weights.items():
-        if int(key) > 0:
-            m += value
-    return m
-
-def combine_degrees(classname, onemode, ncores):
-    """ Combine all multiprocessing degree dict files to single file, Count occurences of degrees, Compute avg degree """
-    om_degrees = {}
-    regex = f"{classname}.{onemode}.k.[0-9][0-9][0-9][0-9].json"
-    mp_files = [mp_file for mp_file in os.listdir(f'out/{classname}') if re.match(regex, mp_file)]
-    for mp_file in mp_files:
-        with open(f"out/{classname}/" + mp_file, "r") as input_file:
-            mp_om_degrees = json.load(input_file)
-            for key, value in mp_om_degrees.items():
-                om_degrees[key] = om_degrees.get(key, 0) + value
-    with open(f"out/{classname}/{classname}.{onemode}.nk.json", "w") as output_file:
-        json.dump(om_degrees, output_file, indent=4)
-
-    om_degrees_count = {}
-    for key, value in om_degrees.items():
-        om_degrees_count[value] = om_degrees_count.get(value, 0) + 1
-    om_degrees_count = {int(key):om_degrees_count[key] for key in om_degrees_count.keys()}
-    with open(f"out/{classname}/{classname}.{onemode}.k.json", "w") as output_file:
-        json.dump(om_degrees_count, output_file, indent=4, sort_keys=True)
-    n = 0
-    for key, value in om_degrees_count.items():
-        n += value
-    k = 0
-    for key, value in om_degrees_count.items():
-        k += key * (value / n)
-    return k
-
-def combine_connectivities(classname, onemode, ncores):
-    """ Combine all multiprocessing connectivity dict files to single file, Count occurences of connectivity, Compute avg connectivity """
-    om_connectivity = {}
-    regex = f"{classname}.{onemode}.nc.[0-9][0-9][0-9][0-9].json"
-    mp_files = [mp_file for mp_file in os.listdir(f'out/{classname}') if re.match(regex, mp_file)]
-    for mp_file in mp_files:
-        with open(f"out/{classname}/" + mp_file, "r") as input_file:
-            mp_om_connectivity = json.load(input_file)
-            for key, value in mp_om_connectivity.items():
-                om_connectivity[key] = om_connectivity.get(key, 0) + value
-    with open(f"out/{classname}/{classname}.{onemode}.nc.json", "w") as output_file:
-        json.dump(om_connectivity, output_file, indent=4)
-
-    om_connectivity_count = {}
-    for key, value in om_connectivity.items():
-        om_connectivity_count[value] = om_connectivity_count.get(value, 0) + 1
-    om_connectivity_count = {int(key):om_connectivity_count[key] for key in om_connectivity_count.keys()}
-    with open(f"out/{classname}/{classname}.{onemode}.c.json", "w") as output_file:
-        json.dump(om_connectivity_count, output_file, indent=4, sort_keys=True)
-    n = 0
-    for key, value in om_connectivity_count.items():
-        n += value
-    c = 0
-    for key, value in om_connectivity_count.items():
-        c += key * (value / n)
-    return c
-
-def concatenate_el(classname, onemode):
-    """ Combine all multiprocessing edgelist files to single onemode edgelist file in shell """
-    os.system(f"cd out/{classname}; echo {onemode}1 {onemode}2 w > {classname}.{onemode}.csv")
-    os.system(f"cd out/{classname}; ls | grep {classname}\.[{onemode}]\.....\.'csv' | xargs cat >> {classname}.{onemode}.csv")
-
-def clean_out(classname, onemode):
-    """ Remove multiprocessing files """
-    os.system(f"cd out/{classname}; ls | grep {classname}\.[{onemode}]\.[w]\.....\.'json' | xargs rm")
-    os.system(f"cd out/{classname}; ls | grep {classname}\.[{onemode}]\.[k]\.....\.'json' | xargs rm")
-    os.system(f"cd out/{classname}; ls | grep {classname}\.[{onemode}]\.[n][c]\.....\.'json' | xargs rm")
-    os.system(f"cd out/{classname}; ls | grep {classname}\.[{onemode}]\.....\.'csv' | xargs rm")
+            members[opp_node] = member_ids
+    print(f"[Info] Count {onemode} with {len(members)} sparse and {len(hubs)} dense hub opposite nodes")
+    hub_matrix = np.zeros((n, len(hubs)), dtype=np.int8)
+    for hub, member_ids in enumerate(hub_members):
+        hub_matrix[member_ids, hub] = 1
+
+    om_counts = init_counts(n)
+    save_el = n < el_max_nodes
+    batch_limit = memory_limit
+    if not save_el:
+        w_max = max((len(neighbors) for node, neighbors in adj_list), default=0)
+        knc_stream = init_discarded_stream(superclass, onemode, n, w_max, memory_limit)
+        batch_limit = memory_limit / 2 # The other half holds the KNC stream or the buffer of its spill
+    batch_size = get_limit_edges(batch_limit, batch_size)
+    batch = []
+    batch_len = 0
+    with open_edgelist(superclass, onemode, save_el) as output_file:
+        for i, (node, neighbors) in enumerate(tqdm(adj_list)):
+            opp_nodes = [str(opp_node) for opp_node in neighbors]
+            row_hubs = [hubs[opp_node] for opp_node in opp_nodes if opp_node in hubs]
+            row_members = [members[opp_node] for opp_node in opp_nodes if opp_node in members]
+            successors = np.concatenate(row_members) if row_members else np.zeros(0, dtype=np.int64)
+            successors = successors[successors > i]
+            if row_hubs:
+                # Dense counting path, the row has about hub_fraction * n nonzero weights anyway
+                row_weights = hub_matrix[i + 1:, row_hubs].sum(axis=1).astype(np.int64)
+                row_weights += np.bincount(successors - (i + 1), minlength=n - i - 1)
+                cols = np.flatnonzero(row_weights)
+                weights = row_weights[cols]
+                cols += i + 1
+            else:
+                cols, weights = np.unique(successors, return_counts=True)
+            batch.append((np.full(len(cols), i), cols, weights))
+            batch_len += len(cols)
+            if batch_len >= batch_size or i == n - 1:
+                rows, cols, weights = (np.concatenate(arrays) for arrays in zip(*batch))
+                count_edges(om_counts, rows, cols, weights)
+                if save_el:
+                    write_onemode_edges(output_file, codes[rows], codes[cols], weights)
+                else:
+                    update_knc_stream(knc_stream, rows, cols, weights)
+                batch = []
+                batch_len = 0
+    if not save_el:
+        finish_projection_stream(superclass, onemode, knc_stream, om_counts, len(inv_adj_list))
+    # Distributions are indexed by node code, not by position in the adjacency list
+    code_counts = init_counts(n)
+    code_counts["w"] = om_counts["w"]
+    code_counts["k"][codes] = om_counts["k"]
+    code_counts["c"][codes] = om_counts["c"]
+    finish_projection(run_name, superclass, onemode, code_counts)
+
+def get_subclass_groups(classes):
+    """ Group the classes of a run derived from a superclass graph under their earliest superclass of the run """
+    groups = {}
+    for classname in classes:
+        root, t_map, b_map = classname, None, None
+        # Follow the derivation chain while the superclass is projected earlier in this run
+        while has_parent(root):
+            parent, parent_t_map, parent_b_map = read_parent(root)
+            if parent not in classes[:classes.index(root)]:
+                break
+            t_map = parent_t_map if t_map is None else parent_t_map[t_map]
+            b_map = parent_b_map if b_map is None else parent_b_map[b_map]
+            root = parent
+        if root != classname:
+            groups.setdefault(root, []).append((classname, t_map, b_map))
+    return groups
+
+@get_time
+def project_subclass_bots(run_name, superclass, subclasses, memory_limit=0):
+    """ Get the bot onemode graphs of all subclasses in one pass over groups of superclass top nodes with equal memberships """
+    biadjmatrix, _, _ = read_biadjacency(superclass)
+    n, n_b = biadjmatrix.shape
+    membership = np.zeros((n, len(subclasses)), dtype=bool)
+    for i, (classname, t_map, b_map) in enumerate(subclasses):
+        membership[t_map, i] = True
+    # Each group of top nodes is multiplied once and added to the bot products of all its subclasses
+    signatures, groups = np.unique(np.packbits(membership, axis=1), axis=0, return_inverse=True)
+    groups = groups.ravel()
+    bot_products = [sparse.csr_matrix((n_b, n_b), dtype=np.int64) for _ in subclasses]
+    # Accumulated products beyond the memory limit are spilled to sorted runs of each subclass and merged at the end
+    limit_edges = get_limit_edges(memory_limit, np.inf)
+    spills = [init_spill(classname, "b", np.inf) for classname, t_map, b_map in subclasses]
+    print(f"[Info] Multiply {len(signatures)} membership groups of {superclass} for {len(subclasses)} subclass bots")
+    group_rows = np.split(np.argsort(groups, kind="stable"), np.cumsum(np.bincount(groups))[:-1])
+    for rows in tqdm(group_rows):
+        members = np.flatnonzero(membership[rows[0]])
+        if len(members) == 0:
+            continue
+        block = biadjmatrix[rows].astype(np.int64)
+        product = (block.T @ block).tocsr()
+        for i in members:
+            bot_products[i] += product
+        if sum(bot_product.nnz for bot_product in bot_products) >= limit_edges:
+            for i, (classname, t_map, b_map) in enumerate(subclasses):
+                spill_bot_product(spills[i], bot_products[i], b_map)
+                bot_products[i] = sparse.csr_matrix((n_b, n_b), dtype=np.int64)
+    for i, (classname, t_map, b_map) in enumerate(subclasses):
+        print(f"[Info] Count b of {classname} from {superclass}")
+        if spills[i]["runs"]:
+            spill_bot_product(spills[i], bot_products[i], b_map)
+            edge_blocks = merge_spill(spills[i])
+        else:
+            wmatrix = sparse.triu(bot_products[i][b_map][:, b_map], k=1, format="coo")
+            edge_blocks = [(wmatrix.row, wmatrix.col, wmatrix.data.astype(np.int64))]
+        bot_products[i] = None
+        project_bot_weights(run_name, classname, edge_blocks, len(b_map), len(t_map), memory_limit)
+
+def spill_bot_product(spill, bot_product, b_map):
+    """ Write the upper triangle of the partial bot product of a subclass to a sorted run in subclass bot codes """
+    wmatrix = sparse.triu(bot_product[b_map][:, b_map], k=1, format="coo")
+    update_spill(spill, wmatrix.row, wmatrix.col, wmatrix.data.astype(np.int64))
+    write_run(spill)
+
+def project_bot_weights(run_name, classname, edge_blocks, n, n_opp, memory_limit=0):
+    """ Count weights, degrees and connectivities of a bot onemode graph from blocks of its upper triangular weights """
+    om_counts = init_counts(n)
+    save_el = n < el_max_nodes
+    if not save_el:
+        # A bot weight is at most the number of top nodes
+        knc_stream = init_discarded_stream(classname, "b", n, n_opp, memory_limit)
+    with open_edgelist(classname, "b", save_el) as output_file:
+        for rows, cols, weights in edge_blocks:
+            count_edges(om_counts, rows, cols, weights)
+            if save_el:
+                write_onemode_edges(output_file, rows, cols, weights)
+            else:
+                update_knc_stream(knc_stream, rows, cols, weights)
+    finish_projection(run_name, classname, "b", om_counts)
+    if not save_el:
+        finish_projection_stream(classname, "b", knc_stream, om_counts, n_opp)
 
 @get_ram
-def project_intersect_al(superclass, edgelist):
+def project_intersect_al(superclass, memory_limit=0):
     """ Project a bipartite graph to its onemode representations in edgelist format """
+    edgelist = read_code_edgelist(superclass)
+    block_size = get_limit_edges(memory_limit, 2**22)
     al_top = get_adjacencylist(edgelist, "t")
-    om_edges_top = project_intersect_al_onemode(al_top)
-    write_edgelist(superclass, "t", om_edges_top)
+    with open_onemode_edgelist(superclass, "t") as output_file:
+        project_intersect_al_onemode(al_top, output_file, block_size)
     al_bot = get_adjacencylist(edgelist, "b")
-    om_edges_bot = project_intersect_al_onemode(al_bot)
-    write_edgelist(superclass, "b", om_edges_bot)
+    with open_onemode_edgelist(superclass, "b") as output_file:
+        project_intersect_al_onemode(al_bot, output_file, block_size)
 
 @get_time
-def project_intersect_al_onemode(onemode_al):
-    """ Get a weigthed edgelist of a onemode graph by intersecting neighbor sets for each node combination """
+def project_intersect_al_onemode(onemode_al, output_file, block_size):
+    """ Write a weigthed edgelist of a onemode graph by intersecting neighbor sets for each node combination """
     om_edges = []
     n = len(onemode_al)
     n_iterations = int(n * (n - 1) * 0.5)
+    add_count(n_iterations, "pairs")
     for node_a, node_b in tqdm(combinations(onemode_al, 2), total=n_iterations):
         neighbors_a = node_a[1]
         neighbors_b = node_b[1]
         weight = len(set.intersection(neighbors_a, neighbors_b))
         if weight > 0:
             om_edges.append((int(node_a[0]), int(node_b[0]), weight))
-    return om_edges
+            if len(om_edges) >= block_size: # Edges are written in blocks instead of kept until the end
+                write_edges(output_file, om_edges)
+                om_edges = []
+    write_edges(output_file, om_edges)
+
+def write_edges(output_file, om_edges):
+    """ Append a block of weighted edge tuples of node codes to a binary onemode edgelist file """
+    edges = np.array(om_edges, dtype=np.int64).reshape(-1, 3)
+    write_onemode_edges(output_file, edges[:, 0], edges[:, 1], edges[:, 2])
 
 @get_time
 def get_adjacencylist(edgelist, onemode):
@@ -370,14 +771,40 @@ def main():
     if __name__ == "__main__":
         run_name = sys.argv[1][:-3]
         run = import_module(run_name)
-        
-        for superclass in run.config["classes"]:
-            print("\n[Project]", superclass)
-            try:
-                project_graph(run_name, superclass, run.config["project_method"])
-            except FileNotFoundError as e:
-                print(f"[Info] file not found {superclass} graph is the null graph\n{e}")
-            except KeyError as e:
-                sys.exit("[Error] Please specify project_method as <hyper;intersect_al;intersect;hop;dot;nx> in run config\n", e)
+        init_trace(run_name)
+        classes = run.config["classes"]
+        groups = {}
+        if run.config.get("incremental_projection", True) and run.config["project_method"] in ["hyper", "sparse", "inverted"]:
+            groups = get_subclass_groups(classes)
+        derived = {classname for subclasses in groups.values() for classname, t_map, b_map in subclasses}
+        memory_limit = run.config.get("memory_limit", 0) # GB, 0 for unlimited
+        approx_error = run.config.get("approx_error", 0) # 0 for exact projections
+        approx_confidence = run.config.get("approx_confidence", 0.95)
+
+        for superclass in sys.argv[2:] or classes: # Optional classes to project, e.g. by orchestrate.py
+            with span("project", stage="project", classname=superclass):
+                print("\n[Project]", superclass)
+                try:
+                    key = None
+                    # Classes projected together with their subclasses write artifacts of other classes
+                    if run.config.get("stage_cache", True) and superclass not in derived and superclass not in groups:
+                        key = get_stage_key("project", superclass, run.config, ["project_method", "approx_error", "approx_confidence"],
+                                            ["project_graph.py", "graph_io.py", "knc_stream.py", "approx.py", "spill.py", "sketch.py",
+                                             "results.py"], [("build", superclass)])
+                    if restore_stage(run_name, "project", superclass, key):
+                        continue
+                    snapshot = start_stage(superclass)
+                    # Bots of derived subclasses were counted together with their superclass
+                    onemodes = "t" if superclass in derived else "tb"
+                    project_graph(run_name, superclass, run.config["project_method"], onemodes, memory_limit,
+                                  approx_error, approx_confidence)
+                    if superclass in groups:
+                        project_subclass_bots(run_name, superclass, groups[superclass], memory_limit)
+                    store_stage("project", superclass, key, snapshot)
+                except FileNotFoundError as e:
+                    print(f"[Info] file not found {superclass} graph is the null graph\n{e}")
+                except KeyError as e:
+                    sys.exit(f"[Error] Please specify project_method as <hyper;sparse;inverted;intersect_al;intersect;hop;dot;nx> in run config\n{e}")
+        export_csv(run_name)
 
 main()
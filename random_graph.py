@@ -1,75 +1,118 @@
 """
-Generate a random graph edgelist based on top and bot degree sequences of real bipartite graphs.
+Generate an ensemble of random graphs with the top and bot degree sequences of real bipartite graphs.
+
+out/XRandom<i>/  sample i of the null model of class X in the binary graph format with the node labels of X
 """
 
 #!/usr/bin/python3
 
 import os
-import pandas as pd
-import networkx as nx
-
-def read_edgelist(classname, label):
-    """ Read real graph edgelist from csv file """
-    return pd.read_csv(f"out/{classname}/{classname}.{label}.csv")
-
-def write_edgelist(classname, edgelist):
-    """ Write random graph edgelist to csv file """
-    df = pd.DataFrame(edgelist, columns=["t", "b"])
-    df.to_csv(f"out/{classname}Random/{classname}Random.g.csv", index=False)
+import sys
+import zlib
+import numpy as np
+import multiprocessing as mp
+from tqdm import tqdm
+from importlib import import_module
+from logger import get_time, get_ram, init_trace, span
+from graph_io import read_graph, write_graph
+from results import add_results, export_csv
 
-def add_results(run_name, superclass, **results):
-    """ Append result columns in a superclass row """
-    df = pd.read_csv(f"out/_results_{run_name}.csv", index_col=0)
-    for resultname, result in results.items():
-        df.at[superclass, resultname] = result
-    df.to_csv(f"out/_results_{run_name}.csv")
+def get_null_classname(classname, sample):
+    """ Get the class name of a sample of the null model of a class """
+    return f"{classname}Random{sample}"
 
-# Classes of which to create randomized versions
-# with same and prescribed degree distribution
-# based on .g.csv
-classnames = [
-    "WrittenWork",
-    "Comic",
-    "ComicStrip",
-    "Manga",
-    "PeriodicalLiterature",
-    "AcademicJournal",
-    "Newspaper",
-    "Poem",
-]
+def is_member(sorted_keys, keys):
+    """ Check for each key whether it is in a sorted key array """
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys
 
-for classname in classnames:
-    if not os.path.exists(f"./out/{classname}Random"):
-        os.mkdir(f"./out/{classname}Random")
-    real_el = read_edgelist(classname, "g")
+def swap_edges(rng, t_codes, b_codes, n_b, swaps):
+    """ Randomize a simple bipartite graph by degree-preserving edge swaps, Return its edges and the swap acceptance rate """
+    t_codes = np.array(t_codes, dtype=np.int64)
+    b_codes = np.array(b_codes, dtype=np.int64)
+    m = len(t_codes)
+    keys = np.sort(t_codes * n_b + b_codes)
+    proposed = accepted = 0
+    while proposed < swaps and m >= 2:
+        # Each round proposes m / 2 swaps (t_i, b_i), (t_j, b_j) -> (t_i, b_j), (t_j, b_i) of disjoint edge pairs
+        order = rng.permutation(m)
+        edges_i, edges_j = order[:m // 2], order[m // 2:2 * (m // 2)]
+        new_i = t_codes[edges_i] * n_b + b_codes[edges_j]
+        new_j = t_codes[edges_j] * n_b + b_codes[edges_i]
+        # Swaps must not create an edge that exists before the round or that another swap of the round creates
+        valid = ~is_member(keys, new_i) & ~is_member(keys, new_j)
+        new_keys, counts = np.unique(np.concatenate((new_i[valid], new_j[valid])), return_counts=True)
+        collisions = new_keys[counts > 1]
+        valid &= ~is_member(collisions, new_i) & ~is_member(collisions, new_j)
+        edges_i, edges_j = edges_i[valid], edges_j[valid]
+        b_codes[edges_i], b_codes[edges_j] = b_codes[edges_j], b_codes[edges_i]
+        keys = np.sort(t_codes * n_b + b_codes)
+        proposed += m // 2
+        accepted += len(edges_i)
+    return t_codes, b_codes, accepted / proposed if proposed else 0.0
 
-    # Degree sequence for top and bot nodes
-    tseq = real_el["t"].value_counts().tolist()
-    bseq = real_el["b"].value_counts().tolist()
+def configure_edges(rng, t_codes, b_codes, n_b, tries):
+    """ Pair shuffled top and bot stubs of a bipartite graph until no edge repeats, None if all tries fail """
+    t_codes = np.asarray(t_codes, dtype=np.int64)
+    for _ in range(tries):
+        shuffled = rng.permutation(np.asarray(b_codes, dtype=np.int64))
+        if len(np.unique(t_codes * n_b + shuffled)) == len(t_codes):
+            return t_codes, shuffled
+    return None
 
-    # Configuration model
-        # Resulting degree sequences might not be exact, Simple graph, no multi graph with parallel edges
-    # G = nx.bipartite.configuration_model(tseq, bseq, create_using=nx.Graph())
-    # Havel Hakimi model
-        # High degree nodes connected with high degree nodes first
-        # High degree nodes connected with low degree nodes first
-        # High degree nodes connected alternating with high and low degree nodes
-    G = nx.bipartite.havel_hakimi_graph(tseq, bseq, create_using=nx.Graph())
+def sample_null_graph(classname, sample, null_model, swaps_per_edge, seed, tries=100):
+    """ Write a sample of the null model of a class, Return its name, number of nodes and edges and swap acceptance rate """
+    # Each sample has its own random stream, so the ensemble does not depend on the number of processes
+    rng = np.random.default_rng([seed, zlib.crc32(classname.encode()), sample])
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph(classname)
+    n_b, m = len(nodes_bot), len(t_codes)
+    edges = None
+    rate = None
+    if null_model == "configuration":
+        # Uniform over simple graphs with the degree sequences, but rarely simple for skewed degrees
+        edges = configure_edges(rng, t_codes, b_codes, n_b, tries)
+        if edges is None:
+            print(f"[Info] configuration model of {classname} not simple after {tries} tries, use edge swaps")
+    elif null_model != "swap":
+        raise ValueError(f"Unknown null model {null_model}")
+    if edges is None:
+        t_codes, b_codes, rate = swap_edges(rng, t_codes, b_codes, n_b, int(swaps_per_edge * m))
+    else:
+        t_codes, b_codes = edges
+    null_classname = get_null_classname(classname, sample)
+    os.makedirs(f"out/{null_classname}", exist_ok=True)
+    write_graph(null_classname, t_codes, b_codes, nodes_top, nodes_bot)
+    return null_classname, len(nodes_top), n_b, m, rate
 
-    write_edgelist(classname, G.edges)
+def sample_null_graph_star(args):
+    return sample_null_graph(*args)
 
-    n_t = len(tseq)
-    n_b = len(bseq)
-    m_g = G.number_of_edges()
-    dens_g = m_g / (n_t * n_b)
-    k_t = sum(tseq) / n_t
-    k_b = sum(bseq) / n_b
+@get_time
+@get_ram
+def main():
+    run_name = sys.argv[1][:-3]
+    run = import_module(run_name)
+    init_trace(run_name)
+    null_model = run.config.get("null_model", "swap")
+    samples = run.config.get("null_samples", 1)
+    swaps_per_edge = run.config.get("null_swaps", 10)
+    seed = run.config.get("null_seed", 0)
+    processes = run.config.get("null_processes", os.cpu_count())
 
-    add_results("random", f"{classname}Random",
-                n_t=n_t, n_b=n_b, m_g=m_g,
-                dens_g=dens_g, k_t=k_t, k_b=k_b)
+    for classname in sys.argv[2:] or run.config["null_classes"]: # Optional classes to randomize
+        with span("random", stage="random", classname=classname):
+            print(f"\n[Random] {classname} {samples} samples of {null_model} model")
+            sample_args = [(classname, sample, null_model, swaps_per_edge, seed) for sample in range(samples)]
+            with mp.Pool(min(processes, samples)) as pool:
+                for null_classname, n_t, n_b, m_g, rate in tqdm(pool.imap_unordered(sample_null_graph_star, sample_args), total=samples):
+                    if rate is not None:
+                        print(f"[Info] {null_classname} swap acceptance rate {rate:.4f}")
+                    add_results(run_name, null_classname,
+                                n_t=n_t, n_b=n_b, m_g=m_g,
+                                dens_g=m_g / (n_t * n_b), k_t_g=m_g / n_t, k_b_g=m_g / n_b)
+    export_csv(run_name)
 
-    edgelist = G.edges
-    print(f"[Info] {classname}")
-    print(f"n_t {n_t} n_b {n_b}")
-    print(f"m_g {len(pd.DataFrame(edgelist, columns=['t', 'b']).drop_duplicates())} unique out of {sum(tseq)} real")
+if __name__ == "__main__":
+    main()
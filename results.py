@@ -0,0 +1,138 @@
+"""
+Store the result columns of each class of a run in a SQLite database that parallel processes can write concurrently.
+
+out/_results_<run>.db  (class, result, value) rows in WAL mode, classes and results in order of their first insert
+out/_results_<run>.csv  wide table of classes and result columns exported from the database
+"""
+
+import os
+import sqlite3
+import pandas as pd
+
+# Names of results in csv files written by earlier versions of the scripts and their names in the database
+legacy_columns = {
+    "k_t": "k_t_g", "k_b": "k_b_g",
+    "k_t_om": "k_mean_t", "k_b_om": "k_mean_b",
+    "c_t_om": "c_mean_t", "c_b_om": "c_mean_b",
+}
+# Names of results in the database and their columns in the exported csv file
+csv_columns = {
+    "rc_t_dens": "rc_dens_t", "rc_b_dens": "rc_dens_b",
+    "rc_t_ncomp": "rc_ncomp_t", "rc_b_ncomp": "rc_ncomp_b",
+    "rc_t_slcc": "rc_slcc_t", "rc_b_slcc": "rc_slcc_b",
+    "avg_dens_t": "mean_dens_t", "avg_dens_b": "mean_dens_b",
+    "max_dens_t": "dens_t", "max_dens_b": "dens_b",
+    "n_disc_t": "ndisc_t", "n_disc_b": "ndisc_b",
+}
+csv_layout = [ # Column order of the exported csv file, Drop unwanted
+    'n_t', 'n_b', 'm_g', 'dens_g', 'k_t_g', 'k_b_g', 'ndisc_t', 'ndisc_b',
+    'm_t', 'dens_t', 'mean_dens_t', 'k_mean_t', 'k_med_t', 'k_sd_t', 'c_mean_t', 'c_med_t', 'c_sd_t','w_med_t', 'w_mean_t', 'w_sd_t',
+    'k_0_t', 'rc_dens_t', 'rc_ncomp_t', 'rc_slcc_t', 'rel_rc_t',
+    'rc_dens_10_t', 'rc_dens_50_t', 'knee_dens_t', 'knee_ncomp_t', 'knee_slcc_t',
+    'm_b', 'dens_b', 'mean_dens_b', 'k_mean_b', 'k_med_b', 'k_sd_b', 'c_mean_b', 'c_med_b', 'c_sd_b','w_med_b', 'w_mean_b', 'w_sd_b',
+    'k_0_b', 'rc_dens_b', 'rc_ncomp_b', 'rc_slcc_b', 'rel_rc_b',
+    'rc_dens_10_b', 'rc_dens_50_b', 'knee_dens_b', 'knee_ncomp_b', 'knee_slcc_b',
+    # 'superclass',
+]
+# Error bounds and confidence intervals, exported if a class of the run was estimated with an approx_error
+csv_approx_layout = [f"{name}_{onemode}" for onemode in "tb"
+                     for name in ["approx", "m_ci", "k_mean_ci", "c_mean_ci", "dens_ci", "rc_dens_ci"]]
+
+connections = {} # Database connection of each run opened by this process
+result_cache = {} # Result values of each run and class read or written by this process
+written_results = {} # Result values of each class written by this process since they were last popped
+
+def db_path(run_name):
+    """ Get the path of the results database of a run """
+    return f"out/_results_{run_name}.db"
+
+def csv_path(run_name):
+    """ Get the path of the exported results csv file of a run """
+    return f"out/_results_{run_name}.csv"
+
+def connect(run_name):
+    """ Open the results database of a run once per process, Migrate an existing results csv file into a new database """
+    if run_name not in connections:
+        is_new = not os.path.isfile(db_path(run_name))
+        connection = sqlite3.connect(db_path(run_name), timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL") # Readers never block the writer
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS classes (class TEXT PRIMARY KEY)")
+            connection.execute("CREATE TABLE IF NOT EXISTS columns (result TEXT PRIMARY KEY)")
+            connection.execute("CREATE TABLE IF NOT EXISTS results (class TEXT, result TEXT, value, PRIMARY KEY (class, result))")
+        connections[run_name] = connection
+        if is_new and os.path.isfile(csv_path(run_name)):
+            migrate_csv(run_name)
+    return connections[run_name]
+
+def migrate_csv(run_name):
+    """ Copy the result columns of a results csv file written before the database existed """
+    df = pd.read_csv(csv_path(run_name), index_col=0)
+    # Exported columns and results of earlier versions are stored under their names in the database
+    df = df.rename(columns={**legacy_columns, **{column: result for result, column in csv_columns.items()}})
+    for classname, row in df.iterrows():
+        add_results(run_name, classname, **row.dropna().to_dict())
+    print(f"[Info] migrate {len(df)} classes from {csv_path(run_name)}")
+
+def to_value(result):
+    """ Convert numpy scalars to python values that sqlite can store """
+    return result.item() if hasattr(result, "item") else result
+
+def add_results(run_name, superclass, **results):
+    """ Upsert result columns in a superclass row in one transaction """
+    results = {resultname: to_value(result) for resultname, result in results.items()}
+    connection = connect(run_name)
+    with connection:
+        connection.execute("INSERT OR IGNORE INTO classes (class) VALUES (?)", (superclass,))
+        connection.executemany("INSERT OR IGNORE INTO columns (result) VALUES (?)", [(resultname,) for resultname in results])
+        connection.executemany(
+            "INSERT INTO results (class, result, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (class, result) DO UPDATE SET value = excluded.value",
+            [(superclass, resultname, result) for resultname, result in results.items()])
+    result_cache.setdefault((run_name, superclass), {}).update(results)
+    written_results.setdefault(superclass, {}).update(results)
+
+def get_result(run_name, superclass, result):
+    """ Get the result value of a superclass, Read all its results once per process """
+    class_results = result_cache.get((run_name, superclass), {})
+    if result not in class_results:
+        rows = connect(run_name).execute("SELECT result, value FROM results WHERE class = ?", (superclass,))
+        class_results = result_cache.setdefault((run_name, superclass), {})
+        class_results.update(rows.fetchall())
+    return class_results[result]
+
+def get_first_class(run_name):
+    """ Get the class that was added first to the results of a run """
+    row = connect(run_name).execute("SELECT class FROM classes ORDER BY rowid LIMIT 1").fetchone()
+    return row[0] if row else None
+
+def pop_written_results(superclass):
+    """ Get and forget the result values written for a superclass by this process """
+    return written_results.pop(superclass, {})
+
+def read_results(run_name):
+    """ Read the results of a run as a data frame of classes and result columns in order of their first insert """
+    connection = connect(run_name)
+    df = pd.read_sql_query("SELECT class, result, value FROM results", connection)
+    classes = [row[0] for row in connection.execute("SELECT class FROM classes ORDER BY rowid")]
+    columns = [row[0] for row in connection.execute("SELECT result FROM columns ORDER BY rowid")]
+    df = df.pivot(index="class", columns="result", values="value")
+    df = df.reindex(index=classes, columns=columns)
+    df.index.name = None
+    df.columns.name = None
+    return df
+
+def get_csv_table(run_name):
+    """ Get the results of a run as a data frame with the columns of the results csv file in their order """
+    df = read_results(run_name).rename(columns=csv_columns)
+    columns = [column for column in csv_layout if column in df]
+    columns += [column for column in csv_approx_layout if column in df and df[column].notna().any()]
+    return df[columns]
+
+def export_csv(run_name):
+    """ Write the results of a run to the results csv file """
+    df = get_csv_table(run_name)
+    tmp_path = f"{csv_path(run_name)}.{os.getpid()}.tmp" # Concurrent scripts of a run export to their own file
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, csv_path(run_name)) # Readers never see a partial file
@@ -0,0 +1,13 @@
+config = {
+    # Synthetic bipartite graphs generated by benchmark.py, n_t top nodes (entities), n_b bot nodes (predicates), m edges
+    "graphs": [
+        {"model": "uniform", "n_t": 1000, "n_b": 200, "m": 10000},
+        {"model": "powerlaw", "n_t": 1000, "n_b": 200, "m": 10000, "exponent": 1.5},
+        {"model": "communities", "n_t": 1000, "n_b": 200, "m": 10000, "communities": 4, "p_in": 0.9},
+    ],
+    "scales": [1, 2, 4],  # Factors of n_t, n_b and m of each graph for the time and memory curves
+    "project_methods": ["hyper", "sparse", "inverted", "intersect_al"],  # The first method is the reference
+    "knc_methods": ["unionfind", "stream", "weights"],
+    "memory_limit": 0,
+    "seed": 0,
+}
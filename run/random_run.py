@@ -1,17 +1,27 @@
+null_classes = [ # Classes of which to create randomized versions with the same degree sequences
+    "WrittenWork",
+    "Comic",
+    "ComicStrip",
+    "Manga",
+    "PeriodicalLiterature",
+    "AcademicJournal",
+    "Newspaper",
+    "Poem",
+]
+null_samples = 100
+
 config = {
-    "classes": [
-                "WrittenWorkRandom",
-                "ComicRandom",
-                "ComicStripRandom",
-                "MangaRandom",
-                "PeriodicalLiteratureRandom",
-                "AcademicJournalRandom",
-                "NewspaperRandom",
-                "PoemRandom",
-                ],
+    # Samples written by random_graph.py from the graphs of the null classes built beforehand
+    "classes": [f"{classname}Random{sample}" for classname in null_classes for sample in range(null_samples)],
+    "null_classes": null_classes,
+    "null_samples": null_samples,
+    "null_model": "swap",
+    "null_swaps": 10,
+    "null_seed": 0,
     "project_method": "hyper",
-    "kg_source": "kg/dbpedia2016-04en.hdt",
+    "kg_source": "random",
     "kg_ontology": "kg/dbpedia.owl",
     "subject_limit": 0,
     "predicate_limit": 0,
+    "stage_cache": False,
 }
@@ -0,0 +1,76 @@
+"""
+Find the node pairs of a onemode graph with weight >= min_weight without intersecting all neighbor sets.
+
+Nodes with fewer than min_weight neighbors are skipped, since a weight is at most min(|A|, |B|). The neighbor sets of the
+other nodes get MinHash signatures, pairs that share a bucket of an LSH band are candidates, and their weight is verified
+exactly. Pairs with weight >= min_weight but a low Jaccard similarity can be missed, so the edges found are a subset.
+"""
+
+import numpy as np
+
+prime = 2**31 - 1 # Modulus of the MinHash functions, larger than any node code
+
+def get_pair_weights(biadjmatrix, rows_a, rows_b, batch_size=2**16):
+    """ Get the number of common neighbors of pairs of rows of a binary CSR biadjacency matrix """
+    weights = []
+    for start in range(0, len(rows_a), batch_size):
+        end = start + batch_size
+        common = biadjmatrix[rows_a[start:end]].multiply(biadjmatrix[rows_b[start:end]]).sum(axis=1)
+        weights.append(np.asarray(common, dtype=np.int64).ravel())
+    return np.concatenate(weights) if weights else np.zeros(0, dtype=np.int64)
+
+def get_signatures(biadjmatrix, nodes, perms, rng):
+    """ Get the MinHash signatures of the neighbor sets of nodes, one column per hash function """
+    rows = biadjmatrix[nodes]
+    starts = rows.indptr[:-1]
+    signatures = np.empty((len(nodes), perms), dtype=np.int64)
+    params = rng.integers(1, prime, size=(perms, 2))
+    for i, (a, b) in enumerate(params):
+        hashes = (a * rows.indices.astype(np.int64) + b) % prime
+        signatures[:, i] = np.minimum.reduceat(hashes, starts) # All rows have at least min_weight >= 1 neighbors
+    return signatures
+
+def get_band_keys(signatures, bands, rows, rng):
+    """ Yield one 64 bit bucket key per node for each LSH band of rows signature columns """
+    multipliers = rng.integers(1, 2**63, size=rows, dtype=np.uint64) | np.uint64(1)
+    for band in range(bands):
+        band_signatures = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        # Colliding keys only add candidates, their weights are verified
+        yield (band_signatures * multipliers).sum(axis=1, dtype=np.uint64)
+
+def get_bucket_pairs(nodes, keys, max_bucket):
+    """ Get the pairs of nodes with the same key, Chain the nodes of buckets larger than max_bucket instead """
+    order = np.argsort(keys, kind="stable")
+    keys, nodes = keys[order], nodes[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    sizes = np.diff(np.concatenate((starts, [len(keys)])))
+    pairs_a, pairs_b = [], []
+    for size in np.unique(sizes[(sizes > 1) & (sizes <= max_bucket)]):
+        # All pairs of the buckets of one size at once
+        members = nodes[starts[sizes == size][:, None] + np.arange(size)]
+        first, second = np.triu_indices(size, k=1)
+        pairs_a.append(members[:, first].ravel())
+        pairs_b.append(members[:, second].ravel())
+    # Large buckets, e.g. of nodes with the same neighbor set, are connected through their consecutive members
+    chained = np.repeat(sizes > max_bucket, sizes)[:-1] & (keys[1:] == keys[:-1])
+    pairs_a.append(nodes[:-1][chained])
+    pairs_b.append(nodes[1:][chained])
+    return np.concatenate(pairs_a), np.concatenate(pairs_b)
+
+def get_sketch_edges(biadjmatrix, min_weight, bands=64, rows=2, max_bucket=64, seed=0):
+    """ Get the onemode edges with weight >= min_weight found by LSH as (node_a, node_b, w) rows and the number of candidates """
+    rng = np.random.default_rng(seed)
+    degrees = np.diff(biadjmatrix.indptr)
+    nodes = np.flatnonzero(degrees >= min_weight)
+    if len(nodes) < 2:
+        return np.zeros((0, 3), dtype=np.int64), 0
+    signatures = get_signatures(biadjmatrix, nodes, bands * rows, rng)
+    candidates = []
+    for keys in get_band_keys(signatures, bands, rows, rng):
+        nodes_a, nodes_b = get_bucket_pairs(nodes, keys, max_bucket)
+        candidates.append(np.minimum(nodes_a, nodes_b) * len(degrees) + np.maximum(nodes_a, nodes_b))
+    candidates = np.unique(np.concatenate(candidates))
+    nodes_a, nodes_b = candidates // len(degrees), candidates % len(degrees)
+    weights = get_pair_weights(biadjmatrix, nodes_a, nodes_b)
+    edges = weights >= min_weight
+    return np.column_stack((nodes_a[edges], nodes_b[edges], weights[edges])), len(candidates)
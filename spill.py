@@ -0,0 +1,103 @@
+"""
+Accumulate weighted onemode edges within a memory limit by spilling them to sorted runs on disk and merging the runs.
+
+out/_spill/X.<onemode>.<run>.bin  (row, col, w) records of a run sorted by (row, col) with unique pairs
+out/_spill/X.<onemode>.w.<run>.bin  (row, col, w) records of a run of unique pairs sorted by descending w
+"""
+
+import os
+import numpy as np
+
+run_dtype = np.dtype([("row", "<i4"), ("col", "<i4"), ("w", "<i8")])
+spill_bytes = 64 # Upper bound of the bytes a buffered edge takes while it is sorted and summed
+
+def get_limit_edges(memory_limit, default):
+    """ Get the number of edges that fit into a memory limit in GB, The default if there is no limit """
+    if not memory_limit:
+        return default
+    return max(2**16, int(memory_limit * 1024**3 / spill_bytes))
+
+def init_spill(classname, onemode, limit_edges, by_weight=False):
+    """ Get an empty spill of a onemode graph that keeps at most limit_edges buffered edges in memory """
+    # Spills by weight take each pair once, e.g. for a KNC sweep over the edges of descending weight
+    prefix = f"out/_spill/{classname}.{onemode}.w" if by_weight else f"out/_spill/{classname}.{onemode}"
+    return {"prefix": prefix, "limit_edges": limit_edges, "by_weight": by_weight,
+            "blocks": [], "buffered": 0, "runs": []}
+
+def update_spill(spill, rows, cols, weights):
+    """ Add a block of weighted edges, Spill the buffered edges to a sorted run if they exceed the limit """
+    spill["blocks"].append((rows, cols, weights))
+    spill["buffered"] += len(weights)
+    if spill["buffered"] >= spill["limit_edges"]:
+        write_run(spill)
+
+def sum_edges(rows, cols, weights):
+    """ Sort weighted edges by (row, col) and sum the weights of equal pairs into one record array """
+    keys = (rows.astype(np.int64) << 32) | cols.astype(np.int64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    records = np.empty(len(keys), dtype=run_dtype)
+    records["row"] = keys >> 32
+    records["col"] = keys & 0xFFFFFFFF
+    records["w"] = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys)).astype(np.int64)
+    return records
+
+def sort_edges(spill, rows, cols, weights):
+    """ Get weighted edges as records in the order of the runs of a spill """
+    if not spill["by_weight"]:
+        return sum_edges(rows, cols, weights)
+    order = np.argsort(-weights, kind="stable")
+    records = np.empty(len(weights), dtype=run_dtype)
+    records["row"], records["col"], records["w"] = rows[order], cols[order], weights[order]
+    return records
+
+def get_buffered(spill):
+    """ Get the buffered edges of a spill as sorted records with unique pairs, Empty the buffer """
+    blocks = spill["blocks"]
+    spill["blocks"] = []
+    spill["buffered"] = 0
+    if not blocks:
+        return np.zeros(0, dtype=run_dtype)
+    rows, cols, weights = (np.concatenate(arrays) for arrays in zip(*blocks))
+    return sort_edges(spill, rows, cols, weights)
+
+def write_run(spill):
+    """ Write the buffered edges of a spill to the next sorted run file """
+    records = get_buffered(spill)
+    if len(records) == 0:
+        return
+    os.makedirs(os.path.dirname(spill["prefix"]), exist_ok=True)
+    run_path = f"{spill['prefix']}.{len(spill['runs']):04}.bin"
+    records.tofile(run_path)
+    spill["runs"].append(run_path)
+    print(f"[Info] Spill {len(records)} edges to {run_path}")
+
+def merge_spill(spill, block_size=2**22):
+    """ Yield all edges of a spill as (rows, cols, weights) blocks sorted by (row, col) with the weights of equal pairs summed,
+    Or sorted by descending weight """
+    runs = [np.memmap(run_path, dtype=run_dtype, mode="r") for run_path in spill["runs"]]
+    runs.append(get_buffered(spill))
+    window = max(1, block_size // len(runs))
+    positions = [0] * len(runs)
+    while any(position < len(run) for position, run in zip(positions, runs)):
+        windows = [run[position:position + window] for position, run in zip(positions, runs)]
+        # Records up to the smallest last key of all windows that do not reach the end of their run are complete
+        frontier = min((get_keys(spill, records[-1:])[0] for position, run, records in zip(positions, runs, windows)
+                        if position + window < len(run)), default=np.iinfo(np.int64).max)
+        parts = []
+        for i, records in enumerate(windows):
+            end = int(np.searchsorted(get_keys(spill, records), frontier, side="right"))
+            parts.append(records[:end])
+            positions[i] += end
+        merged = np.concatenate(parts)
+        if len(runs) > 1:
+            merged = sort_edges(spill, merged["row"], merged["col"], merged["w"])
+        yield merged["row"], merged["col"], merged["w"]
+    for run_path in spill["runs"]:
+        os.remove(run_path)
+    spill["runs"] = []
+
+def get_keys(spill, records):
+    """ Get the (row, col) or descending weight sort keys of run records """
+    if spill["by_weight"]:
+        return -records["w"]
+    return (records["row"].astype(np.int64) << 32) | records["col"].astype(np.int64)
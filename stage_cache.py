@@ -0,0 +1,140 @@
+"""
+Cache the artifacts and result columns of a pipeline stage of a class under a key of all its inputs.
+
+out/_cache/<stage>/<key>/  artifact files, results.json and manifest.json of a stage run of a class
+out/X/X.<stage>.json  key of the stage run that produced the current artifacts of X and their fingerprints
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from results import add_results, pop_written_results
+
+stages = ["build", "project", "compute", "analyze"]
+
+def hash_file(path, block_size=2**20):
+    """ Get the sha256 hex digest of a file """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+def fingerprint_file(path, hash_max_size=2**26):
+    """ Get the content hash of a small file, Size and modification time of a large file (e.g. a HDT source) """
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    if stat.st_size <= hash_max_size:
+        return hash_file(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def get_stage_key(stage, classname, config, config_keys, sources=(), upstream=()):
+    """ Get the cache key of a stage of a class, None if the artifacts of an upstream stage have unknown inputs """
+    upstream_keys = []
+    for upstream_stage, upstream_class in upstream:
+        upstream_key = read_stage_key(upstream_stage, upstream_class)
+        if upstream_key is None:
+            return None
+        upstream_keys.append(upstream_key)
+    inputs = {
+        "stage": stage,
+        "class": classname,
+        "config": {config_key: config.get(config_key) for config_key in config_keys},
+        "sources": {source: fingerprint_file(source) for source in sources},
+        "upstream": upstream_keys,
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+def marker_path(stage, classname):
+    """ Get the path of the file recording the stage key of the current artifacts of a class """
+    return f"out/{classname}/{classname}.{stage}.json"
+
+def list_files(classname):
+    """ Get size and modification time of each artifact file of a class """
+    class_dir = f"out/{classname}"
+    if not os.path.isdir(class_dir):
+        return {}
+    markers = {os.path.basename(marker_path(stage, classname)) for stage in stages}
+    files = {}
+    for entry in os.scandir(class_dir):
+        if entry.is_file() and entry.name not in markers:
+            stat = entry.stat()
+            files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+def read_stage_key(stage, classname):
+    """ Get the key of the stage run that produced the current artifacts of a class, None if they changed since """
+    if not os.path.isfile(marker_path(stage, classname)):
+        return None
+    with open(marker_path(stage, classname), "r") as input_file:
+        marker = json.load(input_file)
+    files = list_files(classname)
+    for name, fingerprint in marker["artifacts"].items():
+        if files.get(name) != fingerprint:
+            return None
+    return marker["key"]
+
+def write_stage_key(stage, classname, key, artifacts):
+    """ Record the stage key and the fingerprints of the artifacts it produced for a class """
+    files = list_files(classname)
+    with open(marker_path(stage, classname), "w") as output_file:
+        json.dump({"key": key, "artifacts": {name: files[name] for name in artifacts}}, output_file, indent=4)
+
+def clear_stage(stage, classname):
+    """ Remove the artifacts the last run of a stage wrote for a class, e.g. an edgelist a restored run did not write """
+    if not os.path.isfile(marker_path(stage, classname)):
+        return
+    with open(marker_path(stage, classname), "r") as input_file:
+        artifacts = json.load(input_file)["artifacts"]
+    for name in artifacts:
+        if os.path.isfile(f"out/{classname}/{name}"):
+            os.remove(f"out/{classname}/{name}")
+
+def start_stage(classname):
+    """ Snapshot the artifact files of a class before a stage runs """
+    pop_written_results(classname)
+    return list_files(classname)
+
+def store_stage(stage, classname, key, files_before):
+    """ Save the artifacts and result columns a stage run wrote for a class in the cache under its key """
+    files = list_files(classname)
+    artifacts = sorted(name for name, fingerprint in files.items() if files_before.get(name) != fingerprint)
+    results = pop_written_results(classname)
+    if key is None:
+        # Unknown inputs, but a later restore still has to clear the artifacts
+        write_stage_key(stage, classname, None, artifacts)
+        return
+    cache_dir = f"out/_cache/{stage}/{key}"
+    # Fill a temporary directory first, so an interrupted run never leaves a partial cache entry
+    shutil.rmtree(cache_dir + ".tmp", ignore_errors=True)
+    os.makedirs(cache_dir + ".tmp")
+    for name in artifacts:
+        shutil.copy2(f"out/{classname}/{name}", f"{cache_dir}.tmp/{name}")
+    with open(f"{cache_dir}.tmp/results.json", "w") as output_file:
+        json.dump(results, output_file, indent=4)
+    with open(f"{cache_dir}.tmp/manifest.json", "w") as output_file:
+        json.dump({"stage": stage, "class": classname, "artifacts": artifacts}, output_file, indent=4)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(cache_dir + ".tmp", cache_dir)
+    write_stage_key(stage, classname, key, artifacts)
+
+def restore_stage(run_name, stage, classname, key):
+    """ Copy the cached artifacts and result columns of a stage run of a class back, Return whether there was one """
+    cache_dir = f"out/_cache/{stage}/{key}"
+    if key is None or not os.path.isdir(cache_dir):
+        return False
+    with open(f"{cache_dir}/manifest.json", "r") as input_file:
+        artifacts = json.load(input_file)["artifacts"]
+    with open(f"{cache_dir}/results.json", "r") as input_file:
+        results = json.load(input_file)
+    os.makedirs(f"out/{classname}", exist_ok=True)
+    clear_stage(stage, classname)
+    for name in artifacts:
+        shutil.copy2(f"{cache_dir}/{name}", f"out/{classname}/{name}")
+    if results:
+        add_results(run_name, classname, **results)
+    write_stage_key(stage, classname, key, artifacts)
+    print(f"[Info] restore {stage} of {classname} from cache {key[:12]}")
+    return True
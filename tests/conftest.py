@@ -0,0 +1,37 @@
+import os
+import sys
+import pytest
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import results
+from graph_io import write_graph_edgelist
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """ Run a test in an empty directory with an out/ directory and fresh result connections """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("out")
+    for cache in (results.connections, results.result_cache, results.written_results):
+        cache.clear()
+    yield tmp_path
+    for connection in results.connections.values():
+        connection.close()
+    for cache in (results.connections, results.result_cache, results.written_results):
+        cache.clear()
+
+@pytest.fixture
+def load_graph(workdir):
+    """ Copy a graph of test-graphs/ to out/ with its build results, like build_graph.py """
+    def load(name, classname=None):
+        classname = classname or name
+        df = pd.read_csv(os.path.join(root, "test-graphs", f"{name}.g.csv"))
+        os.makedirs(f"out/{classname}", exist_ok=True)
+        write_graph_edgelist(classname, df.itertuples(index=False, name=None))
+        n_t, n_b, m_g = df["t"].nunique(), df["b"].nunique(), len(df)
+        results.add_results("test", classname, n_t=n_t, n_b=n_b, m_g=m_g,
+                            dens_g=m_g / (n_t * n_b), k_t_g=m_g / n_t, k_b_g=m_g / n_b)
+        return df
+    return load
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from scipy import sparse
+from approx import scale_counts, get_pair_count, get_mean_ci
+from graph_io import read_frequencies, read_biadjacency
+from compute_knc import get_density_curve
+from project_graph import project_approx_onemode, project_sparse_onemode
+from results import get_result
+
+def read_density_curve(classname, k_max, n):
+    """ Read the density of a top onemode graph at each k from 1 to k_max from its weight distribution """
+    weights, counts = read_frequencies(classname, "t", "w")
+    return get_density_curve(weights, counts, np.arange(1, k_max + 1), get_pair_count(n))
+
+def test_scale_counts_sum_to_total():
+    rng = np.random.default_rng(0)
+    for total in [0, 1, 7, 499500, 10**15 + 3]:
+        values, counts = scale_counts(rng.integers(5, size=1001), total)
+        assert counts.sum() == total
+        assert np.all(counts >= 0)
+    # Counts are scaled in proportion, the largest remainders get the missing items
+    assert scale_counts(np.array([1, 1, 2, 3, 3, 3]), 10)[1].tolist() == [3, 2, 5]
+
+def test_estimate_is_within_error_of_projection(load_graph):
+    load_graph("HighUniform", "Exact")
+    load_graph("HighUniform", "Estimated")
+    biadjmatrix, _, _ = read_biadjacency("Exact")
+    n, n_opp = biadjmatrix.shape
+    project_sparse_onemode("test", "Exact", "t", biadjmatrix)
+    project_approx_onemode("test", "Estimated", "t", biadjmatrix, 0.02, 0.95)
+    exact = read_density_curve("Exact", n_opp, n)
+    estimated = read_density_curve("Estimated", n_opp, n)
+    assert np.abs(estimated - exact).max() <= 0.02
+    assert abs(get_result("test", "Estimated", "m_t") - get_result("test", "Exact", "m_t")) <= get_result("test", "Estimated", "m_ci_t")
+    k_mean, k_mean_ci = get_result("test", "Estimated", "k_mean_t"), get_result("test", "Estimated", "k_mean_ci_t")
+    assert abs(k_mean - get_result("test", "Exact", "k_mean_t")) <= k_mean_ci
+    # A sample of the whole population has no error
+    assert get_mean_ci(np.arange(10), 10, 0.95) == 0.0
+
+def project_approx(superclass, biadjmatrix):
+    os.makedirs(f"out/{superclass}")
+    project_approx_onemode("test", superclass, "t", biadjmatrix, 0.01, 0.95)
+    n = biadjmatrix.shape[0]
+    pairs = read_frequencies(superclass, "t", "w")[1].sum()
+    return pairs, get_result("test", superclass, "m_t"), read_density_curve(superclass, biadjmatrix.shape[1], n)
+
+def test_approx_complete_graph(workdir):
+    # All top nodes share one bot node
+    n = 1000
+    biadjmatrix = sparse.csr_matrix(np.ones((n, 1), dtype=np.int32))
+    pairs, m, density = project_approx("Complete", biadjmatrix)
+    assert pairs == get_pair_count(n)
+    assert m == get_pair_count(n)
+    assert density[0] == 1.0
+
+def test_approx_near_complete_graph(workdir):
+    # One top node has its own bot node
+    n = 1000
+    biadjmatrix = sparse.csr_matrix(np.vstack((np.tile([1, 0], (n - 1, 1)), [0, 1])).astype(np.int32))
+    pairs, m, density = project_approx("NearComplete", biadjmatrix)
+    assert pairs == get_pair_count(n)
+    assert m <= get_pair_count(n)
+    assert np.all(density <= 1.0)
@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+import networkx as nx
+from compute_knc import compute_knc_onemode, get_density_curve
+
+def compute_knc_networkx(edgelist, k_max):
+    """ Compute KNC points like the networkx implementation that removed the edges below each k """
+    onemode_graph = nx.Graph()
+    onemode_graph.add_weighted_edges_from(edgelist.tolist())
+    knc_list = []
+    for k in range(1, k_max + 1):
+        onemode_graph.remove_edges_from([(a, b) for a, b, w in onemode_graph.edges.data("weight") if w < k])
+        density = nx.density(onemode_graph)
+        ncomponents = nx.number_connected_components(onemode_graph)
+        slcc = len(max(nx.connected_components(onemode_graph), key=len))
+        knc_list.append((k, density, ncomponents, slcc))
+    return knc_list
+
+def get_random_edgelist(n, m, w_max, seed):
+    """ Get m weighted edges between distinct pairs of n nodes with sparse node codes """
+    rng = np.random.default_rng(seed)
+    pairs = np.array([(a, b) for a in range(n) for b in range(a + 1, n)])
+    pairs = pairs[rng.choice(len(pairs), m, replace=False)] * 7
+    return np.column_stack((pairs, rng.integers(1, w_max + 1, m)))
+
+edgelists = {
+    # Two triangles joined at weight 1, a pair at weight 4 and a chain that breaks up one edge at a time
+    "hand": np.array([[0, 1, 3], [1, 2, 3], [0, 2, 2], [2, 3, 1], [3, 4, 2], [4, 5, 2], [3, 5, 1],
+                      [10, 11, 4], [20, 21, 1], [21, 22, 2], [22, 23, 3]]),
+    "random": get_random_edgelist(30, 120, 6, seed=0),
+}
+
+@pytest.mark.parametrize("name", edgelists)
+def test_union_find_matches_networkx(name):
+    edgelist = edgelists[name]
+    k_max = int(edgelist[:, 2].max()) + 2 # Also the points after the graph fell apart
+    expected = compute_knc_networkx(edgelist, k_max)
+    knc_list = compute_knc_onemode(edgelist, k_max)
+    assert [(k, ncomponents, slcc) for k, density, ncomponents, slcc in knc_list] == \
+           [(k, ncomponents, slcc) for k, density, ncomponents, slcc in expected]
+    assert [density for k, density, ncomponents, slcc in knc_list] == \
+           pytest.approx([density for k, density, ncomponents, slcc in expected])
+
+def test_density_curve_counts_edges_from_each_k():
+    weights = np.array([0, 1, 2, 5, 9])
+    counts = np.array([30, 8, 4, 2, 1])
+    ks = np.arange(1, 12)
+    density = get_density_curve(weights, counts, ks, edges_max=45)
+    expected = [counts[(weights > 0) & (weights >= k)].sum() / 45 for k in ks]
+    assert density == pytest.approx(expected)
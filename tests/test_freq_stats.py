@@ -0,0 +1,40 @@
+import pytest
+import numpy as np
+from freq_stats import get_size, get_mean, get_median, get_quantile, get_moment, get_stdev
+
+tables = {
+    "ints": (np.array([0, 1, 2, 5, 9]), np.array([3, 1, 4, 1, 5])),
+    "floats": (np.array([-1.5, 0.25, 2.0, 7.75]), np.array([2, 7, 1, 3])),
+    "zero_counts": (np.array([1, 2, 3, 4]), np.array([0, 5, 0, 2])),
+    "single": (np.array([4]), np.array([6])),
+}
+
+@pytest.mark.parametrize("name", tables)
+@pytest.mark.parametrize("method", ["linear", "inverted_cdf"])
+def test_quantile_matches_numpy(name, method):
+    values, counts = tables[name]
+    sample = np.repeat(values, counts)
+    for q in [0, 0.1, 0.25, 0.3, 0.5, 0.75, 0.9, 0.99, 1]:
+        assert get_quantile(values, counts, q, method) == pytest.approx(np.quantile(sample, q, method=method))
+    assert get_median(values, counts) == pytest.approx(np.median(sample))
+
+@pytest.mark.parametrize("name", tables)
+def test_moments_match_numpy(name):
+    values, counts = tables[name]
+    sample = np.repeat(values, counts).astype(np.float64)
+    assert get_size(counts) == len(sample)
+    assert get_mean(values, counts) == pytest.approx(np.mean(sample))
+    assert get_stdev(values, counts) == pytest.approx(np.std(sample))
+    for order in [1, 2, 3, 4]:
+        assert get_moment(values, counts, order, central=False) == pytest.approx(np.mean(sample ** order))
+        assert get_moment(values, counts, order) == pytest.approx(np.mean((sample - sample.mean()) ** order), abs=1e-9)
+
+def test_empty_table_has_no_statistics():
+    values, counts = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    assert get_size(counts) == 0
+    assert get_mean(values, counts) is None
+    assert get_quantile(values, counts, 0.5) is None
+    assert get_quantile(values, counts, 0.5, "inverted_cdf") is None
+    assert get_median(values, counts) is None
+    assert get_moment(values, counts, 2) is None
+    assert get_stdev(values, counts) is None
@@ -0,0 +1,22 @@
+import numpy as np
+from knc_stream import init_knc_stream, update_knc_stream, finish_knc_stream
+from spill import init_spill
+
+def test_spilled_stream_matches_stream(workdir):
+    rng = np.random.default_rng(0)
+    n = 200
+    pairs = rng.choice(n * n, size=1500, replace=False)
+    rows, cols = pairs // n, pairs % n
+    keep = rows < cols
+    rows, cols = rows[keep], cols[keep]
+    weights = rng.integers(1, 12, size=len(rows))
+    # The spill writes a sorted run every 50 edges, so the sweep merges many runs
+    streams = [init_knc_stream(n), init_knc_stream(n, init_spill("X", "t", 50, by_weight=True))]
+    for start in range(0, len(weights), 64):
+        for stream in streams:
+            update_knc_stream(stream, rows[start:start + 64], cols[start:start + 64], weights[start:start + 64])
+    assert len(streams[1]["spill"]["runs"]) > 1
+    weight_counts = np.bincount(weights)
+    degrees = np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n)
+    assert (finish_knc_stream(streams[0], weight_counts, degrees, 15)
+            == finish_knc_stream(streams[1], weight_counts, degrees, 15))
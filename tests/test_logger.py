@@ -0,0 +1,18 @@
+import logger
+from logger import span, read_trace, aggregate_spans
+
+def test_span_records_growth_of_process_peak(workdir, monkeypatch):
+    monkeypatch.setitem(logger.trace, "path", None) # Later tests do not write to the trace of this directory
+    monkeypatch.setenv("TRACE_SESSION", "test")
+    logger.init_trace("test")
+    with span("grow"):
+        block = b"x" * (512 * 1024 ** 2) # Above the peak of the test process so far
+        del block
+    with span("idle"):
+        pass
+    spans = {record["name"]: record for record in read_trace(logger.trace["path"])}
+    assert spans["grow"]["rss_growth"] > 0.4
+    assert spans["idle"]["rss_growth"] == 0.0
+    assert spans["idle"]["max_rss"] >= spans["grow"]["max_rss"] # Process peak is not reset by a span
+    totals = aggregate_spans(spans.values())
+    assert totals[(f"{spans['grow']['script']}:grow", "", "")]["rss_growth"] == spans["grow"]["rss_growth"]
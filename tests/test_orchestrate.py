@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+from orchestrate import get_skipped, get_ancestors
+
+def test_skip_three_level_chain():
+    # Grandchild and child are listed before the task they depend on
+    tasks = {
+        ("Grandchild", "build"): [("Child", "build")],
+        ("Child", "build"): [("Parent", "build")],
+        ("Parent", "build"): [],
+        ("Other", "build"): [],
+    }
+    pending = [("Grandchild", "build"), ("Child", "build"), ("Other", "build")]
+    skipped = get_skipped(tasks, pending, {("Parent", "build")})
+    assert skipped == [("Grandchild", "build"), ("Child", "build")]
+
+def test_skip_nothing_without_failure():
+    tasks = {("A", "build"): [], ("A", "project"): [("A", "build")]}
+    assert get_skipped(tasks, [("A", "project")], set()) == []
+
+def test_ancestors_from_ontology(workdir):
+    with open("ontology.ttl", "w") as output_file:
+        output_file.write("""
+            @prefix rdfs: <http://www.w3.org/2000/01/rdf-schema#> .
+            @prefix dbo: <http://dbpedia.org/ontology/> .
+            dbo:Athlete rdfs:subClassOf dbo:Person .
+            dbo:Boxer rdfs:subClassOf dbo:Athlete .
+        """)
+    run = SimpleNamespace(config={"classes": ["Person", "Boxer", "Athlete", "Place"], "kg_source": "kg/dbpedia2016-04en.hdt",
+                                  "kg_ontology": "ontology.ttl", "subject_limit": 0})
+    # Only classes listed earlier in the run are ancestors
+    assert get_ancestors(run) == {"Person": [], "Boxer": ["Person"], "Athlete": ["Person"], "Place": []}
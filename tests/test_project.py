@@ -0,0 +1,150 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from collections import Counter
+import project_graph
+import results
+from graph_io import onemode_path, read_onemode_edgelist, read_distribution, read_graph, write_graph
+from compute_knc import compute_knc
+
+graphs = ["Cluster", "FiveFour", "FullUniformSmall", "KaMusicians", "NotConnected", "OneCommon"]
+
+def read_edges(classname, onemode):
+    """ Read a onemode edgelist as a set of (node_a, node_b, w) with node_a < node_b """
+    return {(min(a, b), max(a, b), w) for a, b, w in read_onemode_edgelist(classname, onemode).tolist()}
+
+def read_distributions(classname, onemode):
+    """ Read the w, k and c distributions of a onemode graph as {value: count} """
+    return {dist: read_distribution(classname, onemode, dist) for dist in "wkc"}
+
+def get_distributions(edges, n):
+    """ Get the w, k and c distributions of a onemode graph with n nodes from its edges """
+    degrees = Counter()
+    connectivities = Counter()
+    for node_a, node_b, w in edges:
+        degrees.update([node_a, node_b])
+        connectivities.update({node_a: w})
+        connectivities.update({node_b: w})
+    weights = Counter(w for node_a, node_b, w in edges)
+    weights[0] = n * (n - 1) // 2 - len(edges)
+    return {"w": {w: count for w, count in weights.items() if count > 0},
+            "k": dict(Counter(degrees.values())),
+            "c": dict(Counter(connectivities.values()))}
+
+def read_knc(classname, onemode):
+    """ Read the KNC plot points of a onemode graph """
+    return pd.read_csv(f"out/{classname}/{classname}.{onemode}.knc.csv")
+
+def use_options(monkeypatch, function_name, **options):
+    """ Call a function of project_graph with extra keyword options """
+    function = getattr(project_graph, function_name)
+    monkeypatch.setattr(project_graph, function_name, lambda *args: function(*args, **options))
+
+@pytest.mark.parametrize("graph", graphs)
+@pytest.mark.parametrize("project_method, function_name, options", [
+    ("sparse", "project_sparse_onemode", {}),
+    ("sparse", "project_sparse_onemode", {"block_size": 4}), # Several row blocks
+    ("inverted", "project_inverted_onemode", {}),
+    ("inverted", "project_inverted_onemode", {"hub_fraction": 0, "batch_size": 4}), # Dense hub rows, several batches
+    ("hyper", "project_hyper_onemode", {}),
+    ("hyper", "project_hyper_onemode", {"chunks_per_core": 1}),
+])
+def test_projection_matches_intersect_al(load_graph, monkeypatch, graph, project_method, function_name, options):
+    df = load_graph(graph)
+    project_graph.project_graph("test", graph, "intersect_al")
+    expected = {onemode: read_edges(graph, onemode) for onemode in "tb"}
+    use_options(monkeypatch, function_name, **options)
+    project_graph.project_graph("test", graph, project_method)
+    for onemode in "tb":
+        assert read_edges(graph, onemode) == expected[onemode]
+        assert read_distributions(graph, onemode) == get_distributions(expected[onemode], df[onemode].nunique())
+
+@pytest.mark.parametrize("project_method", ["hyper", "sparse", "inverted"])
+def test_discarded_edgelist_streams_knc(load_graph, monkeypatch, project_method):
+    load_graph("KaMusicians", "Saved")
+    load_graph("KaMusicians", "Streamed")
+    project_graph.project_graph("test", "Saved", project_method)
+    monkeypatch.setattr(project_graph, "el_max_nodes", 10) # Both onemode graphs have more nodes
+    project_graph.project_graph("test", "Streamed", project_method)
+    compute_knc("test", "Saved", project_method)
+    compute_knc("test", "Streamed", project_method)
+    for onemode in "tb":
+        assert not os.path.isfile(onemode_path("Streamed", onemode))
+        pd.testing.assert_frame_equal(read_knc("Streamed", onemode), read_knc("Saved", onemode))
+
+def test_hyper_streams_bounded_edge_blocks(load_graph, monkeypatch):
+    df = load_graph("KaMusicians")
+    monkeypatch.setattr(project_graph, "el_max_nodes", 10)
+    monkeypatch.setattr(project_graph, "hyper_block_edges", 8)
+    block_lens = []
+    update_knc_stream = project_graph.update_knc_stream
+    def record_block(knc_stream, rows, cols, weights):
+        block_lens.append(len(weights))
+        update_knc_stream(knc_stream, rows, cols, weights)
+    monkeypatch.setattr(project_graph, "update_knc_stream", record_block)
+    project_graph.project_graph("test", "KaMusicians", "hyper")
+    # A worker sends its edges once they reach the block size, the last row may add up to n - 1 edges
+    n = max(df["t"].nunique(), df["b"].nunique())
+    assert len(block_lens) > 2 and max(block_lens) <= 8 + n - 2
+    m = sum(int(results.get_result("test", "KaMusicians", f"m_{onemode}")) for onemode in "tb")
+    assert sum(block_lens) == m
+
+def test_hyper_bounds_edge_blocks_by_memory_limit(load_graph, monkeypatch):
+    load_graph("KaMusicians")
+    monkeypatch.setattr(project_graph, "el_max_nodes", 10)
+    blocks = []
+    update_knc_stream = project_graph.update_knc_stream
+    def record_block(knc_stream, rows, cols, weights):
+        blocks.append((len(np.unique(rows)), len(weights)))
+        update_knc_stream(knc_stream, rows, cols, weights)
+    monkeypatch.setattr(project_graph, "update_knc_stream", record_block)
+    # About 1 KB leaves no room for more than the edges of one row per block
+    project_graph.project_graph("test", "KaMusicians", "hyper", memory_limit=1e-6)
+    assert all(nrows == 1 for nrows, nedges in blocks)
+    m = sum(int(results.get_result("test", "KaMusicians", f"m_{onemode}")) for onemode in "tb")
+    assert sum(nedges for nrows, nedges in blocks) == m
+    assert len(blocks) > 2 * 8 # More blocks than chunks
+
+@pytest.mark.parametrize("project_method", ["hyper", "sparse", "inverted"])
+def test_spill_knc_stream_beyond_memory_limit(load_graph, monkeypatch, project_method):
+    load_graph("KaMusicians", "Saved")
+    load_graph("KaMusicians", "Spilled")
+    project_graph.project_graph("test", "Saved", project_method)
+    spilled = []
+    init_knc_stream = project_graph.init_knc_stream
+    def record_stream(n, spill=None):
+        spilled.append(spill is not None)
+        return init_knc_stream(n, spill)
+    monkeypatch.setattr(project_graph, "init_knc_stream", record_stream)
+    monkeypatch.setattr(project_graph, "el_max_nodes", 10)
+    # KNC streams of 11 nodes with weights up to 46 and 46 nodes with weights up to 11 take 2024 bytes, more than half of the limit
+    project_graph.project_graph("test", "Spilled", project_method, memory_limit=1e-6)
+    assert spilled == [True, True]
+    compute_knc("test", "Saved", project_method)
+    compute_knc("test", "Spilled", project_method)
+    for onemode in "tb":
+        pd.testing.assert_frame_equal(read_knc("Spilled", onemode), read_knc("Saved", onemode))
+
+def derive_class(superclass, classname, t_map):
+    """ Write the subgraph of the top nodes t_map of a superclass like a derived class of build_graph.py, Return its bot map """
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph(superclass)
+    keep = np.isin(t_codes, t_map)
+    b_map = np.unique(b_codes[keep])
+    os.makedirs(f"out/{classname}")
+    write_graph(classname, np.searchsorted(t_map, t_codes[keep]), np.searchsorted(b_map, b_codes[keep]),
+                [nodes_top[i] for i in t_map], [nodes_bot[i] for i in b_map])
+    results.add_results("test", classname, n_t=len(t_map), n_b=len(b_map))
+    return b_map
+
+def test_subclass_bots_match_their_own_projection(load_graph):
+    load_graph("KaMusicians", "Super")
+    # Overlapping subclasses, so top nodes fall into groups of different memberships
+    subclasses = []
+    for classname, t_map in [("Even", np.arange(0, 11, 2)), ("Head", np.arange(0, 6))]:
+        subclasses.append((classname, t_map, derive_class("Super", classname, t_map)))
+    project_graph.project_subclass_bots("test", "Super", subclasses)
+    derived = {classname: (read_edges(classname, "b"), read_distributions(classname, "b")) for classname, *maps in subclasses}
+    for classname, t_map, b_map in subclasses:
+        project_graph.project_graph("test", classname, "sparse")
+        assert (read_edges(classname, "b"), read_distributions(classname, "b")) == derived[classname]
@@ -0,0 +1,53 @@
+import pytest
+import numpy as np
+import multiprocessing as mp
+from graph_io import read_graph
+from random_graph import swap_edges, configure_edges, sample_null_graph, sample_null_graph_star
+
+def get_degrees(t_codes, b_codes, n_t, n_b):
+    """ Get the top and bot degree sequences of a bipartite edgelist """
+    return np.bincount(t_codes, minlength=n_t).tolist(), np.bincount(b_codes, minlength=n_b).tolist()
+
+def is_simple(t_codes, b_codes, n_b):
+    """ Check that no (t, b) pair repeats """
+    return len(np.unique(np.asarray(t_codes) * n_b + b_codes)) == len(t_codes)
+
+def test_swaps_keep_degrees_and_simple_graph(load_graph):
+    load_graph("KaMusicians")
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph("KaMusicians")
+    n_t, n_b = len(nodes_top), len(nodes_bot)
+    swapped_t, swapped_b, rate = swap_edges(np.random.default_rng(0), t_codes, b_codes, n_b, 10 * len(t_codes))
+    assert get_degrees(swapped_t, swapped_b, n_t, n_b) == get_degrees(t_codes, b_codes, n_t, n_b)
+    assert is_simple(swapped_t, swapped_b, n_b)
+    assert 0 < rate <= 1
+    assert set(zip(swapped_t, swapped_b)) != set(zip(t_codes, b_codes))
+
+def test_configuration_keeps_degrees_and_simple_graph(load_graph):
+    load_graph("Cluster")
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph("Cluster")
+    n_t, n_b = len(nodes_top), len(nodes_bot)
+    edges = configure_edges(np.random.default_rng(1), t_codes, b_codes, n_b, 1000)
+    assert edges is not None
+    assert get_degrees(*edges, n_t, n_b) == get_degrees(t_codes, b_codes, n_t, n_b)
+    assert is_simple(*edges, n_b)
+
+def test_configuration_gives_up_on_graphs_without_simple_pairing():
+    # A top node of degree 3 next to only two bot nodes has no simple pairing
+    assert configure_edges(np.random.default_rng(0), [0, 0, 0], [0, 1, 1], 2, 10) is None
+
+@pytest.mark.parametrize("null_model", ["swap", "configuration"])
+def test_samples_do_not_depend_on_processes(load_graph, null_model):
+    load_graph("KaMusicians")
+    sample_args = [("KaMusicians", sample, null_model, 5, 7) for sample in range(4)]
+    samples = {}
+    for processes in [1, 3]:
+        with mp.Pool(processes) as pool:
+            for null_classname, n_t, n_b, m_g, rate in pool.imap_unordered(sample_null_graph_star, sample_args):
+                t_codes, b_codes, nodes_top, nodes_bot = read_graph(null_classname)
+                samples.setdefault(processes, {})[null_classname] = sorted(zip(t_codes.tolist(), b_codes.tolist()))
+    assert samples[1] == samples[3]
+    # Samples of one seed differ from each other and from another seed
+    assert len({tuple(edges) for edges in samples[1].values()}) == 4
+    sample_null_graph("KaMusicians", 0, null_model, 5, 8)
+    t_codes, b_codes, nodes_top, nodes_bot = read_graph("KaMusiciansRandom0")
+    assert sorted(zip(t_codes.tolist(), b_codes.tolist())) != samples[1]["KaMusiciansRandom0"]
@@ -0,0 +1,27 @@
+import pandas as pd
+from results import add_results, get_result, export_csv, csv_path
+
+def test_migrated_legacy_columns_are_kept_next_to_new_results(workdir):
+    # Columns of a results file exported by analyze_knc.py before the database, and of the baseline build
+    pd.DataFrame({
+        "n_t": [60, 40], "k_t": [3.0, 2.5], "k_t_om": [20.0, 10.0],
+        "dens_t": [0.5, 0.4], "ndisc_t": [2, 1], "rc_dens_t": [0.25, 0.2],
+    }, index=["Updated", "Legacy"]).to_csv(csv_path("test"))
+    # The first access migrates the csv file under the names of the results in the database
+    assert get_result("test", "Legacy", "k_t_g") == 2.5
+    assert get_result("test", "Legacy", "rc_t_dens") == 0.2
+    add_results("test", "Updated", k_t_g=4.0, rc_t_dens=0.75, m_t=12)
+    export_csv("test")
+
+    res = pd.read_csv(csv_path("test"), index_col=0)
+    assert list(res.columns) == ["n_t", "k_t_g", "ndisc_t", "m_t", "dens_t", "k_mean_t", "rc_dens_t"]
+    assert pd.isna(res.loc["Legacy", "m_t"])
+    assert res.loc["Legacy", ["n_t", "k_t_g", "ndisc_t", "dens_t", "k_mean_t", "rc_dens_t"]].tolist() == [40, 2.5, 1, 0.4, 10.0, 0.2]
+    assert res.loc["Updated"].tolist() == [60, 4.0, 2, 12, 0.5, 20.0, 0.75]
+
+def test_export_renames_and_orders_results(workdir):
+    add_results("test", "X", rc_t_dens=0.5, m_t=1, n_b=2, n_t=3, unknown=7)
+    export_csv("test")
+    res = pd.read_csv(csv_path("test"), index_col=0)
+    assert list(res.columns) == ["n_t", "n_b", "m_t", "rc_dens_t"]
+    assert res.loc["X"].tolist() == [3, 2, 1, 0.5]
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+from graph_io import onemode_path, read_biadjacency, read_onemode_edgelist
+from sketch import get_sketch_edges
+from project_graph import project_graph
+from compute_knc import compute_knc
+from analyze_knc import analyze_knc
+from results import get_result
+
+def test_sketch_finds_heavy_pairs_with_exact_weights(load_graph):
+    load_graph("KaMusicians")
+    project_graph("test", "KaMusicians", "sparse")
+    biadjmatrix, _, _ = read_biadjacency("KaMusicians")
+    for onemode, matrix in [("t", biadjmatrix), ("b", biadjmatrix.T.tocsr())]:
+        exact = {(a, b, w) for a, b, w in read_onemode_edgelist("KaMusicians", onemode).tolist() if w >= 3}
+        edges, candidates = get_sketch_edges(matrix, 3)
+        # Found pairs are heavy pairs with their exact weight, with 64 bands of 2 rows all of them on this small graph
+        assert {(a, b, w) for a, b, w in edges.tolist()} == exact
+        assert candidates >= len(exact)
+
+def test_analyze_sketched_class_from_first_measured_k(load_graph):
+    # Exact plots of one class, sketched plots of the same graph without its onemode edgelists
+    for classname in ["Exact", "Sketched"]:
+        load_graph("KaMusicians", classname)
+        project_graph("test", classname, "sparse")
+    for onemode in "tb":
+        os.remove(onemode_path("Sketched", onemode))
+    compute_knc("test", "Exact", "sparse")
+    compute_knc("test", "Sketched", "sparse", sketch_min_weight=3)
+    analyze_knc("test", ["Exact", "Sketched"])
+
+    for onemode in "tb":
+        exact = pd.read_csv(f"out/Exact/Exact.{onemode}.knc.csv")
+        sketched = pd.read_csv(f"out/Sketched/Sketched.{onemode}.knc.csv")
+        assert sketched[["ncomponents", "slcc"]][:2].isna().all().all()
+        # All heavy pairs were found, so the sketched plot equals the exact plot from k = 3 on
+        pd.testing.assert_frame_equal(sketched[2:], exact[2:], check_dtype=False)
+        # Its RCs are the means over k >= 3 of the exact curve
+        n = get_result("test", "Exact", f"n_{onemode}")
+        rc_ncomp = ((n - exact["ncomponents"][2:]) / (n - 1)).mean()
+        rc_slcc = ((exact["slcc"][2:] - 1) / (n - 1)).mean()
+        assert np.isclose(get_result("test", "Sketched", f"rc_{onemode}_ncomp"), rc_ncomp)
+        assert np.isclose(get_result("test", "Sketched", f"rc_{onemode}_slcc"), rc_slcc)
+        assert get_result("test", "Sketched", f"knee_ncomp_{onemode}") >= 3
+        assert np.isclose(get_result("test", "Sketched", f"rc_{onemode}_dens"), get_result("test", "Exact", f"rc_{onemode}_dens"))
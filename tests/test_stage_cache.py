@@ -0,0 +1,44 @@
+import os
+import pytest
+import pandas as pd
+import project_graph
+import results
+from compute_knc import compute_knc
+from graph_io import onemode_path, read_distribution
+from stage_cache import start_stage, store_stage, restore_stage, read_stage_key
+
+def project_stage(classname, key):
+    """ Run the project stage of a class under a cache key like project_graph.py """
+    snapshot = start_stage(classname)
+    project_graph.project_graph("test", classname, "sparse")
+    store_stage("project", classname, key, snapshot)
+
+def read_knc(classname, onemode):
+    """ Compute and read the KNC plot points of a onemode graph """
+    compute_knc("test", classname, "sparse")
+    return pd.read_csv(f"out/{classname}/{classname}.{onemode}.knc.csv")
+
+def test_restore_gives_artifacts_and_results_of_cached_run(load_graph):
+    load_graph("KaMusicians")
+    project_stage("KaMusicians", "exact")
+    weights = read_distribution("KaMusicians", "t", "w")
+    m_t = results.get_result("test", "KaMusicians", "m_t")
+    os.remove("out/KaMusicians/KaMusicians.t.w.npy")
+    results.add_results("test", "KaMusicians", m_t=0)
+    assert restore_stage("test", "project", "KaMusicians", "exact")
+    assert read_distribution("KaMusicians", "t", "w") == weights
+    assert results.get_result("test", "KaMusicians", "m_t") == m_t
+    assert read_stage_key("project", "KaMusicians") == "exact"
+
+@pytest.mark.parametrize("key", ["saved", None])
+def test_restore_removes_artifacts_of_previous_run(load_graph, monkeypatch, key):
+    load_graph("KaMusicians")
+    with monkeypatch.context() as patch:
+        patch.setattr(project_graph, "el_max_nodes", 10)
+        project_stage("KaMusicians", "streamed")
+    streamed = read_knc("KaMusicians", "b")
+    # The saved edgelists of a run with another key, or without a key, are not part of the streamed run
+    project_stage("KaMusicians", key)
+    assert restore_stage("test", "project", "KaMusicians", "streamed")
+    assert not os.path.isfile(onemode_path("KaMusicians", "b"))
+    pd.testing.assert_frame_equal(read_knc("KaMusicians", "b"), streamed)